@@ -0,0 +1,250 @@
+"""列式导出（Parquet / Arrow IPC），供研究分析直接用 pandas / polars 读取。
+
+- 依赖可选的 pyarrow；未安装时 available() 为 False，接口返回 501。
+- 按 rowid 递增分页读取并逐批写入临时文件，内存占用与表大小无关。
+- 增量：调用方传入上次返回的 watermark（rowid），只导出之后新增的行。
+  stories 等会被更新的表，watermark 只覆盖新增行，不包含已有行的后续修改。
+- telemetry 的 payload JSON 按顶层键展开为 payload.<key> 列；类型由 SQLite
+  json_each 预先统计，混合类型或对象/数组统一为字符串（JSON）。
+"""
+import json
+import os
+import tempfile
+from typing import Any, Optional
+
+from database import get_read_db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pragma: no cover - 可选依赖
+    pa = None
+    pc = None
+    pa_ipc = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 可选依赖
+    pq = None
+
+# 导出名 → (表名, [(列名, 类型)], 需要展开的 JSON 列)
+TABLES: dict[str, tuple[str, list[tuple[str, str]], Optional[str]]] = {
+    "telemetry": (
+        "telemetry_events",
+        [
+            ("event_id", "string"),
+            ("session_id", "string"),
+            ("story_id", "string"),
+            ("page_id", "string"),
+            ("event_type", "string"),
+            ("ts_client_ms", "int64"),
+            ("created_at", "timestamp"),
+        ],
+        "payload",
+    ),
+    "sessions": (
+        "sessions",
+        [
+            ("session_id", "string"),
+            ("story_id", "string"),
+            ("child_id", "string"),
+            ("session_index", "int64"),
+            ("status", "string"),
+            ("created_at", "timestamp"),
+        ],
+        None,
+    ),
+    "feedback": (
+        "feedback",
+        [
+            ("id", "int64"),
+            ("session_id", "string"),
+            ("status", "string"),
+            ("try_level", "string"),
+            ("abort_reason", "string"),
+            ("notes", "string"),
+            ("created_at", "timestamp"),
+        ],
+        None,
+    ),
+    "sus": (
+        "sus_responses",
+        [
+            ("id", "int64"),
+            ("session_id", "string"),
+            ("answers", "string"),
+            ("sus_score", "float64"),
+            ("created_at", "timestamp"),
+        ],
+        None,
+    ),
+    "stories": (
+        "stories",
+        [
+            ("story_id", "string"),
+            ("parent_story_id", "string"),
+            ("child_id", "string"),
+            ("regen_count", "int64"),
+            ("title", "string"),
+            ("summary", "string"),
+            ("theme_food", "string"),
+            ("story_type", "string"),
+            ("page_count", "int64"),
+            ("created_at", "timestamp"),
+        ],
+        None,
+    ),
+}
+
+# json_each 的 type → 统一类型
+_JSON_TYPE_MAP = {
+    "integer": "int64",
+    "real": "float64",
+    "text": "string",
+    "true": "bool",
+    "false": "bool",
+    "object": "json",
+    "array": "json",
+}
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def _page_size() -> int:
+    return max(1, int(os.getenv("EXPORT_COLUMNAR_PAGE_SIZE", "50000")))
+
+
+def _arrow_type(kind: str):
+    return {
+        "string": pa.string(),
+        "json": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("s"),
+    }[kind]
+
+
+def _payload_columns(
+    db, table: str, json_column: str, after_rowid: int, until_rowid: int, max_rows: int
+) -> list[tuple[str, str]]:
+    """扫描本次将导出的行（after_rowid < rowid <= until_rowid 的前 max_rows 行）的 JSON 键与类型。"""
+    rows = db.execute(
+        f"""SELECT j.key AS key, GROUP_CONCAT(DISTINCT j.type) AS types
+            FROM (SELECT {json_column} AS doc FROM {table}
+                  WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?) AS t,
+                 json_each(t.doc) AS j
+            WHERE json_valid(t.doc) AND json_type(t.doc) = 'object' AND j.type != 'null'
+            GROUP BY j.key ORDER BY j.key""",
+        (after_rowid, until_rowid, max_rows),
+    ).fetchall()
+    columns = []
+    for row in rows:
+        kinds = {_JSON_TYPE_MAP.get(t, "json") for t in (row["types"] or "").split(",") if t}
+        if kinds == {"int64", "float64"}:
+            kind = "float64"
+        elif len(kinds) == 1:
+            kind = kinds.pop()
+        else:
+            kind = "json"
+        columns.append((f"{json_column}.{row['key']}", kind))
+    return columns
+
+
+def _coerce_json_value(value: Any, kind: str) -> Any:
+    if value is None:
+        return None
+    if kind == "json":
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    if kind == "float64":
+        return float(value)
+    return value
+
+
+def _build_batch(rows, base_columns, json_column, payload_columns, schema):
+    arrays = []
+    for name, kind in base_columns:
+        values = [row[name] for row in rows]
+        if kind == "timestamp":
+            arrays.append(pc.strptime(pa.array(values, pa.string()), format="%Y-%m-%d %H:%M:%S", unit="s"))
+        else:
+            arrays.append(pa.array(values, _arrow_type(kind)))
+    if json_column:
+        parsed = []
+        for row in rows:
+            try:
+                payload = json.loads(row[json_column]) if row[json_column] else {}
+            except Exception:
+                payload = {}
+            parsed.append(payload if isinstance(payload, dict) else {})
+        prefix = len(json_column) + 1
+        for name, kind in payload_columns:
+            key = name[prefix:]
+            values = [_coerce_json_value(p.get(key), kind) for p in parsed]
+            arrays.append(pa.array(values, _arrow_type(kind)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_table(
+    name: str,
+    fmt: str,
+    *,
+    after_rowid: int = 0,
+    max_rows: Optional[int] = None,
+) -> tuple[str, dict]:
+    """导出 rowid > after_rowid 的行到临时文件，返回 (path, info)。
+
+    info: format / rows / watermark（本次最大 rowid，下次作为 after_rowid）/ has_more。
+    列扫描与 MAX(rowid) 在同一读事务中取得快照，分页读取只到快照上限，扫描之后新写入的行
+    留给下一次导出，不会以不匹配的 schema 导出或被水位线跳过。调用方负责删除临时文件。
+    """
+    table, base_columns, json_column = TABLES[name]
+    if fmt == "parquet" and not parquet_available():
+        fmt = "arrow"
+    max_rows = max_rows or int(os.getenv("EXPORT_COLUMNAR_MAX_ROWS", "2000000"))
+    page_size = min(_page_size(), max_rows)
+
+    with get_read_db() as db:
+        snapshot_max = db.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+        payload_columns = (
+            _payload_columns(db, table, json_column, after_rowid, snapshot_max, max_rows) if json_column else []
+        )
+    schema = pa.schema([(n, _arrow_type(k)) for n, k in base_columns + payload_columns])
+    select_columns = [n for n, _ in base_columns] + ([json_column] if json_column else [])
+
+    suffix = ".parquet" if fmt == "parquet" else ".arrow"
+    fd, path = tempfile.mkstemp(prefix=f"sggg_export_{name}_", suffix=suffix)
+    os.close(fd)
+    writer = pq.ParquetWriter(path, schema, compression="zstd") if fmt == "parquet" else pa_ipc.new_file(path, schema)
+    watermark = after_rowid
+    exported = 0
+    try:
+        while exported < max_rows:
+            limit = min(page_size, max_rows - exported)
+            with get_read_db() as db:
+                rows = db.execute(
+                    f"SELECT rowid AS _rowid, {', '.join(select_columns)} FROM {table} "
+                    "WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                    (watermark, snapshot_max, limit),
+                ).fetchall()
+            if not rows:
+                break
+            writer.write_batch(_build_batch(rows, base_columns, json_column, payload_columns, schema))
+            exported += len(rows)
+            watermark = rows[-1]["_rowid"]
+            if len(rows) < limit:
+                break
+        has_more = exported >= max_rows and watermark < snapshot_max
+    except Exception:
+        writer.close()
+        os.remove(path)
+        raise
+    writer.close()
+    return path, {"format": fmt, "rows": exported, "watermark": watermark, "has_more": has_more}
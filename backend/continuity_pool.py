@@ -0,0 +1,270 @@
+"""连续性模块（story_arc / summarize）的常驻 worker 进程池。
+
+每个 worker 进程只在启动时导入 story_arc_module / summarizer_module，
+因此静态 JSON 库与 AzureOpenAI client 在进程生命周期内复用。父进程通过
+Pipe 发送 JSON 任务并接收结果（连同 token 用量记录，由父进程写入 usage_store）；worker 处理 CONTINUITY_POOL_MAX_JOBS_PER_WORKER
+个任务后回收重建，超时或崩溃的 worker 会被直接终止并替换。
+"""
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from typing import Any, Optional
+
+import usage_store
+from episode_engine import build_azure_compat_env
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _worker_main(conn, env: dict[str, str]) -> None:
+    """worker 进程入口：导入模块一次，循环处理任务直到收到 None 或管道关闭。"""
+    os.environ.update(env)
+    if _MODULE_DIR not in sys.path:
+        sys.path.insert(0, _MODULE_DIR)
+    modules: dict[str, Any] = {}
+    static_libraries: Optional[dict[str, Any]] = None
+
+    def load():
+        nonlocal static_libraries
+        if not modules:
+            import story_arc_module
+            import summarizer_module
+            modules["story_arc"] = story_arc_module
+            modules["summarize"] = summarizer_module
+            static_libraries = story_arc_module.load_static_libraries()
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        try:
+            load()
+            task = job.get("task")
+            payload = job.get("payload") or {}
+            usage: list[dict[str, Any]] = []
+            if task == "story_arc":
+                result = modules["story_arc"].generate_story_arc_framework(
+                    payload.get("user_profile") or {},
+                    **static_libraries,
+                    on_usage=usage.append,
+                )
+            elif task == "summarize":
+                result = modules["summarize"].summarize_previous_episodes(
+                    payload.get("previous_blocks", []),
+                    payload.get("story_framework"),
+                    on_usage=usage.append,
+                )
+            else:
+                raise ValueError(f"unknown continuity task: {task!r}")
+            conn.send({"ok": True, "result": result, "usage": usage})
+        except Exception as e:
+            conn.send({"ok": False, "error": str(e) or e.__class__.__name__})
+
+
+class _Worker:
+    def __init__(self, ctx):
+        parent_conn, child_conn = ctx.Pipe()
+        self.conn = parent_conn
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, build_azure_compat_env()),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(timeout=2)
+        self.conn.close()
+
+
+class ContinuityWorkerPool:
+    def __init__(self, size: int, max_jobs_per_worker: int, timeout_sec: int):
+        self.size = max(1, size)
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.timeout_sec = timeout_sec
+        self._ctx = mp.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._idle: list[_Worker] = []
+        self._busy = 0
+        self._closed = False
+        self._stats = {
+            "spawned": 0,
+            "recycled": 0,
+            "killed": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+        }
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx)
+        with self._lock:
+            self._stats["spawned"] += 1
+        return worker
+
+    def prestart(self) -> None:
+        """预先拉起全部 worker，避免首批请求承担进程启动成本。"""
+        with self._lock:
+            missing = self.size - len(self._idle) - self._busy
+        for _ in range(max(0, missing)):
+            worker = self._spawn()
+            with self._lock:
+                self._idle.append(worker)
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    self._busy += 1
+                    return worker
+                self._stats["killed"] += 1
+            self._busy += 1
+        try:
+            return self._spawn()
+        except Exception:
+            with self._lock:
+                self._busy -= 1
+            raise
+
+    def _checkin(self, worker: _Worker, *, discard: bool = False) -> None:
+        recycle = not discard and worker.jobs >= self.max_jobs_per_worker
+        with self._lock:
+            self._busy -= 1
+            if discard:
+                self._stats["killed"] += 1
+            elif recycle:
+                self._stats["recycled"] += 1
+            elif not self._closed:
+                self._idle.append(worker)
+                return
+        if discard:
+            worker.kill()
+        else:
+            worker.stop()
+
+    def run(self, task: str, payload: dict[str, Any]) -> Any:
+        if not self._slots.acquire(timeout=self.timeout_sec):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise RuntimeError("continuity worker pool busy")
+        try:
+            worker = self._checkout()
+            try:
+                worker.conn.send({"task": task, "payload": payload})
+                ready = worker.conn.poll(self.timeout_sec)
+                reply = worker.conn.recv() if ready else None
+            except (EOFError, OSError) as e:
+                self._checkin(worker, discard=True)
+                raise RuntimeError(f"continuity worker crashed: {e}")
+            if reply is None:
+                self._checkin(worker, discard=True)
+                raise TimeoutError(f"continuity {task} timed out after {self.timeout_sec}s")
+            worker.jobs += 1
+            self._checkin(worker)
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self._stats["completed" if reply.get("ok") else "failed"] += 1
+        for record in reply.get("usage") or []:
+            usage_store.record(record)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error") or "continuity module execution failed")
+        return reply.get("result")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "maxJobsPerWorker": self.max_jobs_per_worker,
+                "idle": len(self._idle),
+                "busy": self._busy,
+                **self._stats,
+            }
+
+
+_pool: Optional[ContinuityWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ContinuityWorkerPool:
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ContinuityWorkerPool(
+                size=int(os.getenv("CONTINUITY_POOL_SIZE", "2")),
+                max_jobs_per_worker=int(os.getenv("CONTINUITY_POOL_MAX_JOBS_PER_WORKER", "50")),
+                timeout_sec=int(os.getenv("CONTINUITY_MODULE_TIMEOUT_SEC", "180")),
+            )
+        return _pool
+
+
+def run_story_arc(user_profile: dict[str, Any]) -> Any:
+    return get_pool().run("story_arc", {"user_profile": user_profile})
+
+
+def run_summarize(previous_blocks: list[Any], story_framework: Optional[dict[str, Any]]) -> Any:
+    return get_pool().run(
+        "summarize",
+        {"previous_blocks": previous_blocks, "story_framework": story_framework},
+    )
+
+
+def warm_up() -> None:
+    """后台预热 worker 进程，不阻塞服务启动。"""
+    def _prestart():
+        started = time.monotonic()
+        try:
+            get_pool().prestart()
+            print(f"[INFO] continuity_pool ready in {(time.monotonic() - started) * 1000:.0f}ms")
+        except Exception as e:
+            print(f"[WARN] continuity_pool warm-up skipped: {e}")
+
+    threading.Thread(target=_prestart, daemon=True).start()
+
+
+def shutdown() -> None:
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close()
+
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        pool = _pool
+    if pool is None:
+        return {"started": False}
+    return {"started": True, **pool.stats()}
@@ -1,9 +1,148 @@
+import os
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
 
 DB_PATH = "storybook.db"
 
 
+# 版本化迁移：按 version 递增执行，当前版本记录在 PRAGMA user_version。
+# 只追加新版本，不修改已发布的条目；语句需可重复执行（IF NOT EXISTS）。
+_MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, "stories meta indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_stories_child_id ON stories(child_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stories_theme_food ON stories(theme_food)",
+        "CREATE INDEX IF NOT EXISTS idx_stories_story_type ON stories(story_type)",
+    ]),
+    (2, "sessions / telemetry / admin export indexes", [
+        # session_start 的 COUNT(*) WHERE child_id 与 export_child_data 的 ORDER BY session_index
+        "CREATE INDEX IF NOT EXISTS idx_sessions_child_id ON sessions(child_id, session_index)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at)",
+        # get_telemetry_stats：GROUP BY event_type 与 COUNT(DISTINCT session_id)/AVG(ts_client_ms) 走覆盖索引
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_event_type ON telemetry_events(event_type)",
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_session_id ON telemetry_events(session_id, ts_client_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_created_at ON telemetry_events(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stories_created_at ON stories(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_sus_responses_created_at ON sus_responses(created_at)",
+        "ANALYZE",
+    ]),
+    (3, "admin stats summary tables", [
+        # 计数器 / 分布由 stats_store 读取；sessions / feedback / sus 由触发器随写入维护，
+        # telemetry 写入量大，由 stats_store.refresh_telemetry 按 rowid 水位增量汇总。
+        """CREATE TABLE IF NOT EXISTS stats_counters (
+               name  TEXT PRIMARY KEY,
+               value REAL NOT NULL DEFAULT 0
+           )""",
+        """CREATE TABLE IF NOT EXISTS stats_dist (
+               dimension TEXT NOT NULL,
+               value     TEXT NOT NULL,
+               cnt       INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (dimension, value)
+           )""",
+        "CREATE TABLE IF NOT EXISTS stats_telemetry_sessions (session_id TEXT PRIMARY KEY)",
+        """CREATE TABLE IF NOT EXISTS stats_watermarks (
+               source     TEXT PRIMARY KEY,
+               last_rowid INTEGER NOT NULL DEFAULT 0
+           )""",
+        # 回填现有数据（与触发器在同一事务内创建）
+        """INSERT OR REPLACE INTO stats_counters (name, value)
+           SELECT 'sessions.total', COUNT(*) FROM sessions
+           UNION ALL SELECT 'sessions.completed', COUNT(*) FROM sessions WHERE status = 'COMPLETED'
+           UNION ALL SELECT 'sessions.aborted', COUNT(*) FROM sessions WHERE status = 'ABORTED'
+           UNION ALL SELECT 'feedback.total', COUNT(*) FROM feedback
+           UNION ALL SELECT 'sus.count', COUNT(*) FROM sus_responses
+           UNION ALL SELECT 'sus.score_sum', COALESCE(SUM(sus_score), 0) FROM sus_responses
+           UNION ALL SELECT 'sus.score_count', COUNT(sus_score) FROM sus_responses
+           UNION ALL SELECT 'sus.low', COUNT(*) FROM sus_responses WHERE sus_score < 50
+           UNION ALL SELECT 'sus.mid', COUNT(*) FROM sus_responses WHERE sus_score >= 50 AND sus_score < 70
+           UNION ALL SELECT 'sus.high', COUNT(*) FROM sus_responses WHERE sus_score >= 70
+           UNION ALL SELECT 'telemetry.total', 0
+           UNION ALL SELECT 'telemetry.ts_sum', 0
+           UNION ALL SELECT 'telemetry.ts_count', 0
+           UNION ALL SELECT 'telemetry.unique_sessions', 0""",
+        """INSERT OR REPLACE INTO stats_dist (dimension, value, cnt)
+           SELECT 'try_level', try_level, COUNT(*) FROM feedback WHERE try_level IS NOT NULL GROUP BY try_level
+           UNION ALL
+           SELECT 'abort_reason', abort_reason, COUNT(*) FROM feedback WHERE abort_reason IS NOT NULL GROUP BY abort_reason""",
+        "INSERT OR REPLACE INTO stats_watermarks (source, last_rowid) VALUES ('telemetry_events', 0)",
+        """CREATE TRIGGER IF NOT EXISTS trg_stats_sessions_insert AFTER INSERT ON sessions
+           BEGIN
+               UPDATE stats_counters SET value = value + CASE name
+                   WHEN 'sessions.total' THEN 1
+                   WHEN 'sessions.completed' THEN NEW.status = 'COMPLETED'
+                   WHEN 'sessions.aborted' THEN NEW.status = 'ABORTED'
+               END
+               WHERE name IN ('sessions.total', 'sessions.completed', 'sessions.aborted');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_stats_sessions_status AFTER UPDATE OF status ON sessions
+           WHEN OLD.status IS NOT NEW.status
+           BEGIN
+               UPDATE stats_counters SET value = value + CASE name
+                   WHEN 'sessions.completed' THEN (NEW.status = 'COMPLETED') - (OLD.status = 'COMPLETED')
+                   WHEN 'sessions.aborted' THEN (NEW.status = 'ABORTED') - (OLD.status = 'ABORTED')
+               END
+               WHERE name IN ('sessions.completed', 'sessions.aborted');
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_stats_feedback_insert AFTER INSERT ON feedback
+           BEGIN
+               UPDATE stats_counters SET value = value + 1 WHERE name = 'feedback.total';
+               INSERT INTO stats_dist (dimension, value, cnt)
+                   SELECT 'try_level', NEW.try_level, 1 WHERE NEW.try_level IS NOT NULL
+                   ON CONFLICT (dimension, value) DO UPDATE SET cnt = cnt + 1;
+               INSERT INTO stats_dist (dimension, value, cnt)
+                   SELECT 'abort_reason', NEW.abort_reason, 1 WHERE NEW.abort_reason IS NOT NULL
+                   ON CONFLICT (dimension, value) DO UPDATE SET cnt = cnt + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_stats_sus_insert AFTER INSERT ON sus_responses
+           BEGIN
+               UPDATE stats_counters SET value = value + CASE name
+                   WHEN 'sus.count' THEN 1
+                   WHEN 'sus.score_sum' THEN COALESCE(NEW.sus_score, 0)
+                   WHEN 'sus.score_count' THEN NEW.sus_score IS NOT NULL
+                   WHEN 'sus.low' THEN COALESCE(NEW.sus_score < 50, 0)
+                   WHEN 'sus.mid' THEN COALESCE(NEW.sus_score >= 50 AND NEW.sus_score < 70, 0)
+                   WHEN 'sus.high' THEN COALESCE(NEW.sus_score >= 70, 0)
+               END
+               WHERE name IN ('sus.count', 'sus.score_sum', 'sus.score_count', 'sus.low', 'sus.mid', 'sus.high');
+           END""",
+    ]),
+    (4, "llm usage accounting", [
+        # 每次 LLM 调用一行（usage_store.record）；cached_tokens 为上游 prompt 缓存命中的 token 数
+        """CREATE TABLE IF NOT EXISTS llm_usage (
+               id                INTEGER PRIMARY KEY AUTOINCREMENT,
+               kind              TEXT NOT NULL,
+               model             TEXT,
+               story_id          TEXT,
+               prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+               cached_tokens     INTEGER NOT NULL DEFAULT 0,
+               completion_tokens INTEGER NOT NULL DEFAULT 0,
+               latency_ms        REAL,
+               created_at        TEXT NOT NULL DEFAULT (datetime('now'))
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage(created_at, kind)",
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_story_id ON llm_usage(story_id)",
+    ]),
+]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _apply_migrations(conn) -> None:
+    current = get_schema_version(conn)
+    for version, name, statements in _MIGRATIONS:
+        if version <= current:
+            continue
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        print(f"[INFO] db migration applied version={version} ({name})")
+
+
 def init_db():
     with get_db() as conn:
         conn.executescript("""
@@ -13,9 +152,33 @@ def init_db():
                 child_id        TEXT,
                 regen_count     INTEGER NOT NULL DEFAULT 0,
                 story_json      TEXT NOT NULL,
+                title           TEXT,
+                summary         TEXT,
+                theme_food      TEXT,
+                story_type      TEXT,
+                page_count      INTEGER NOT NULL DEFAULT 0,
                 created_at      TEXT NOT NULL DEFAULT (datetime('now'))
             );
 
+            CREATE TABLE IF NOT EXISTS story_pages (
+                story_id              TEXT NOT NULL,
+                page_index            INTEGER NOT NULL,
+                page_id               TEXT,
+                page_json             TEXT NOT NULL,
+                image_url             TEXT,
+                interaction_image_url TEXT,
+                audio_json            TEXT,
+                renditions_json       TEXT,
+                PRIMARY KEY (story_id, page_index)
+            );
+
+            CREATE TABLE IF NOT EXISTS story_assets (
+                story_id   TEXT NOT NULL,
+                kind       TEXT NOT NULL,
+                asset_json TEXT NOT NULL,
+                PRIMARY KEY (story_id, kind)
+            );
+
             CREATE TABLE IF NOT EXISTS sessions (
                 session_id           TEXT PRIMARY KEY,
                 story_id             TEXT NOT NULL,
@@ -48,6 +211,23 @@ def init_db():
                 created_at   TEXT NOT NULL DEFAULT (datetime('now'))
             );
 
+            CREATE TABLE IF NOT EXISTS story_jobs (
+                job_id      TEXT PRIMARY KEY,
+                story_id    TEXT NOT NULL,
+                child_id    TEXT,
+                kind        TEXT NOT NULL,
+                status      TEXT NOT NULL DEFAULT 'QUEUED',
+                stage       TEXT NOT NULL DEFAULT 'queued',
+                progress    REAL NOT NULL DEFAULT 0,
+                error_code  TEXT,
+                error       TEXT,
+                created_at  TEXT NOT NULL DEFAULT (datetime('now')),
+                updated_at  TEXT NOT NULL DEFAULT (datetime('now')),
+                finished_at TEXT
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_story_jobs_story_id ON story_jobs(story_id);
+
             CREATE TABLE IF NOT EXISTS sus_responses (
                 id         INTEGER PRIMARY KEY AUTOINCREMENT,
                 session_id TEXT UNIQUE NOT NULL,
@@ -59,6 +239,13 @@ def init_db():
         # 迁移旧数据库（列已存在则忽略）
         for sql in [
             "ALTER TABLE stories ADD COLUMN child_id TEXT",
+            "ALTER TABLE stories ADD COLUMN title TEXT",
+            "ALTER TABLE stories ADD COLUMN summary TEXT",
+            "ALTER TABLE stories ADD COLUMN theme_food TEXT",
+            "ALTER TABLE stories ADD COLUMN story_type TEXT",
+            "ALTER TABLE stories ADD COLUMN page_count INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE story_pages ADD COLUMN audio_json TEXT",
+            "ALTER TABLE story_pages ADD COLUMN renditions_json TEXT",
             "ALTER TABLE sessions ADD COLUMN child_id TEXT",
             "ALTER TABLE sessions ADD COLUMN session_index INTEGER NOT NULL DEFAULT 0",
         ]:
@@ -66,114 +253,181 @@ def init_db():
                 conn.execute(sql)
             except Exception:
                 pass
+        _apply_migrations(conn)
+        # 旧版整本 story_json 拆分到 story_pages / story_assets
+        from story_store import migrate_legacy_stories
+        migrated = migrate_legacy_stories(conn)
+        if migrated:
+            print(f"[INFO] story_store migrated legacy stories count={migrated}")
 
 
-def get_backend_stats() -> dict:
-    """Aggregate stats from sessions, feedback, sus_responses for admin dashboard."""
-    with get_db() as conn:
-        row = conn.execute("""
-            SELECT
-                COUNT(*) as total,
-                SUM(CASE WHEN status = 'COMPLETED' THEN 1 ELSE 0 END) as completed,
-                SUM(CASE WHEN status = 'ABORTED' THEN 1 ELSE 0 END) as aborted
-            FROM sessions
-        """).fetchone()
-        total = row["total"] or 0
-        sessions = {
-            "total": total,
-            "completed": row["completed"] or 0,
-            "aborted": row["aborted"] or 0,
-            "completedRate": round((row["completed"] or 0) / total * 100, 1) if total > 0 else 0,
-            "abortedRate": round((row["aborted"] or 0) / total * 100, 1) if total > 0 else 0,
-        }
-
-        try_levels = conn.execute("""
-            SELECT try_level, COUNT(*) as cnt
-            FROM feedback WHERE try_level IS NOT NULL
-            GROUP BY try_level
-        """).fetchall()
-        try_level_dist = {r["try_level"]: r["cnt"] for r in try_levels}
-
-        abort_reasons = conn.execute("""
-            SELECT abort_reason, COUNT(*) as cnt
-            FROM feedback WHERE abort_reason IS NOT NULL
-            GROUP BY abort_reason
-        """).fetchall()
-        abort_reason_dist = {r["abort_reason"]: r["cnt"] for r in abort_reasons}
-
-        sus_row = conn.execute("""
-            SELECT COUNT(*) as cnt, AVG(sus_score) as avg_score
-            FROM sus_responses
-        """).fetchone()
-        sus_dist = conn.execute("""
-            SELECT
-                SUM(CASE WHEN sus_score < 50 THEN 1 ELSE 0 END) as low,
-                SUM(CASE WHEN sus_score >= 50 AND sus_score < 70 THEN 1 ELSE 0 END) as mid,
-                SUM(CASE WHEN sus_score >= 70 THEN 1 ELSE 0 END) as high
-            FROM sus_responses
-        """).fetchone()
-        sus = {
-            "responseCount": sus_row["cnt"] or 0,
-            "avgScore": round(sus_row["avg_score"], 1) if sus_row["avg_score"] is not None else None,
-            "distribution": {
-                "low": sus_dist["low"] or 0,
-                "mid": sus_dist["mid"] or 0,
-                "high": sus_dist["high"] or 0,
-            },
-        }
-
-        feedback_count = conn.execute("SELECT COUNT(DISTINCT session_id) as cnt FROM feedback").fetchone()["cnt"] or 0
-        sus_count = sus_row["cnt"] or 0
-        completeness = {
-            "sessionsWithFeedback": feedback_count,
-            "sessionsWithFeedbackPct": round(feedback_count / total * 100, 1) if total > 0 else 0,
-            "sessionsWithSUS": sus_count,
-            "sessionsWithSUSPct": round(sus_count / total * 100, 1) if total > 0 else 0,
-        }
-
-        return {
-            "sessions": sessions,
-            "feedback": {"tryLevelDist": try_level_dist, "abortReasonDist": abort_reason_dist},
-            "sus": sus,
-            "completeness": completeness,
-        }
-
-
-def get_telemetry_stats() -> dict:
-    """Aggregate telemetry event stats for admin dashboard."""
-    with get_db() as conn:
-        row = conn.execute("""
-            SELECT
-                COUNT(*) as total_events,
-                COUNT(DISTINCT session_id) as unique_sessions,
-                AVG(ts_client_ms) as avg_dwell_ms
-            FROM telemetry_events
-        """).fetchone()
-
-        type_dist = conn.execute("""
-            SELECT event_type, COUNT(*) as cnt
-            FROM telemetry_events
-            GROUP BY event_type
-        """).fetchall()
-
-        return {
-            "totalEvents": row["total_events"] or 0,
-            "uniqueSessions": row["unique_sessions"] or 0,
-            "avgDwellMs": round(row["avg_dwell_ms"] or 0, 1),
-            "byType": {r["event_type"]: r["cnt"] for r in type_dist},
-        }
+class _ConnectionPool:
+    """线程安全的 SQLite 连接池：连接按需创建（上限 size），PRAGMA 只在建连时设置一次。"""
+
+    def __init__(self, path: str, size: int, *, readonly: bool):
+        self.path = path
+        self.size = max(1, size)
+        self.readonly = readonly
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._stats = {"acquired": 0, "waits": 0, "timeouts": 0, "discarded": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=busy_timeout_ms / 1000)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{int(os.getenv('DB_CACHE_SIZE_KB', '16384'))}")
+        conn.execute(f"PRAGMA mmap_size = {int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+                    self._stats["waits"] += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=float(os.getenv("DB_POOL_TIMEOUT_SEC", "10")))
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise sqlite3.OperationalError("database connection pool exhausted")
+        with self._lock:
+            self._in_use += 1
+            self._stats["acquired"] += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection, *, discard: bool = False) -> None:
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._created -= 1
+                self._stats["discarded"] += 1
+        if discard:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "inUse": self._in_use,
+                "idle": self._idle.qsize(),
+                **self._stats,
+            }
+
+
+_pools: dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(kind: str) -> _ConnectionPool:
+    pool = _pools.get(kind)
+    if pool is not None and pool.path == DB_PATH:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(kind)
+        # DB_PATH 在运行期被替换时（如测试/脚本），旧池作废重建
+        if pool is None or pool.path != DB_PATH:
+            if pool is not None:
+                pool.close()
+            # journal_mode 持久化在数据库文件中，建池时设置一次即可
+            conn = sqlite3.connect(DB_PATH)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+            if kind == "write":
+                size = int(os.getenv("DB_POOL_SIZE", "8"))
+            else:
+                size = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+            pool = _ConnectionPool(DB_PATH, size, readonly=(kind == "read"))
+            _pools[kind] = pool
+        return pool
 
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
+    pool = _get_pool("write")
+    conn = pool.acquire()
+    discard = False
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
         raise
     finally:
-        conn.close()
+        pool.release(conn, discard=discard)
+
+
+@contextmanager
+def get_read_db():
+    """只读连接（query_only），供 GET / 导出等纯读取路径使用，不占用写连接池。"""
+    pool = _get_pool("read")
+    conn = pool.acquire()
+    discard = False
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        pool.release(conn, discard=discard)
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def get_pool_stats() -> dict:
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        "path": DB_PATH,
+        **{kind: pool.stats() for kind, pool in pools.items()},
+    }
@@ -0,0 +1,316 @@
+"""Episode 生成引擎：进程内常驻调用 episode_module.generate_episode。
+
+默认模式（EPISODE_ENGINE_MODE=inprocess）下，episode_module 只导入一次，
+AzureOpenAI client 常驻复用，调用在有界线程池中执行并带单次超时。
+EPISODE_ENGINE_MODE=subprocess 时保留旧的“临时目录 + 子进程”隔离模式。
+"""
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+import episode_fixers
+import llm_usage
+from llm_usage import OnUsage
+
+_MODULE_DIR = Path(__file__).resolve().parent
+_AZURE_COMPAT_KEYS = (
+    "AZURE_OPENAI_API_KEY",
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_DEPLOYMENT",
+    "AZURE_OPENAI_API_VERSION",
+)
+
+OnPartial = Callable[[str, Optional[int], Any], None]
+# 工作线程超过 deadline 后最多还会等一次进行中的请求返回，调用方兜底多等这么久
+_DEADLINE_GRACE_SEC = 30
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_module: Any = None
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "in_flight": 0,
+    "streamed": 0,
+}
+
+
+def _engine_mode() -> str:
+    mode = (os.getenv("EPISODE_ENGINE_MODE") or "inprocess").strip().lower()
+    return "subprocess" if mode == "subprocess" else "inprocess"
+
+
+def _timeout_sec() -> int:
+    return int(os.getenv("EPISODE_MODULE_TIMEOUT_SEC", "300"))
+
+
+def _max_workers() -> int:
+    return max(1, int(os.getenv("EPISODE_ENGINE_MAX_WORKERS", "4")))
+
+
+def build_azure_compat_env() -> dict[str, str]:
+    env = os.environ.copy()
+    if not env.get("AZURE_OPENAI_API_KEY") and env.get("STORYTEXT_OPENAI_API_KEY"):
+        env["AZURE_OPENAI_API_KEY"] = env["STORYTEXT_OPENAI_API_KEY"]
+
+    storytext_uri = env.get("STORYTEXT_OPENAI_URI", "")
+    if not env.get("AZURE_OPENAI_ENDPOINT") and storytext_uri:
+        try:
+            parsed = urlparse(storytext_uri)
+            if parsed.scheme and parsed.netloc:
+                env["AZURE_OPENAI_ENDPOINT"] = f"{parsed.scheme}://{parsed.netloc}"
+            parts = [p for p in parsed.path.split("/") if p]
+            if not env.get("AZURE_OPENAI_DEPLOYMENT") and "deployments" in parts:
+                idx = parts.index("deployments")
+                if idx + 1 < len(parts):
+                    env["AZURE_OPENAI_DEPLOYMENT"] = parts[idx + 1]
+            if not env.get("AZURE_OPENAI_API_VERSION"):
+                q = parse_qs(parsed.query)
+                api_ver = q.get("api-version", [None])[0]
+                if api_ver:
+                    env["AZURE_OPENAI_API_VERSION"] = api_ver
+        except Exception:
+            pass
+    return env
+
+
+def _parse_last_json_line(stdout: str) -> Any:
+    lines = [line.strip() for line in stdout.splitlines() if line.strip()]
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except Exception:
+            continue
+    raise ValueError("No valid JSON found in episode module stdout")
+
+
+def _run_episode_module(cwd: str, code: str) -> Any:
+    proc = subprocess.run(
+        [os.getenv("PYTHON_EXECUTABLE") or sys.executable, "-c", code],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        env=build_azure_compat_env(),
+        timeout=_timeout_sec(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip() or proc.stdout.strip() or "episode module execution failed")
+    return _parse_last_json_line(proc.stdout)
+
+
+def _run_subprocess(payload: dict[str, Any], on_usage: Optional[OnUsage] = None) -> Any:
+    """隔离模式：复制模块到临时目录，在新解释器中执行一次生成。"""
+    required_files = [
+        "episode_module.py",
+        "episode_fixers.py",
+        "episode_stream.py",
+        "llm_usage.py",
+        "basic_constraints.json",
+    ]
+    with tempfile.TemporaryDirectory(prefix="sggg_episode_") as tmpdir:
+        for name in required_files:
+            src = _MODULE_DIR / name
+            if not src.exists():
+                raise RuntimeError(f"missing required file: {name}")
+            shutil.copy(src, Path(tmpdir) / name)
+
+        with open(Path(tmpdir) / "input.json", "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+
+        code = (
+            "import json,runpy; "
+            "ns=runpy.run_path('episode_module.py'); "
+            "payload=json.load(open('input.json','r',encoding='utf-8')); "
+            "usage=[]; "
+            "out=ns['generate_episode']("
+            "story_arc=payload.get('story_arc'), "
+            "recap_and_goal=payload.get('recap_and_goal'), "
+            "basic_constraints=payload.get('basic_constraints'), "
+            "temporal_characteristics=payload.get('temporal_characteristics'), "
+            "recent_story=payload.get('recent_story'), "
+            "on_usage=usage.append); "
+            "print(json.dumps({'episode': out, 'usage': usage}, ensure_ascii=False))"
+        )
+        output = _run_episode_module(tmpdir, code)
+    for record in output.get("usage") or []:
+        llm_usage.forward(on_usage, record)
+    return output.get("episode")
+
+
+def _load_module() -> Any:
+    """导入 episode_module（仅首次），并给常驻 client 设置单次请求超时。"""
+    global _module
+    if _module is not None:
+        return _module
+    with _lock:
+        if _module is not None:
+            return _module
+        # episode_module 在导入时读取 AZURE_OPENAI_*，先补齐 STORYTEXT_* 的兼容映射
+        compat_env = build_azure_compat_env()
+        for key in _AZURE_COMPAT_KEYS:
+            if compat_env.get(key) and not os.environ.get(key):
+                os.environ[key] = compat_env[key]
+        started = time.monotonic()
+        module = importlib.import_module("episode_module")
+        module.client = module.client.with_options(timeout=float(_timeout_sec()))
+        print(f"[INFO] episode_engine module loaded in {(time.monotonic() - started) * 1000:.0f}ms")
+        _module = module
+        return _module
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_max_workers(),
+                thread_name_prefix="episode-engine",
+            )
+        return _executor
+
+
+def _bump(key: str, delta: int = 1) -> None:
+    with _lock:
+        _stats[key] += delta
+
+
+def _run_inprocess(
+    payload: dict[str, Any],
+    on_partial: Optional[OnPartial] = None,
+    on_usage: Optional[OnUsage] = None,
+    started: Optional[threading.Event] = None,
+) -> Any:
+    """在工作线程中执行；超时从开始执行时计算，deadline 覆盖整次生成的所有模型调用。"""
+    timeout = _timeout_sec()
+    deadline = time.monotonic() + timeout
+    if started is not None:
+        started.set()
+    module = _load_module()
+    _bump("in_flight")
+    if on_partial is not None:
+        _bump("streamed")
+    try:
+        return module.generate_episode(
+            story_arc=payload.get("story_arc"),
+            recap_and_goal=payload.get("recap_and_goal"),
+            basic_constraints=payload.get("basic_constraints"),
+            temporal_characteristics=payload.get("temporal_characteristics"),
+            recent_story=payload.get("recent_story"),
+            on_partial=on_partial,
+            on_usage=on_usage,
+            deadline=deadline,
+        )
+    except TimeoutError:
+        raise
+    except Exception as e:
+        # 单次请求被截到剩余时间后的超时等错误，过了 deadline 一律按整体超时上报
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"episode generation timed out after {timeout}s") from e
+        raise
+    finally:
+        _bump("in_flight", -1)
+
+
+def streaming_enabled() -> bool:
+    """EPISODE_STREAM=1（默认）时进程内模式流式生成；隔离子进程模式不支持流式回调。"""
+    if _engine_mode() == "subprocess":
+        return False
+    return os.getenv("EPISODE_STREAM", "1").strip().lower() not in ("0", "false", "no")
+
+
+def run_generate_episode(
+    payload: dict[str, Any],
+    on_partial: Optional[OnPartial] = None,
+    on_usage: Optional[OnUsage] = None,
+) -> Any:
+    """执行一次 episode 生成，返回 generate_episode 的原始输出。
+
+    payload 字段与 generate_episode 的关键字参数一致。从开始执行（而非排队）起超过
+    EPISODE_MODULE_TIMEOUT_SEC 时抛出 TimeoutError；进程内模式下工作线程按同一 deadline
+    自行结束，不会在调用方放弃后继续占用线程池。
+    on_partial 仅在 streaming_enabled() 时生效，在工作线程中被调用。
+    on_usage 对每次模型调用收到一条 llm_usage 记录；子进程模式下在子进程结束后统一回调。
+    """
+    _bump("submitted")
+    if _engine_mode() == "subprocess":
+        try:
+            result = _run_subprocess(payload, on_usage)
+        except Exception:
+            _bump("failed")
+            raise
+        _bump("completed")
+        return result
+
+    timeout = _timeout_sec()
+    if not streaming_enabled():
+        on_partial = None
+    started = threading.Event()
+    future = _get_executor().submit(_run_inprocess, payload, on_partial, on_usage, started)
+    # 排队时间不计入超时；开始执行后由工作线程内的 deadline 结束，这里的等待上限只是兜底
+    while not started.wait(1.0):
+        if future.done():
+            break
+    try:
+        result = future.result(timeout=timeout + _DEADLINE_GRACE_SEC)
+    except FutureTimeoutError:
+        _bump("timeouts")
+        raise TimeoutError(f"episode generation timed out after {timeout}s")
+    except TimeoutError:
+        _bump("timeouts")
+        raise
+    except Exception:
+        _bump("failed")
+        raise
+    _bump("completed")
+    return result
+
+
+def warm_up() -> None:
+    """启动时预热：导入模块并创建线程池。配置缺失时只打印日志，首次调用时再重试。"""
+    if _engine_mode() == "subprocess":
+        return
+    try:
+        _load_module()
+        _get_executor()
+    except Exception as e:
+        print(f"[WARN] episode_engine warm-up skipped: {e}")
+
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_engine_stats() -> dict:
+    with _lock:
+        return {
+            "mode": _engine_mode(),
+            "maxWorkers": _max_workers(),
+            "moduleLoaded": _module is not None,
+            "streaming": streaming_enabled(),
+            "streamed": _stats["streamed"],
+            "submitted": _stats["submitted"],
+            "completed": _stats["completed"],
+            "failed": _stats["failed"],
+            "timeouts": _stats["timeouts"],
+            "inFlight": _stats["in_flight"],
+            # 仅统计进程内模式；子进程模式的修复记录随子进程退出
+            "fixers": episode_fixers.get_fixer_stats(),
+        }
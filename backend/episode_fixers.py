@@ -0,0 +1,229 @@
+"""episode 模型输出的本地确定性修复：解析之后、校验之前执行，能本地修好的问题不再让模型重来。
+
+- parse_episode_json：容错 JSON 解析。去掉代码块包裹与前后多余文字；输出被截断时回退到
+  最后一个完整的值并补齐括号，后续由校验 / 局部修复处理缺失部分。
+- apply_fixers：结构修复（弃用字段、非 choice 页的 branch_choices、event_key 缺失或重复、
+  超出预算的 tap/drag/mimic 与 record_voice 页、next_page_id 断链、prompt package 的 page_id 对不上等）。
+每个修复器命中时记一次，见 get_fixer_stats()。
+本模块与 episode_module.py 一起被复制到隔离子进程，只依赖标准库。
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+MICRO_INTERACTION_TYPES = ("tap", "drag", "mimic")
+DEPRECATED_VISUAL_CANON_KEYS = (
+    "style_summary_cn",
+    "character_consistency_note_cn",
+    "background_consistency_note_cn",
+    "color_palette_note_cn",
+)
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_MAX_TRUNCATION_CANDIDATES = 200
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {}
+
+
+def _record(fixes: Dict[str, int], name: str, count: int = 1) -> None:
+    if count:
+        fixes[name] = fixes.get(name, 0) + count
+
+
+def record_stats(fixes: Dict[str, int]) -> None:
+    with _stats_lock:
+        _stats["episodes"] = _stats.get("episodes", 0) + 1
+        if fixes:
+            _stats["episodes_fixed"] = _stats.get("episodes_fixed", 0) + 1
+        for name, count in fixes.items():
+            _stats[name] = _stats.get(name, 0) + count
+
+
+def get_fixer_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+# ── 容错解析 ────────────────────────────────────────────────
+def _close_truncated(text: str) -> Any:
+    """截断输出：从后往前尝试每个完整值之后的位置，补齐未闭合的括号后解析。"""
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    candidates: List[Tuple[int, str]] = []  # (截断位置, 需补的闭合括号)
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            candidates.append((i + 1, "".join(reversed(stack))))
+        elif c == ",":
+            candidates.append((i, "".join(reversed(stack))))
+    for end, closers in reversed(candidates[-_MAX_TRUNCATION_CANDIDATES:]):
+        try:
+            return json.loads(text[:end] + closers)
+        except ValueError:
+            continue
+    raise json.JSONDecodeError("unrecoverable truncated JSON", text, len(text))
+
+
+def parse_episode_json(raw: str) -> Tuple[Any, Dict[str, int]]:
+    """解析模型输出，返回 (对象, 命中的修复器)。完全无法恢复时抛出 json.JSONDecodeError。"""
+    fixes: Dict[str, int] = {}
+    try:
+        return json.loads(raw), fixes
+    except json.JSONDecodeError as e:
+        error = e
+    text = _FENCE_RE.sub("", raw or "")
+    start = text.find("{")
+    if start < 0:
+        raise error
+    if text != raw or start:
+        _record(fixes, "json_wrapper")
+    text = text[start:]
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(text)
+        return obj, fixes
+    except json.JSONDecodeError:
+        pass
+    try:
+        obj = _close_truncated(text)
+    except json.JSONDecodeError:
+        raise error
+    _record(fixes, "json_truncated")
+    return obj, fixes
+
+
+# ── 结构修复 ────────────────────────────────────────────────
+def _interaction(page: Dict[str, Any]) -> Dict[str, Any]:
+    interaction = page.get("interaction")
+    return interaction if isinstance(interaction, dict) else {}
+
+
+def _demote_to_none(page: Dict[str, Any]) -> None:
+    page["interaction"] = {"type": "none", "instruction": None, "event_key": None, "ext": {"encouragement": None}}
+
+
+def _fix_deprecated_keys(episode: Dict[str, Any], pages: List[Dict[str, Any]], fixes: Dict[str, int]) -> None:
+    visual_canon = episode.get("visual_canon")
+    if isinstance(visual_canon, dict):
+        for key in DEPRECATED_VISUAL_CANON_KEYS:
+            if key in visual_canon:
+                del visual_canon[key]
+                _record(fixes, "deprecated_visual_canon_keys")
+    for page in pages:
+        if "char_count_cn" in page:
+            del page["char_count_cn"]
+            _record(fixes, "char_count_cn")
+    packages = episode.get("page_image_prompt_packages")
+    for pkg in packages if isinstance(packages, list) else []:
+        if isinstance(pkg, dict) and "final_image_prompt_en" in pkg:
+            del pkg["final_image_prompt_en"]
+            _record(fixes, "final_image_prompt_en")
+
+
+def _fix_interaction_budget(pages: List[Dict[str, Any]], micro_limit: int, fixes: Dict[str, int]) -> None:
+    """超出预算的 tap/drag/mimic 从后往前降为 none；record_voice 只保留第一个。"""
+    micro_pages = [p for p in pages if _interaction(p).get("type") in MICRO_INTERACTION_TYPES]
+    for page in micro_pages[max(0, micro_limit):][::-1]:
+        _demote_to_none(page)
+        _record(fixes, "micro_interaction_overflow")
+    voice_pages = [p for p in pages if _interaction(p).get("type") == "record_voice"]
+    for page in voice_pages[1:]:
+        _demote_to_none(page)
+        _record(fixes, "record_voice_overflow")
+
+
+def _fix_interaction_fields(pages: List[Dict[str, Any]], fixes: Dict[str, int]) -> None:
+    """none 页清空互动字段；非 choice 页清空 branch_choices；event_key 缺失或重复时按 page_id 补齐。"""
+    seen: set = set()
+    for idx, page in enumerate(pages, start=1):
+        interaction = _interaction(page)
+        interaction_type = interaction.get("type")
+        if interaction_type == "none":
+            ext = interaction.get("ext") if isinstance(interaction.get("ext"), dict) else {}
+            if interaction.get("instruction") or interaction.get("event_key") or ext.get("encouragement"):
+                _demote_to_none(page)
+                _record(fixes, "none_interaction_fields")
+        if interaction_type != "choice" and page.get("branch_choices") != []:
+            page["branch_choices"] = []
+            _record(fixes, "non_choice_branch_choices")
+        if interaction_type in (None, "none"):
+            continue
+        event_key = interaction.get("event_key")
+        if isinstance(event_key, str) and event_key.strip() and event_key not in seen:
+            seen.add(event_key)
+            continue
+        base = f"{page.get('page_id') or f'p{idx:02d}'}_{interaction_type}"
+        candidate, n = base, 2
+        while candidate in seen:
+            candidate, n = f"{base}_{n}", n + 1
+        interaction["event_key"] = candidate
+        seen.add(candidate)
+        _record(fixes, "event_key")
+
+
+def _fix_page_links(pages: List[Dict[str, Any]], fixes: Dict[str, int]) -> None:
+    """非 choice 页 next_page_id 缺失或指向不存在的页时接到数组中的下一页；末页置 null。"""
+    page_ids = [p.get("page_id") for p in pages]
+    id_set = {pid for pid in page_ids if isinstance(pid, str)}
+    for idx, page in enumerate(pages):
+        if _interaction(page).get("type") == "choice":
+            continue
+        next_page_id = page.get("next_page_id")
+        if idx == len(pages) - 1:
+            if next_page_id is not None:
+                page["next_page_id"] = None
+                _record(fixes, "final_next_page_id")
+            continue
+        if next_page_id in id_set and next_page_id != page.get("page_id"):
+            continue
+        following = page_ids[idx + 1]
+        if isinstance(following, str) and following.strip():
+            page["next_page_id"] = following
+            _record(fixes, "next_page_id")
+
+
+def _fix_package_page_ids(episode: Dict[str, Any], pages: List[Dict[str, Any]], fixes: Dict[str, int]) -> None:
+    """prompt package 与页数一致但 page_id 对不上时，按 page_no 对齐到页的 page_id。"""
+    packages = episode.get("page_image_prompt_packages")
+    if not isinstance(packages, list) or len(packages) != len(pages):
+        return
+    page_ids = [p.get("page_id") for p in pages]
+    if {pkg.get("page_id") for pkg in packages if isinstance(pkg, dict)} == set(page_ids):
+        return
+    for idx, pkg in enumerate(packages, start=1):
+        if not isinstance(pkg, dict):
+            continue
+        page_no = pkg.get("page_no") if isinstance(pkg.get("page_no"), int) else idx
+        if 1 <= page_no <= len(pages) and isinstance(page_ids[page_no - 1], str):
+            if pkg.get("page_id") != page_ids[page_no - 1]:
+                pkg["page_id"] = page_ids[page_no - 1]
+                _record(fixes, "prompt_package_page_id")
+
+
+def apply_fixers(episode: Any, basic_constraints: Dict[str, Any]) -> Dict[str, int]:
+    """就地修复 episode，返回 {修复器: 修改次数}。不是对象或缺 pages 时不做任何事。"""
+    fixes: Dict[str, int] = {}
+    if not isinstance(episode, dict) or not isinstance(episode.get("pages"), list):
+        return fixes
+    pages = [p for p in episode["pages"] if isinstance(p, dict)]
+    micro_limit = basic_constraints["interaction_constraints"]["micro_interactions_max_per_episode"]
+    _fix_deprecated_keys(episode, pages, fixes)
+    _fix_interaction_budget(pages, micro_limit, fixes)
+    _fix_interaction_fields(pages, fixes)
+    _fix_page_links(pages, fixes)
+    _fix_package_page_ids(episode, pages, fixes)
+    return fixes
@@ -1,9 +1,16 @@
 import json
 import os
 import re
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from openai import AzureOpenAI
+from openai import AzureOpenAI, RateLimitError
+
+import episode_fixers
+import llm_usage
+from episode_stream import EpisodeStreamParser
 
 # 从.env文件中读取Azure OpenAI配置
 from dotenv import load_dotenv
@@ -27,6 +34,12 @@ client = AzureOpenAI(
 )
 
 
+STREAM_KEYS = ("visual_canon", "page_image_prompt_packages", "pages")
+
+# 分片写作的并发上限（进程内所有 episode 共享），与引擎的 worker 预算一致，
+# 避免 EPISODE_CHUNKS × 引擎并发个请求同时打到模型
+_SLICE_SLOTS = threading.BoundedSemaphore(max(1, int(os.getenv("EPISODE_ENGINE_MAX_WORKERS", "4"))))
+
 HAN_RE = re.compile(r"[\u3400-\u4DBF\u4E00-\u9FFF\uF900-\uFAFF]")
 
 
@@ -373,6 +386,7 @@ Visual and image prompt requirements:
   "Children's picture-book illustration with a cinematic composition. Characters should occupy about 28-45% of the frame (generally below half-frame dominance). Emphasize scene-driven storytelling rather than close-up character portraits. Besides the main characters and the primary action, include a clear scene anchor, multiple props related to the action, and at least one layer of background everyday-life details. Use clear foreground, midground, and background layering to create a readable, story-rich, lived-in environment. Prefer full-body or 3/4-body framing when possible. Avoid extreme close-ups, oversized heads, empty backgrounds, and implausible human scale."
 - This composition baseline is a strong recommendation, not an absolute hard lock for every page. If a specific page genuinely requires tighter focus (for example, a key detail reveal or interaction-specific close framing), you may partially relax the baseline while still keeping environment readability and plausible scale.
 - page_image_prompt_packages should contain ONLY the page-specific English suffix for each page. Do NOT output final_image_prompt_en or any per-page fully assembled prompt.
+- page_image_prompt_packages is output before pages. Plan every page (page_no, page_id, scene) first; the pages written afterwards must use exactly the same page_no and page_id values and match the scenes described in the suffixes.
 - Each image_prompt_suffix_en must be detailed enough for stable generation: scene location, camera framing, main action, key objects, emotion, lighting/mood, page-specific continuity details, and any truly needed temporary scene-specific clothing change. Do NOT restate stable facial features or default outfit details that should come from the persistent reference image.
 - The downstream caller will assemble the final image prompt externally by combining visual_canon with each page's image_prompt_suffix_en.
 - Do NOT generate the final images. Output only prompts.
@@ -390,7 +404,7 @@ Self-check before finalizing:
 Output rules:
 - Output MUST be exactly one valid JSON object and nothing else.
 - Do NOT add markdown, code fences, explanations, or extra text outside the JSON object.
-- The final output must contain ONLY these top-level keys: pages, visual_canon, page_image_prompt_packages.
+- The final output must contain ONLY these top-level keys, in this order: visual_canon, page_image_prompt_packages, pages.
 - Each page object must contain ONLY: page_no, page_id, page_text_cn, next_page_id, interaction, branch_choices.
 - Each interaction object must contain ONLY: type, instruction, event_key, ext.
 - interaction.ext must contain ONLY: encouragement.
@@ -415,16 +429,7 @@ def build_run_config(
     )
 
     return {
-        "effective_inputs": {
-            "language": basic_constraints.get("language", "zh-CN"),
-            "episode_page_count": basic_constraints["episode_page_count"],
-            "words_per_page_target_cn": page_range,
-            "word_count_cn_profile_standard": total_range,
-            "image_count_target": basic_constraints["image_count_target"],
-            "three_element_minimums": three_element_minimums,
-            "food_override_hint": food_override_hint,
-            "food_override_must_follow": food_override_must_follow,
-        },
+        # 不随故事变化的 prompt_emphasis 在前，供上游前缀缓存命中；每集变化的 effective_inputs 在后
         "prompt_emphasis": {
             "continuity_priority": "Honor recurring world logic, helper roles, rituals, recurring objects, and recent continuity without turning framework-only details into fake past events.",
             "episode_freshness": "Keep the episode fresh by varying the focal food trait, place detail, helper moment, or comparison thread while staying coherent with the same series.",
@@ -461,6 +466,16 @@ def build_run_config(
             ),
             "image_prompt_packaging": "Store shared reusable English prompt components only once inside visual_canon. Do not output final_image_prompt_en. Each page_image_prompt_package should contain only image_prompt_suffix_en for downstream prompt assembly.",
         },
+        "effective_inputs": {
+            "language": basic_constraints.get("language", "zh-CN"),
+            "episode_page_count": basic_constraints["episode_page_count"],
+            "words_per_page_target_cn": page_range,
+            "word_count_cn_profile_standard": total_range,
+            "image_count_target": basic_constraints["image_count_target"],
+            "three_element_minimums": three_element_minimums,
+            "food_override_hint": food_override_hint,
+            "food_override_must_follow": food_override_must_follow,
+        },
     }
 
 def build_response_format(basic_constraints: Dict[str, Any]) -> Dict[str, Any]:
@@ -475,8 +490,58 @@ def build_response_format(basic_constraints: Dict[str, Any]) -> Dict[str, Any]:
             "schema": {
                 "type": "object",
                 "additionalProperties": False,
-                "required": ["pages", "visual_canon", "page_image_prompt_packages"],
+                "required": ["visual_canon", "page_image_prompt_packages", "pages"],
                 "properties": {
+                    "visual_canon": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": [
+                            "global_visual_prompt_prefix_en",
+                            "character_lock_prompt_en",
+                            "world_lock_prompt_en",
+                            "negative_prompt_en",
+                        ],
+                        "properties": {
+                            "global_visual_prompt_prefix_en": {
+                                "type": "string",
+                                "description": "Shared reusable English prompt front-half for global art style, rendering canon, and overall visual tone across the whole episode."
+                            },
+                            "character_lock_prompt_en": {
+                                "type": "string",
+                                "description": "Lightweight shared English character lock. Assume a persistent base character reference image defines the child's face, facial features, hairstyle, and default look. Only mention temporary scene-specific clothing/accessory changes when required by the episode."
+                            },
+                            "world_lock_prompt_en": {
+                                "type": "string",
+                                "description": "Shared reusable English world lock for recurring locations, objects, props, and environment continuity."
+                            },
+                            "negative_prompt_en": {
+                                "type": "string",
+                                "description": "Shared reusable English negative prompt constraints for all pages."
+                            },
+                        },
+                    },
+                    "page_image_prompt_packages": {
+                        "type": "array",
+                        "minItems": page_count,
+                        "maxItems": page_count,
+                        "items": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": [
+                                "page_no",
+                                "page_id",
+                                "image_prompt_suffix_en",
+                            ],
+                            "properties": {
+                                "page_no": {"type": "integer"},
+                                "page_id": {"type": "string"},
+                                "image_prompt_suffix_en": {
+                                    "type": "string",
+                                    "description": "Page-specific English scene suffix. The shared reusable front-half is stored once in visual_canon and should be combined downstream with this suffix during image generation."
+                                },
+                            },
+                        },
+                    },
                     "pages": {
                         "type": "array",
                         "minItems": page_count,
@@ -554,56 +619,6 @@ def build_response_format(basic_constraints: Dict[str, Any]) -> Dict[str, Any]:
                             },
                         },
                     },
-                    "visual_canon": {
-                        "type": "object",
-                        "additionalProperties": False,
-                        "required": [
-                            "global_visual_prompt_prefix_en",
-                            "character_lock_prompt_en",
-                            "world_lock_prompt_en",
-                            "negative_prompt_en",
-                        ],
-                        "properties": {
-                            "global_visual_prompt_prefix_en": {
-                                "type": "string",
-                                "description": "Shared reusable English prompt front-half for global art style, rendering canon, and overall visual tone across the whole episode."
-                            },
-                            "character_lock_prompt_en": {
-                                "type": "string",
-                                "description": "Lightweight shared English character lock. Assume a persistent base character reference image defines the child's face, facial features, hairstyle, and default look. Only mention temporary scene-specific clothing/accessory changes when required by the episode."
-                            },
-                            "world_lock_prompt_en": {
-                                "type": "string",
-                                "description": "Shared reusable English world lock for recurring locations, objects, props, and environment continuity."
-                            },
-                            "negative_prompt_en": {
-                                "type": "string",
-                                "description": "Shared reusable English negative prompt constraints for all pages."
-                            },
-                        },
-                    },
-                    "page_image_prompt_packages": {
-                        "type": "array",
-                        "minItems": page_count,
-                        "maxItems": page_count,
-                        "items": {
-                            "type": "object",
-                            "additionalProperties": False,
-                            "required": [
-                                "page_no",
-                                "page_id",
-                                "image_prompt_suffix_en",
-                            ],
-                            "properties": {
-                                "page_no": {"type": "integer"},
-                                "page_id": {"type": "string"},
-                                "image_prompt_suffix_en": {
-                                    "type": "string",
-                                    "description": "Page-specific English scene suffix. The shared reusable front-half is stored once in visual_canon and should be combined downstream with this suffix during image generation."
-                                },
-                            },
-                        },
-                    },
                 },
             },
         },
@@ -863,24 +878,536 @@ def _validate_episode_output(episode: Dict[str, Any], basic_constraints: Dict[st
 
     return errors
 
+def _apply_fixers(episode: Any, basic_constraints: Dict[str, Any], fixes: Dict[str, int]) -> None:
+    """Run the deterministic local fixers before validation and record which ones fired."""
+    for name, count in episode_fixers.apply_fixers(episode, basic_constraints).items():
+        fixes[name] = fixes.get(name, 0) + count
+    episode_fixers.record_stats(fixes)
+    if fixes:
+        print("[INFO] episode fixers applied: " + ", ".join(f"{k}={v}" for k, v in sorted(fixes.items())))
+
+
+_PAGE_ERROR_RE = re.compile(r"^(?:Choice page|Non-choice page|Non-final non-choice page|Page) (\d+)\b")
+_PACKAGE_ERROR_RE = re.compile(r"^Prompt package (\d+)\b")
+_PAGE_COUNT_ERROR_RE = re.compile(r"^Page (\d+) Han-character count \d+ is outside")
+_TOTAL_COUNT_ERROR_RE = re.compile(r"^Total Han-character count (\d+) is outside")
+
+
+def _plan_repair(
+    episode: Dict[str, Any],
+    errors: List[str],
+    basic_constraints: Dict[str, Any],
+) -> Optional[Dict[str, Any]]:
+    """Map validation errors to the page / prompt package / visual_canon fragments they concern.
+
+    Returns None when any error is episode-wide (page count, id uniqueness, interaction
+    layout, ...) or too many pages are affected; those still need a full regeneration.
+    """
+    pages = episode.get("pages")
+    packages = episode.get("page_image_prompt_packages")
+    if not isinstance(pages, list) or not isinstance(packages, list):
+        return None
+    min_page_cn, max_page_cn = basic_constraints["words_per_page_target_cn"]
+    total_low, total_high = basic_constraints["word_count_cn_profiles"]["standard"]
+
+    page_issues: Dict[int, List[str]] = {}
+    package_issues: Dict[int, List[str]] = {}
+    canon_issues: List[str] = []
+    targets: Dict[int, List[int]] = {}
+    total_cn: Optional[int] = None
+
+    for error in errors:
+        page_match = _PAGE_ERROR_RE.match(error)
+        package_match = _PACKAGE_ERROR_RE.match(error)
+        total_match = _TOTAL_COUNT_ERROR_RE.match(error)
+        if page_match and 1 <= int(page_match.group(1)) <= len(pages):
+            idx = int(page_match.group(1)) - 1
+            if not isinstance(pages[idx], dict):
+                return None
+            page_issues.setdefault(idx, []).append(error)
+            if _PAGE_COUNT_ERROR_RE.match(error):
+                targets[idx] = [min_page_cn, max_page_cn]
+        elif package_match and 1 <= int(package_match.group(1)) <= len(packages):
+            package_issues.setdefault(int(package_match.group(1)) - 1, []).append(error)
+        elif error.startswith("visual_canon"):
+            canon_issues.append(error)
+        elif total_match:
+            total_cn = int(total_match.group(1))
+        else:
+            return None
+
+    if total_cn is not None:
+        # 总字数越界：从余量最大的页开始，把缺口/超出分摊到尽量少的页上
+        margin = min(20, (total_high - total_low) // 4)
+        need = total_low + margin - total_cn if total_cn < total_low else total_high - margin - total_cn
+        counts = {
+            idx: _count_han_characters(page.get("page_text_cn") or "")
+            for idx, page in enumerate(pages)
+            if isinstance(page, dict) and isinstance(page.get("page_text_cn"), str)
+        }
+        headroom = {
+            idx: (max_page_cn - count) if need > 0 else (count - min_page_cn)
+            for idx, count in counts.items()
+        }
+        remaining = abs(need)
+        for idx in sorted(headroom, key=lambda i: -headroom[i]):
+            if remaining <= 0 or headroom[idx] <= 0:
+                break
+            delta = min(headroom[idx], remaining)
+            remaining -= delta
+            target = counts[idx] + delta if need > 0 else counts[idx] - delta
+            targets[idx] = [max(min_page_cn, target - 5), min(max_page_cn, target + 5)]
+            page_issues.setdefault(idx, []).append(
+                f"Total Han-character count {total_cn} is outside {total_low}-{total_high}; "
+                f"this page currently has {counts[idx]}."
+            )
+        if remaining > 0:
+            return None
+
+    if len(page_issues) > max(1, len(pages) // 2):
+        return None
+    if not (page_issues or package_issues or canon_issues):
+        return None
+    return {
+        "pages": page_issues,
+        "targets": targets,
+        "packages": package_issues,
+        "visual_canon": canon_issues,
+    }
+
+
+def build_fragment_response_format(
+    basic_constraints: Dict[str, Any],
+    page_count: int,
+    package_count: int,
+    include_visual_canon: bool,
+) -> Dict[str, Any]:
+    base = build_response_format(basic_constraints)["json_schema"]["schema"]["properties"]
+    properties: Dict[str, Any] = {}
+    if include_visual_canon:
+        properties["visual_canon"] = base["visual_canon"]
+    if package_count:
+        properties["page_image_prompt_packages"] = {
+            **base["page_image_prompt_packages"],
+            "minItems": package_count,
+            "maxItems": package_count,
+        }
+    if page_count:
+        properties["pages"] = {**base["pages"], "minItems": page_count, "maxItems": page_count}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "episode_fragments",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": list(properties),
+                "properties": properties,
+            },
+        },
+    }
+
+
+def _build_repair_instruction(episode: Dict[str, Any], plan: Dict[str, Any]) -> str:
+    pages = episode["pages"]
+    packages = episode["page_image_prompt_packages"]
+    lines = [
+        "Your previous output failed validation. Do NOT regenerate the whole episode.",
+        "Rewrite ONLY the fragments listed below; everything else is kept exactly as you wrote it.",
+        "Output only a JSON object containing the rewritten fragments, in the listed order.",
+    ]
+    if plan["visual_canon"]:
+        lines.append("\nvisual_canon (rewrite the whole object):")
+        lines.extend(f"- {issue}" for issue in plan["visual_canon"])
+    if plan["packages"]:
+        lines.append("\npage_image_prompt_packages to rewrite (keep page_no and page_id unchanged):")
+        for idx in sorted(plan["packages"]):
+            pkg = packages[idx] if isinstance(packages[idx], dict) else {}
+            lines.append(f"- package {idx + 1} (page_id {pkg.get('page_id')!r}): " + " ".join(plan["packages"][idx]))
+    if plan["pages"]:
+        lines.append(
+            "\npages to rewrite (keep page_no and page_id unchanged, keep interaction design unless an issue "
+            "concerns it, and keep the story continuous with the neighbouring pages):"
+        )
+        for idx in sorted(plan["pages"]):
+            page = pages[idx]
+            line = f"- page_no {idx + 1} (page_id {page.get('page_id')!r}): " + " ".join(plan["pages"][idx])
+            if idx in plan["targets"]:
+                low, high = plan["targets"][idx]
+                line += f" Rewrite page_text_cn to {low}-{high} Han characters."
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _repair_episode(
+    messages: List[Dict[str, str]],
+    episode: Dict[str, Any],
+    plan: Dict[str, Any],
+    basic_constraints: Dict[str, Any],
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Ask the model for the planned fragments only and splice them into a copy of episode."""
+    page_indexes = sorted(plan["pages"])
+    package_indexes = sorted(plan["packages"])
+    response_format = build_fragment_response_format(
+        basic_constraints,
+        page_count=len(page_indexes),
+        package_count=len(package_indexes),
+        include_visual_canon=bool(plan["visual_canon"]),
+    )
+    repair_messages = messages + [
+        {"role": "assistant", "content": json.dumps(episode, ensure_ascii=False)},
+        {"role": "developer", "content": _build_repair_instruction(episode, plan)},
+    ]
+    response = _call_model(
+        messages=repair_messages,
+        response_format=response_format,
+        max_completion_tokens=8192,
+        usage_kind="episode_repair",
+        on_usage=on_usage,
+        deadline=deadline,
+    )
+    fragments, fixes = episode_fixers.parse_episode_json(response.choices[0].message.content)
+
+    repaired = json.loads(json.dumps(episode))
+    if plan["visual_canon"]:
+        repaired["visual_canon"] = fragments["visual_canon"]
+    for key, indexes in (("pages", page_indexes), ("page_image_prompt_packages", package_indexes)):
+        items = (fragments.get(key) or []) if indexes else []
+        if len(items) != len(indexes):
+            raise ValueError(f"repair returned {len(items)} {key}, expected {len(indexes)}")
+        for idx, item in zip(indexes, items):
+            original = repaired[key][idx] if isinstance(repaired[key][idx], dict) else {}
+            page_id = original.get("page_id")
+            if isinstance(item, dict) and isinstance(page_id, str) and page_id.strip():
+                item["page_id"] = page_id
+            repaired[key][idx] = item
+    _normalize_page_numbers(repaired)
+    _apply_fixers(repaired, basic_constraints, fixes)
+    return repaired
+
+
+def _repair_until_valid(
+    messages: List[Dict[str, str]],
+    result: Dict[str, Any],
+    errors: List[str],
+    basic_constraints: Dict[str, Any],
+    max_repair_rounds: int,
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Run targeted repair rounds while the errors stay locally repairable; returns (result, errors)."""
+    repair_round = 0
+    while errors and repair_round < max_repair_rounds:
+        plan = _plan_repair(result, errors, basic_constraints)
+        if plan is None:
+            break
+        repair_round += 1
+        try:
+            repaired = _repair_episode(messages, result, plan, basic_constraints, on_usage, deadline)
+        except TimeoutError:
+            raise
+        except Exception as e:
+            print(f"[WARN] episode repair failed round={repair_round}: {e}")
+            break
+        repaired_errors = _validate_episode_output(repaired, basic_constraints)
+        print(
+            f"[INFO] episode repair round={repair_round} pages={len(plan['pages'])} "
+            f"packages={len(plan['packages'])} errors={len(errors)}->{len(repaired_errors)}"
+        )
+        if len(repaired_errors) > len(errors):
+            break
+        result, errors = repaired, repaired_errors
+    return result, errors
+
+
+def _client_for(deadline: Optional[float]) -> Any:
+    """Return the shared client, with the request timeout capped to what is left before deadline."""
+    if deadline is None:
+        return client
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("episode generation deadline exceeded")
+    return client.with_options(timeout=remaining)
+
+
 def _call_model(
     messages: List[Dict[str, str]],
     response_format: Dict[str, Any],
     max_completion_tokens: int,
+    usage_kind: str = "episode",
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
 ):
+    model_client = _client_for(deadline)
+    started = time.monotonic()
     try:
-        return client.chat.completions.create(
+        response = model_client.chat.completions.create(
             model=deployment,
             messages=messages,
             response_format=response_format,
             max_completion_tokens=max_completion_tokens,
         )
     except TypeError:
-        return client.chat.completions.create(
+        response = model_client.chat.completions.create(
             model=deployment,
             messages=messages,
             max_completion_tokens=max_completion_tokens,
         )
+    llm_usage.report(on_usage, usage_kind, deployment, getattr(response, "usage", None), started)
+    return response
+
+
+def _notify(
+    on_partial: Optional[Callable[[str, Optional[int], Any], None]],
+    key: str,
+    index: Optional[int],
+    value: Any,
+) -> None:
+    if on_partial is None:
+        return
+    try:
+        on_partial(key, index, value)
+    except Exception as e:
+        print(f"[WARN] episode partial callback failed key={key} index={index}: {e}")
+
+
+def _call_model_stream(
+    messages: List[Dict[str, str]],
+    response_format: Dict[str, Any],
+    max_completion_tokens: int,
+    on_partial: Callable[[str, Optional[int], Any], None],
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
+) -> str:
+    """流式调用模型，边接收边解析：visual_canon、每个 prompt package、每页完整时回调 on_partial。
+
+    返回完整的输出文本；回调中的异常只打印，不影响生成本身。超过 deadline 时关闭流并抛出 TimeoutError。
+    """
+    parser = EpisodeStreamParser(
+        lambda key, index, value: _notify(on_partial, key, index, value),
+        keys=STREAM_KEYS,
+    )
+    model_client = _client_for(deadline)
+    started = time.monotonic()
+    stream = model_client.chat.completions.create(
+        model=deployment,
+        messages=messages,
+        response_format=response_format,
+        max_completion_tokens=max_completion_tokens,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts: List[str] = []
+    usage = None
+    for chunk in stream:
+        if deadline is not None and time.monotonic() > deadline:
+            stream.close()
+            raise TimeoutError("episode generation deadline exceeded")
+        # usage 在最后一个（choices 为空的）分片上
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        # Azure 的首个分片可能只有内容过滤结果，没有 choices
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            parts.append(text)
+            parser.feed(text)
+    llm_usage.report(on_usage, "episode", deployment, usage, started)
+    return "".join(parts)
+
+
+def build_plan_response_format(basic_constraints: Dict[str, Any]) -> Dict[str, Any]:
+    base = build_response_format(basic_constraints)["json_schema"]["schema"]["properties"]
+    page_props = base["pages"]["items"]["properties"]
+    page_count = basic_constraints["episode_page_count"]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "episode_plan",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["visual_canon", "outline"],
+                "properties": {
+                    "visual_canon": base["visual_canon"],
+                    "outline": {
+                        "type": "array",
+                        "minItems": page_count,
+                        "maxItems": page_count,
+                        "items": {
+                            "type": "object",
+                            "additionalProperties": False,
+                            "required": [
+                                "page_no",
+                                "page_id",
+                                "next_page_id",
+                                "interaction_type",
+                                "beat_cn",
+                                "branch_choices",
+                            ],
+                            "properties": {
+                                "page_no": page_props["page_no"],
+                                "page_id": page_props["page_id"],
+                                "next_page_id": page_props["next_page_id"],
+                                "interaction_type": page_props["interaction"]["properties"]["type"],
+                                "beat_cn": {
+                                    "type": "string",
+                                    "description": "One or two short Chinese sentences: what happens on this page, which food or element beat it carries, and how it hands off to the next page."
+                                },
+                                "branch_choices": page_props["branch_choices"],
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    }
+
+
+def _plan_slices(page_count: int, chunk_count: int) -> List[Tuple[int, int]]:
+    """Split 1..page_count into chunk_count contiguous (first, last) page_no ranges."""
+    chunk_count = max(1, min(chunk_count, page_count))
+    size, extra = divmod(page_count, chunk_count)
+    slices: List[Tuple[int, int]] = []
+    first = 1
+    for i in range(chunk_count):
+        last = first + size + (1 if i < extra else 0) - 1
+        slices.append((first, last))
+        first = last + 1
+    return slices
+
+
+def _build_plan_instruction() -> str:
+    return (
+        "Planning step. Do NOT write page_text_cn or image prompt suffixes yet. "
+        "Plan the whole episode and output only visual_canon and an outline with exactly one entry per page. "
+        "The outline fixes page_no, page_id, next_page_id, interaction type and branch_choices for every page, "
+        "so apply all interaction budget, choice-point and record_voice rules here. "
+        "The pages will then be written in parallel slices by writers who only see this plan, "
+        "so each beat_cn must carry the continuity details a writer needs."
+    )
+
+
+def _build_slice_instruction(first: int, last: int, basic_constraints: Dict[str, Any]) -> str:
+    min_page_cn, max_page_cn = basic_constraints["words_per_page_target_cn"]
+    total_low, total_high = basic_constraints["word_count_cn_profiles"]["standard"]
+    page_count = basic_constraints["episode_page_count"]
+    per_page = max(min_page_cn, min(max_page_cn, round((total_low + total_high) / 2 / page_count)))
+    return (
+        f"Writing step. Write ONLY pages {first}-{last} (page_no) of the planned episode above, "
+        "plus the page_image_prompt_packages for those pages. "
+        "Follow the outline exactly: keep page_no, page_id, next_page_id, interaction.type and branch_choices as planned, "
+        "and realise each beat_cn. The other pages are written separately from the same plan; do not repeat their content. "
+        f"Each page_text_cn must stay within {min_page_cn}-{max_page_cn} Han characters; aim for about {per_page} per page "
+        f"so the whole episode stays within {total_low}-{total_high}. "
+        "Prefix every event_key with the page_id. "
+        "Output only a JSON object with page_image_prompt_packages and pages for these pages."
+    )
+
+
+def _generate_episode_chunked(
+    messages: List[Dict[str, str]],
+    basic_constraints: Dict[str, Any],
+    chunk_count: int,
+    on_partial: Optional[Callable[[str, Optional[int], Any], None]] = None,
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Plan once, write page slices concurrently, and merge them into one unvalidated episode."""
+    started = time.monotonic()
+    response = _call_model(
+        messages=messages + [{"role": "developer", "content": _build_plan_instruction()}],
+        response_format=build_plan_response_format(basic_constraints),
+        max_completion_tokens=8192,
+        usage_kind="episode_plan",
+        on_usage=on_usage,
+        deadline=deadline,
+    )
+    plan, fixes = episode_fixers.parse_episode_json(response.choices[0].message.content)
+    outline = plan["outline"]
+    _notify(on_partial, "visual_canon", None, plan["visual_canon"])
+    plan_ms = (time.monotonic() - started) * 1000
+
+    slices = _plan_slices(len(outline), chunk_count)
+    slice_messages = messages + [{"role": "assistant", "content": json.dumps(plan, ensure_ascii=False)}]
+
+    aborted = threading.Event()
+
+    def write_slice(first: int, last: int) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        count = last - first + 1
+        wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not _SLICE_SLOTS.acquire(timeout=wait):
+            raise TimeoutError("episode generation deadline exceeded")
+        try:
+            if aborted.is_set():
+                raise RuntimeError(f"slice {first}-{last} skipped after another slice failed")
+            slice_response = _call_model(
+                messages=slice_messages + [
+                    {"role": "developer", "content": _build_slice_instruction(first, last, basic_constraints)}
+                ],
+                response_format=build_fragment_response_format(
+                    basic_constraints, page_count=count, package_count=count, include_visual_canon=False
+                ),
+                max_completion_tokens=8192,
+                usage_kind="episode_slice",
+                on_usage=on_usage,
+                deadline=deadline,
+            )
+        finally:
+            _SLICE_SLOTS.release()
+        fragment, slice_fixes = episode_fixers.parse_episode_json(slice_response.choices[0].message.content)
+        pages = fragment.get("pages") or []
+        packages = fragment.get("page_image_prompt_packages") or []
+        if len(pages) != count or len(packages) != count:
+            raise ValueError(f"slice {first}-{last} returned {len(pages)} pages / {len(packages)} packages")
+        for offset, pkg in enumerate(packages):
+            _notify(on_partial, "page_image_prompt_packages", first - 1 + offset, pkg)
+        return fragment, slice_fixes
+
+    fragments: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    pool = ThreadPoolExecutor(max_workers=len(slices), thread_name_prefix="episode-chunk")
+    try:
+        futures = {pool.submit(write_slice, first, last): (first, last) for first, last in slices}
+        for future in as_completed(futures):
+            fragment, slice_fixes = future.result()
+            fragments[futures[future]] = fragment
+            for name, n in slice_fixes.items():
+                fixes[name] = fixes.get(name, 0) + n
+    except BaseException:
+        # 任一分片失败即放弃：未开始的分片取消，不再等待进行中的分片，立即回落单次生成
+        aborted.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=False)
+
+    episode: Dict[str, Any] = {
+        "visual_canon": plan["visual_canon"],
+        "page_image_prompt_packages": [],
+        "pages": [],
+    }
+    for key in slices:
+        episode["page_image_prompt_packages"].extend(fragments[key]["page_image_prompt_packages"])
+        episode["pages"].extend(fragments[key]["pages"])
+    # 链接关系以计划为准，避免各分片各自发挥导致断链
+    for page, planned in zip(episode["pages"], outline):
+        if not isinstance(page, dict) or not isinstance(planned, dict):
+            continue
+        page["page_id"] = planned.get("page_id", page.get("page_id"))
+        page["next_page_id"] = planned.get("next_page_id")
+        if planned.get("interaction_type") == "choice":
+            page["branch_choices"] = planned.get("branch_choices") or page.get("branch_choices") or []
+    _normalize_page_numbers(episode)
+    _apply_fixers(episode, basic_constraints, fixes)
+    print(
+        f"[INFO] episode chunked slices={len(slices)} plan_ms={plan_ms:.0f} "
+        f"total_ms={(time.monotonic() - started) * 1000:.0f}"
+    )
+    return episode
 
 
 def generate_episode(
@@ -890,6 +1417,11 @@ def generate_episode(
     temporal_characteristics: Optional[Dict[str, Any]] = None,
     recent_story: Optional[Any] = None,
     max_retries: int = 2,
+    on_partial: Optional[Callable[[str, Optional[int], Any], None]] = None,
+    max_repair_rounds: int = 2,
+    chunks: Optional[int] = None,
+    on_usage: Optional[llm_usage.OnUsage] = None,
+    deadline: Optional[float] = None,
 ) -> Dict[str, Any]:
     """生成单集绘本 episode。
 
@@ -906,6 +1438,27 @@ def generate_episode(
     - 输出页对象中不再包含 char_count_cn；汉字数由模块内部校验。
     - visual_canon 只保留共享可复用的英文图像提示前半部分，不再输出中文/英文重复说明。
     - page_image_prompt_packages 中只保留每页 image_prompt_suffix_en；最终图像 prompt 由下游将 visual_canon 与 suffix 进行拼接。
+    - 顶层字段顺序为 visual_canon、page_image_prompt_packages、pages，便于流式消费时尽早拿到插图提示词。
+
+    校验失败时的处理：
+    - 错误能定位到具体页 / prompt package / visual_canon（含总字数越界，分摊到余量最大的几页）时，
+      只让模型重写这些片段并拼回原结果再校验，最多 max_repair_rounds 轮；
+    - 页数、page_id 唯一性、互动布局等整集层面的问题，或局部修复未能解决时，才整份重新生成（最多 max_retries 次）。
+
+    分片生成（chunks 或 EPISODE_CHUNKS > 1）：
+    - 先用一次短调用生成 visual_canon 与逐页大纲（page_id、跳转、互动类型、choice 分支、情节要点）；
+    - 再按页切成 chunks 段并发写作（每段输出该段的 pages 与 page_image_prompt_packages），按大纲拼接后
+      走同样的本地修复、校验与局部修复；仍不通过时回落到整份单次生成。
+
+    超时说明：
+    - deadline 为 time.monotonic() 时间点，覆盖整次生成（含分片、局部修复与重试）；每次模型调用前检查，
+      单次请求的超时不超过剩余时间，流式接收中途超时会关闭流；超过时抛出 TimeoutError。
+
+    流式说明：
+    - 传入 on_partial 时以流式方式调用模型，visual_canon 完整时回调 on_partial("visual_canon", None, canon)，
+      每个 prompt package / 页完整时回调 on_partial(key, 序号, item)；下游可据此提前开始插图生成。
+    - 回调只是提前通知，最终结果仍以完整输出通过校验后的返回值为准；只有第一轮生成（分片或整份）回调，
+      回落到整份生成与校验失败重试时不再回调，改用非流式调用。
 
     交互说明：
     - 允许的交互类型为 none、tap、drag、choice、mimic、record_voice。
@@ -954,10 +1507,11 @@ def generate_episode(
     )
     response_format = build_response_format(basic_constraints)
 
+    # 从最稳定到最易变排列：basic_constraints 跨故事不变，story_arc 同一故事内不变，其余每集变化
     user_payload: Dict[str, Any] = {
+        "basic_constraints": basic_constraints,
         "story_arc": story_arc,
         "recap_and_goal": recap_and_goal,
-        "basic_constraints": basic_constraints,
         "temporal_characteristics": temporal_characteristics,
     }
     if recent_story is not None:
@@ -971,16 +1525,53 @@ def generate_episode(
 
     last_errors: List[str] = []
 
+    chunk_count = chunks if chunks is not None else int(os.getenv("EPISODE_CHUNKS", "1") or 1)
+    if chunk_count > 1:
+        try:
+            result = _generate_episode_chunked(
+                messages, basic_constraints, chunk_count, on_partial, on_usage, deadline
+            )
+            errors = _validate_episode_output(result, basic_constraints)
+            result, errors = _repair_until_valid(
+                messages, result, errors, basic_constraints, max_repair_rounds, on_usage, deadline
+            )
+            if not errors:
+                return result
+            print(f"[WARN] episode chunked output still invalid, falling back to single completion: {errors[:3]}")
+        except (RateLimitError, TimeoutError):
+            raise
+        except Exception as e:
+            print(f"[WARN] episode chunked generation failed, falling back to single completion: {e}")
+        # 提前插图只跟随第一轮生成，回落与重试不再回调，避免重复排队整套插图
+        on_partial = None
+
     for attempt in range(1, max(1, max_retries) + 1):
-        response = _call_model(
-            messages=messages,
-            response_format=response_format,
-            max_completion_tokens=32768,
-        )
-        raw_content = response.choices[0].message.content
-        result = json.loads(raw_content)
+        if on_partial is not None:
+            raw_content = _call_model_stream(
+                messages=messages,
+                response_format=response_format,
+                max_completion_tokens=32768,
+                on_partial=on_partial,
+                on_usage=on_usage,
+                deadline=deadline,
+            )
+            on_partial = None
+        else:
+            response = _call_model(
+                messages=messages,
+                response_format=response_format,
+                max_completion_tokens=32768,
+                on_usage=on_usage,
+                deadline=deadline,
+            )
+            raw_content = response.choices[0].message.content
+        result, fixes = episode_fixers.parse_episode_json(raw_content)
         _normalize_page_numbers(result)
+        _apply_fixers(result, basic_constraints, fixes)
         errors = _validate_episode_output(result, basic_constraints)
+        result, errors = _repair_until_valid(
+            messages, result, errors, basic_constraints, max_repair_rounds, on_usage, deadline
+        )
         if not errors:
             return result
 
@@ -0,0 +1,90 @@
+"""流式 episode 输出的增量解析：模型边生成边扫描 JSON，顶层字段或数组元素一完整就回调。
+
+只跟踪顶层对象的直接成员：
+- 对象值（如 visual_canon）完整时回调 on_event(key, None, value)；
+- 数组值（如 pages、page_image_prompt_packages）中每个元素完整时回调
+  on_event(key, index, item)。
+其余位置的字符只做括号/字符串状态跟踪，不保留，内存占用与单个被跟踪值的大小相当。
+本模块与 episode_module.py 一起被复制到隔离子进程，只依赖标准库。
+"""
+import json
+from typing import Any, Callable, Iterable, Optional
+
+OnEvent = Callable[[str, Optional[int], Any], None]
+
+
+class EpisodeStreamParser:
+    def __init__(self, on_event: OnEvent, keys: Optional[Iterable[str]] = None):
+        self.on_event = on_event
+        self.keys = set(keys) if keys is not None else None
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_chars: Optional[list[str]] = None
+        self._key: Optional[str] = None
+        self._index = 0
+        self._capture: Optional[list[str]] = None
+        self._capture_depth = 0
+
+    def _wanted(self) -> bool:
+        return self._key is not None and (self.keys is None or self._key in self.keys)
+
+    def _emit(self, index: Optional[int]) -> None:
+        raw = "".join(self._capture or [])
+        self._capture = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        self.on_event(self._key, index, value)
+
+    def feed(self, text: str) -> None:
+        for c in text:
+            if self._capture is not None:
+                self._capture.append(c)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._key = json.loads('"' + "".join(self._key_chars) + '"')
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(c)
+                continue
+
+            depth = len(self._stack)
+            if c == '"':
+                self._in_string = True
+                if depth == 1 and self._expect_key:
+                    self._key_chars = []
+            elif c in "{[":
+                self._stack.append(c)
+                if depth == 0:
+                    self._expect_key = c == "{"
+                elif depth == 1 and self._wanted():
+                    self._index = 0
+                    if c == "{":
+                        self._capture, self._capture_depth = [c], 2
+                elif depth == 2 and self._stack[1] == "[" and self._wanted() and self._capture is None:
+                    self._capture, self._capture_depth = [c], 3
+            elif c in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if self._capture is not None and depth == self._capture_depth:
+                    if depth == 3:
+                        self._emit(self._index)
+                        self._index += 1
+                    else:
+                        self._emit(None)
+            elif depth == 1:
+                if c == ":":
+                    self._expect_key = False
+                elif c == ",":
+                    self._expect_key = True
@@ -1,63 +1,9 @@
 import json
-import os
 import re
-import shutil
-import subprocess
-import sys
-import tempfile
 from pathlib import Path
-from typing import Any, Optional
-from urllib.parse import parse_qs, urlparse
-
-
-def _build_azure_compat_env() -> dict[str, str]:
-    env = os.environ.copy()
-    if not env.get("AZURE_OPENAI_API_KEY") and env.get("STORYTEXT_OPENAI_API_KEY"):
-        env["AZURE_OPENAI_API_KEY"] = env["STORYTEXT_OPENAI_API_KEY"]
-
-    storytext_uri = env.get("STORYTEXT_OPENAI_URI", "")
-    if not env.get("AZURE_OPENAI_ENDPOINT") and storytext_uri:
-        try:
-            parsed = urlparse(storytext_uri)
-            if parsed.scheme and parsed.netloc:
-                env["AZURE_OPENAI_ENDPOINT"] = f"{parsed.scheme}://{parsed.netloc}"
-            parts = [p for p in parsed.path.split("/") if p]
-            if not env.get("AZURE_OPENAI_DEPLOYMENT") and "deployments" in parts:
-                idx = parts.index("deployments")
-                if idx + 1 < len(parts):
-                    env["AZURE_OPENAI_DEPLOYMENT"] = parts[idx + 1]
-            if not env.get("AZURE_OPENAI_API_VERSION"):
-                q = parse_qs(parsed.query)
-                api_ver = q.get("api-version", [None])[0]
-                if api_ver:
-                    env["AZURE_OPENAI_API_VERSION"] = api_ver
-        except Exception:
-            pass
-    return env
-
-
-def _parse_last_json_line(stdout: str) -> Any:
-    lines = [line.strip() for line in stdout.splitlines() if line.strip()]
-    for line in reversed(lines):
-        try:
-            return json.loads(line)
-        except Exception:
-            continue
-    raise ValueError("No valid JSON found in episode module stdout")
-
+from typing import Any, Callable, Optional
 
-def _run_episode_module(cwd: str, code: str) -> Any:
-    proc = subprocess.run(
-        [os.getenv("PYTHON_EXECUTABLE") or sys.executable, "-c", code],
-        cwd=cwd,
-        capture_output=True,
-        text=True,
-        env=_build_azure_compat_env(),
-        timeout=int(os.getenv("EPISODE_MODULE_TIMEOUT_SEC", "300")),
-    )
-    if proc.returncode != 0:
-        raise RuntimeError(proc.stderr.strip() or proc.stdout.strip() or "episode module execution failed")
-    return _parse_last_json_line(proc.stdout)
+from episode_engine import run_generate_episode
 
 
 def _safe_str(value: Any) -> str:
@@ -364,6 +310,33 @@ def _build_basic_constraints_override(
     return merged
 
 
+def build_placeholder_content(
+    *,
+    theme_food: Optional[str],
+    story_arc: Optional[dict[str, Any]],
+    meal_context: dict[str, Any],
+    story_config: dict[str, Any],
+    temporal_characteristics: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """文案生成完成前返回给调用方的占位 story content（pages 为空）。"""
+    theme_food = _extract_theme_food(theme_food, story_arc, meal_context, temporal_characteristics)
+    return {
+        "book_meta": {
+            "title": "生成中",
+            "subtitle": "",
+            "theme_food": theme_food,
+            "story_type": story_config.get("story_type", "light_fantasy"),
+            "target_behavior_level": "Lv3",
+            "summary": "生成中",
+            "design_logic": "",
+            "global_visual_style": "",
+        },
+        "pages": [],
+        "ending": {},
+        "avatar_feedback": _build_avatar_feedback(meal_context, theme_food),
+    }
+
+
 def generate_story_from_episode(
     *,
     theme_food: Optional[str] = None,
@@ -375,48 +348,22 @@ def generate_story_from_episode(
     temporal_characteristics: Optional[dict[str, Any]] = None,
     recent_story: Any = None,
     regenerate_overrides: Optional[dict[str, Any]] = None,
+    on_partial: Optional[Callable[[str, Optional[int], Any], None]] = None,
+    on_usage: Optional[Callable[[dict[str, Any]], None]] = None,
 ) -> dict[str, Any]:
     module_dir = Path(__file__).resolve().parent
-    required_files = [
-        "episode_module.py",
-        "basic_constraints.json",
-    ]
     print("INFO: episode_text:start")
-    with tempfile.TemporaryDirectory(prefix="sggg_episode_") as tmpdir:
-        for name in required_files:
-            src = module_dir / name
-            if not src.exists():
-                raise RuntimeError(f"missing required file: {name}")
-            shutil.copy(src, Path(tmpdir) / name)
-
-        runtime_basic_constraints = _build_basic_constraints_override(
-            module_dir=module_dir,
-            regenerate_overrides=regenerate_overrides,
-        )
-
-        payload = {
-            "story_arc": story_arc,
-            "recap_and_goal": recap_and_goal,
-            "basic_constraints": runtime_basic_constraints,
-            "temporal_characteristics": temporal_characteristics or {},
-            "recent_story": recent_story,
-        }
-        with open(Path(tmpdir) / "input.json", "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-
-        code = (
-            "import json,runpy; "
-            "ns=runpy.run_path('episode_module.py'); "
-            "payload=json.load(open('input.json','r',encoding='utf-8')); "
-            "out=ns['generate_episode']("
-            "story_arc=payload.get('story_arc'), "
-            "recap_and_goal=payload.get('recap_and_goal'), "
-            "basic_constraints=payload.get('basic_constraints'), "
-            "temporal_characteristics=payload.get('temporal_characteristics'), "
-            "recent_story=payload.get('recent_story')); "
-            "print(json.dumps(out, ensure_ascii=False))"
-        )
-        episode = _run_episode_module(tmpdir, code)
+    runtime_basic_constraints = _build_basic_constraints_override(
+        module_dir=module_dir,
+        regenerate_overrides=regenerate_overrides,
+    )
+    episode = run_generate_episode({
+        "story_arc": story_arc,
+        "recap_and_goal": recap_and_goal,
+        "basic_constraints": runtime_basic_constraints,
+        "temporal_characteristics": temporal_characteristics or {},
+        "recent_story": recent_story,
+    }, on_partial=on_partial, on_usage=on_usage)
 
     if not isinstance(episode, dict):
         raise ValueError("episode output is not a JSON object")
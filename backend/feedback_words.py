@@ -1,7 +1,10 @@
 import json
 import os
-import urllib.error
-import urllib.request
+import time
+
+import llm_usage
+import upstream_http
+import usage_store
 
 
 def _prompt_file_path(name: str) -> str:
@@ -70,21 +73,8 @@ def _fill_user_template(template: str, params: dict) -> str:
 
 
 def _post_json(uri: str, payload: dict, api_key: str) -> dict:
-    headers = {"Content-Type": "application/json"}
-    if "openai.azure.com" in uri:
-        headers["api-key"] = api_key
-    else:
-        headers["Authorization"] = f"Bearer {api_key}"
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(uri, data=data, headers=headers, method="POST")
     timeout_sec = int(os.getenv("FEEDBACK_OPENAI_TIMEOUT_SEC", "60"))
-    try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            body = resp.read().decode("utf-8")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8")
-        raise RuntimeError(f"LLM request failed ({e.code}): {body}")
-    return json.loads(body) if body else {}
+    return upstream_http.post_json(uri, payload, api_key, timeout=timeout_sec, label="LLM")
 
 
 def generate_feedback_words(params: dict) -> str:
@@ -117,7 +107,9 @@ def generate_feedback_words(params: dict) -> str:
     else:
         payload["model"] = model
 
+    started = time.monotonic()
     rsp = _post_json(uri, payload, api_key)
+    llm_usage.report(usage_store.record, "feedback_words", model, rsp.get("usage"), started)
     raw = rsp.get("choices", [{}])[0].get("message", {}).get("content")
     text = raw.strip() if isinstance(raw, str) else ""
     if not text:
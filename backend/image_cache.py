@@ -0,0 +1,217 @@
+"""插图的提示词哈希缓存（磁盘 LRU）。
+
+key = sha256(完整提示词, 尺寸, 模型, 参考图摘要)，同样的请求只调用一次图片接口：
+- 缓存文件为 STORYIMAGE_CACHE_DIR/<key>.<内容 sha256>.png（默认目录 image_cache，不在公开的
+  /static 下），总量不超过 STORYIMAGE_CACHE_MB，按最近访问淘汰。
+- 内容哈希记在文件名与内存索引中，命中时直接按它把缓存文件硬链接（跨盘时复制）为
+  static/images/<内容 sha256>.png，无需重读文件；故事引用的是自己的那份文件，缓存淘汰
+  不会影响已生成的绘本。旧格式 <key>.png 在首次命中时补算哈希并改名。
+- 相同 key 的并发请求合并为一次生成。
+- STORYIMAGE_CACHE=0 关闭。
+"""
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def enabled() -> bool:
+    return os.getenv("STORYIMAGE_CACHE", "1").strip().lower() not in ("0", "false", "no")
+
+
+def digest(raw: Optional[bytes]) -> str:
+    return hashlib.sha256(raw).hexdigest() if raw else ""
+
+
+def cache_key(prompt: str, size: str, model: str, reference_digest: str = "") -> str:
+    raw = "\x00".join([prompt, size, model, reference_digest]).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class ImageCache:
+    def __init__(self, directory: str, *, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max(0, max_bytes)
+        self._lock = threading.Lock()
+        # key → (size, 内容 sha256)，按访问顺序；旧格式文件的内容哈希为空串
+        self._entries: "OrderedDict[str, tuple[int, str]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, concurrent.futures.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "stored": 0, "failures": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            key, _, content_digest = stem.partition(".")
+            if ext != ".png" or len(key) != 64 or len(content_digest) not in (0, 64):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, key, st.st_size, content_digest))
+        for _, key, size, content_digest in sorted(entries):
+            self._entries[key] = (size, content_digest)
+            self._bytes += size
+
+    def path_for(self, key: str, content_digest: str) -> str:
+        name = f"{key}.{content_digest}.png" if content_digest else f"{key}.png"
+        return os.path.join(self.directory, name)
+
+    def _drop(self, key: str) -> None:
+        with self._lock:
+            size, _ = self._entries.pop(key, (0, ""))
+            self._bytes -= size
+
+    def _upgrade_legacy(self, key: str, path: str) -> Optional[tuple[str, str]]:
+        """旧格式 <key>.png：读一次算出内容哈希，改为新文件名。"""
+        try:
+            with open(path, "rb") as f:
+                content_digest = digest(f.read())
+            new_path = self.path_for(key, content_digest)
+            os.replace(path, new_path)
+        except FileNotFoundError:
+            self._drop(key)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], content_digest)
+        return new_path, content_digest
+
+    def lookup(self, key: str) -> Optional[tuple[str, str]]:
+        """命中时返回 (缓存文件路径, 内容 sha256)。"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            _, content_digest = self._entries[key]
+        path = self.path_for(key, content_digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._drop(key)
+            return None
+        if not content_digest:
+            return self._upgrade_legacy(key, path)
+        return path, content_digest
+
+    def store(self, key: str, raw: bytes) -> tuple[str, str]:
+        content_digest = digest(raw)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        path = self.path_for(key, content_digest)
+        os.replace(tmp, path)
+        victims = []
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is None:
+                self._bytes += len(raw)
+            else:
+                self._bytes += len(raw) - previous[0]
+                if previous[1] != content_digest:
+                    victims.append((key, previous[1]))
+            self._entries[key] = (len(raw), content_digest)
+            self._entries.move_to_end(key)
+            self._stats["stored"] += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victim, (size, victim_digest) = next(iter(self._entries.items()))
+                if victim == key:
+                    break
+                del self._entries[victim]
+                self._bytes -= size
+                self._stats["evicted"] += 1
+                victims.append((victim, victim_digest))
+        for victim, victim_digest in victims:
+            try:
+                os.remove(self.path_for(victim, victim_digest))
+            except FileNotFoundError:
+                pass
+        return path, content_digest
+
+    def get_or_render(
+        self, key: str, render: Callable[[], Optional[bytes]]
+    ) -> tuple[Optional[tuple[str, str]], Optional[bytes], bool]:
+        """返回 ((缓存文件路径, 内容 sha256), 新生成的字节, 是否命中)。
+
+        命中时只有缓存条目；未命中时返回 render 的结果，写缓存失败则条目为 None。
+        render 返回 None 表示生成失败，不缓存。
+        """
+        while True:
+            entry = self.lookup(key)
+            if entry is not None:
+                with self._lock:
+                    self._stats["hits"] += 1
+                return entry, None, True
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = concurrent.futures.Future()
+                    self._stats["misses"] += 1
+                    owner = True
+                else:
+                    self._stats["coalesced"] += 1
+                    owner = False
+            if owner:
+                break
+            # 等待进行中的同 key 生成；其失败时由本请求重新生成
+            future.result()
+        entry = None
+        raw = None
+        try:
+            raw = render()
+            if raw:
+                try:
+                    entry = self.store(key, raw)
+                except OSError as e:
+                    print(f"[WARN] image_cache write failed key={key}: {e}")
+            return entry, raw, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if not raw:
+                    self._stats["failures"] += 1
+            future.set_result(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "inflight": len(self._inflight),
+                **self._stats,
+            }
+
+
+_cache: Optional[ImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ImageCache:
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(
+                # 缓存原件不经 /static 公开，故事引用的是复制到 static/images 的文件
+                os.getenv("STORYIMAGE_CACHE_DIR", "image_cache"),
+                max_bytes=int(float(os.getenv("STORYIMAGE_CACHE_MB", "1024")) * 1024 * 1024),
+            )
+        return _cache
+
+
+def get_cache_stats() -> dict:
+    with _cache_lock:
+        cache = _cache
+    if cache is None:
+        return {"enabled": enabled(), "started": False}
+    return {"enabled": enabled(), "started": True, **cache.stats()}
@@ -1,18 +1,23 @@
 import base64
-import json
+import hashlib
 import os
+import shutil
+import tempfile
+import threading
 import time
-import uuid as _uuid
-import urllib.request
-import urllib.error
 from urllib.parse import urlparse, unquote
 from pathlib import Path
-from typing import Any, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Optional
+
+import image_cache
+import image_renditions
+from image_scheduler import KIND_DELTA, KIND_PAGE, get_scheduler
+import upstream_http
 
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8000")
 _IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "images")
 
+IMAGE_SIZE = "1024x1024"
 MAX_RETRIES = 3
 PAGE_MAX_RETRIES = 2
 RETRY_DELAYS = [2, 5, 10]  # seconds between retries
@@ -64,65 +69,71 @@ def _resolve_page_prompt(
     return f"{fallback} {_COMPOSITION_ENRICHMENT_GUIDANCE}".strip()
 
 
+def _content_name(raw: bytes, ext: str) -> str:
+    return hashlib.sha256(raw).hexdigest() + ext
+
+
 def _save_locally_bytes(raw: bytes, ext: str = ".png") -> Optional[str]:
-    """保存图片字节到本地，返回永久本地 URL。失败返回 None。"""
+    """按内容 sha256 命名保存图片字节（相同内容只存一份），返回永久本地 URL。失败返回 None。"""
     try:
         os.makedirs(_IMAGES_DIR, exist_ok=True)
-        img_name = _uuid.uuid4().hex + ext
+        img_name = _content_name(raw, ext)
         path = os.path.join(_IMAGES_DIR, img_name)
-        with open(path, "wb") as f:
-            f.write(raw)
+        if not os.path.exists(path):
+            fd, tmp = tempfile.mkstemp(dir=_IMAGES_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(raw)
+            os.replace(tmp, path)
         return f"{BACKEND_BASE_URL}/static/images/{img_name}"
     except Exception as e:
         print(f"[IMG] 本地保存失败: {e}")
         return None
 
 
-def _build_multipart_body(fields: list[tuple[str, str]], files: list[tuple[str, str, bytes, str]], boundary: str) -> bytes:
-    chunks: list[bytes] = []
-    for name, value in fields:
-        chunks.extend(
-            [
-                f"--{boundary}\r\n".encode("utf-8"),
-                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode("utf-8"),
-                value.encode("utf-8"),
-                b"\r\n",
-            ]
-        )
-    for field_name, filename, content, content_type in files:
-        chunks.extend(
-            [
-                f"--{boundary}\r\n".encode("utf-8"),
-                (
-                    f'Content-Disposition: form-data; name="{field_name}"; '
-                    f'filename="{filename}"\r\n'
-                ).encode("utf-8"),
-                f"Content-Type: {content_type}\r\n\r\n".encode("utf-8"),
-                content,
-                b"\r\n",
-            ]
-        )
-    chunks.append(f"--{boundary}--\r\n".encode("utf-8"))
-    return b"".join(chunks)
+def _local_image_path(image_url: str) -> Optional[Path]:
+    """/static/images/* 的 URL 对应的本地文件（不存在时返回 None）。"""
+    try:
+        parsed_path = unquote(urlparse(image_url).path or "")
+        marker = "/static/images/"
+        if marker in parsed_path:
+            local_file = Path(_IMAGES_DIR) / Path(parsed_path.split(marker, 1)[1]).name
+            if local_file.exists():
+                return local_file
+    except Exception:
+        pass
+    return None
+
+
+def derive_renditions(image_url: str) -> dict[str, dict[str, str]]:
+    """为本地插图生成 AVIF/WebP 全尺寸与缩略图，返回 {格式: {宽度: URL}}；未安装 Pillow 时为空。"""
+    local_file = _local_image_path(image_url)
+    if local_file is None:
+        return {}
+    return {
+        fmt: {width: f"{BACKEND_BASE_URL}/static/images/{name}" for width, name in variants.items()}
+        for fmt, variants in image_renditions.derive(str(local_file)).items()
+    }
+
+
+def _throttled(uri: str) -> dict:
+    """按图片服务 URI 的令牌桶限速后发送请求；上游 429 时通知调度器暂停该 URI。
+
+    重试只由本模块的逐页重试循环负责（每次重试都重新取令牌），upstream_http 不再重试。
+    """
+    scheduler = get_scheduler()
+    return {
+        "throttle": lambda: scheduler.throttle(uri),
+        "on_rate_limited": lambda retry_after: scheduler.report_rate_limited(uri, retry_after),
+        "retries": 0,
+    }
 
 
 def _post_json(uri: str, payload: dict, api_key: str) -> dict:
     print(f"[INFO] IMG request start uri={uri}")
-    headers = {"Content-Type": "application/json"}
-    if "openai.azure.com" in uri:
-        headers["api-key"] = api_key
-    else:
-        headers["Authorization"] = f"Bearer {api_key}"
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(uri, data=data, headers=headers, method="POST")
-    try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            body = resp.read().decode("utf-8")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8")
-        raise RuntimeError(f"image request failed ({e.code}): {body}")
+    timeout_sec = int(os.getenv("STORYIMAGE_OPENAI_TIMEOUT_SEC", "60"))
+    rsp = upstream_http.post_json(uri, payload, api_key, timeout=timeout_sec, label="image", **_throttled(uri))
     print("[INFO] IMG request done")
-    return json.loads(body) if body else {}
+    return rsp
 
 
 def _post_multipart(
@@ -131,23 +142,19 @@ def _post_multipart(
     files: list[tuple[str, str, bytes, str]],
     api_key: str,
 ) -> dict:
-    boundary = f"----sggg-{_uuid.uuid4().hex}"
-    data = _build_multipart_body(fields, files, boundary)
-    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
-    if "openai.azure.com" in uri:
-        headers["api-key"] = api_key
-    else:
-        headers["Authorization"] = f"Bearer {api_key}"
     print(f"[INFO] IMG request start uri={uri}")
-    req = urllib.request.Request(uri, data=data, headers=headers, method="POST")
-    try:
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            body = resp.read().decode("utf-8")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8")
-        raise RuntimeError(f"image request failed ({e.code}): {body}")
+    resp = upstream_http.request(
+        "POST",
+        uri,
+        api_key=api_key,
+        timeout=120,
+        label="image",
+        data=dict(fields),
+        files=[(field_name, (filename, content, content_type)) for field_name, filename, content, content_type in files],
+        **_throttled(uri),
+    )
     print("[INFO] IMG request done")
-    return json.loads(body) if body else {}
+    return resp.json() if resp.content else {}
 
 
 def _build_reference_guidance(prompt: str) -> str:
@@ -194,50 +201,73 @@ def _resolve_child_avatar_reference_path(child_avatar: Optional[dict[str, Any]])
     return str(candidate)
 
 
-def _extract_image_response(rsp: dict) -> Optional[str]:
+def _extract_image_bytes(rsp: dict) -> Optional[bytes]:
     data = rsp.get("data", [])
     if data:
         b64 = data[0].get("b64_json")
         if b64:
-            raw = base64.b64decode(b64)
-            saved = _save_locally_bytes(raw, ".png")
-            if saved:
-                return saved
+            return base64.b64decode(b64)
         url = data[0].get("url")
         if url:
             try:
-                with urllib.request.urlopen(url, timeout=60) as resp:
-                    raw = resp.read()
-                saved = _save_locally_bytes(raw, ".png")
-                if saved:
-                    return saved
+                return upstream_http.get_bytes(url, timeout=60, label="image download")
             except Exception:
                 pass
     return None
 
 
+def _save_cached_copy(path: str, content_digest: str) -> Optional[str]:
+    """把缓存文件硬链接（失败时复制）为 static/images 下按内容命名的文件，返回本地 URL。
+
+    content_digest 取自缓存索引，不必重读文件。
+    """
+    try:
+        img_name = content_digest + ".png"
+        os.makedirs(_IMAGES_DIR, exist_ok=True)
+        dest = os.path.join(_IMAGES_DIR, img_name)
+        if not os.path.exists(dest):
+            try:
+                os.link(path, dest)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(path, dest)
+        return f"{BACKEND_BASE_URL}/static/images/{img_name}"
+    except Exception as e:
+        print(f"[IMG] 缓存图片复制失败: {e}")
+        return None
+
+
+def _render_with_cache(key: str, render: Callable[[], Optional[bytes]]) -> Optional[str]:
+    """命中提示词缓存时不调用图片接口；否则 render 并写入缓存。返回本地 URL。"""
+    if not image_cache.enabled():
+        raw = render()
+        return _save_locally_bytes(raw, ".png") if raw else None
+    entry, raw, hit = image_cache.get_cache().get_or_render(key, render)
+    if hit:
+        print(f"[INFO] IMG cache hit key={key[:12]}")
+    saved = _save_cached_copy(*entry) if entry else None
+    if not saved and raw:
+        saved = _save_locally_bytes(raw, ".png")
+    return saved
+
+
 def _load_base_image_bytes(image_url: str) -> Optional[bytes]:
     raw_url = _safe_str(image_url)
     if not raw_url:
         return None
 
     # Prefer local backend static file when URL points to /static/images/*
-    try:
-        parsed = urlparse(raw_url)
-        parsed_path = unquote(parsed.path or "")
-        marker = "/static/images/"
-        if marker in parsed_path:
-            filename = Path(parsed_path.split(marker, 1)[1]).name
-            local_file = Path(_IMAGES_DIR) / filename
-            if local_file.exists():
-                return local_file.read_bytes()
-    except Exception:
-        pass
+    local_file = _local_image_path(raw_url)
+    if local_file is not None:
+        try:
+            return local_file.read_bytes()
+        except OSError:
+            pass
 
     # Fallback to HTTP fetch
     try:
-        with urllib.request.urlopen(raw_url, timeout=60) as resp:
-            return resp.read()
+        return upstream_http.get_bytes(raw_url, timeout=60, label="image download")
     except Exception:
         return None
 
@@ -299,34 +329,39 @@ def generate_interaction_delta_image(
         print("[IMG] interaction diff skipped: base image bytes unavailable")
         return None
 
-    for attempt in range(PAGE_MAX_RETRIES):
-        try:
-            prompt = _build_interaction_delta_prompt(
-                base_prompt=base_prompt,
-                interaction_type=interaction_type,
-                instruction=instruction,
-            )
-            fields = [("prompt", prompt), ("size", "1024x1024")]
-            if "/deployments/" not in edits_uri:
-                fields.append(("model", model))
-            if "mini" not in model.lower():
-                fields.append(("input_fidelity", "high"))
-            print(f"[INFO] IMG interaction diff start type={interaction_type}")
-            rsp = _post_multipart(
-                edits_uri,
-                fields,
-                [("image[]", "base_scene.png", image_bytes, "image/png")],
-                api_key,
-            )
-            saved = _extract_image_response(rsp)
-            if saved:
-                return saved
-            print(f"[IMG] interaction diff attempt {attempt+1}: empty image data")
-        except Exception as e:
-            print(f"[IMG] interaction diff attempt {attempt+1} exception: {e}")
-        if attempt < MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAYS[attempt])
-    return None
+    prompt = _build_interaction_delta_prompt(
+        base_prompt=base_prompt,
+        interaction_type=interaction_type,
+        instruction=instruction,
+    )
+
+    def render() -> Optional[bytes]:
+        for attempt in range(PAGE_MAX_RETRIES):
+            try:
+                fields = [("prompt", prompt), ("size", IMAGE_SIZE)]
+                if "/deployments/" not in edits_uri:
+                    fields.append(("model", model))
+                if "mini" not in model.lower():
+                    fields.append(("input_fidelity", "high"))
+                print(f"[INFO] IMG interaction diff start type={interaction_type}")
+                rsp = _post_multipart(
+                    edits_uri,
+                    fields,
+                    [("image[]", "base_scene.png", image_bytes, "image/png")],
+                    api_key,
+                )
+                raw = _extract_image_bytes(rsp)
+                if raw:
+                    return raw
+                print(f"[IMG] interaction diff attempt {attempt+1}: empty image data")
+            except Exception as e:
+                print(f"[IMG] interaction diff attempt {attempt+1} exception: {e}")
+            if attempt < MAX_RETRIES - 1:
+                time.sleep(RETRY_DELAYS[attempt])
+        return None
+
+    key = image_cache.cache_key(prompt, IMAGE_SIZE, model, image_cache.digest(image_bytes))
+    return _render_with_cache(key, render)
 
 
 def generate_page_image(prompt: str, global_style: str = "", reference_image_path: Optional[str] = None) -> Optional[str]:
@@ -347,71 +382,101 @@ def generate_page_image(prompt: str, global_style: str = "", reference_image_pat
         print("[IMG] reference image provided but edits endpoint cannot be derived; skip page")
         return None
 
-    timeout_sec = int(os.getenv("STORYIMAGE_OPENAI_TIMEOUT_SEC", "60"))
-    max_timeout_sec = int(os.getenv("STORYIMAGE_OPENAI_TIMEOUT_MAX_SEC", "180"))
-
-    for attempt in range(MAX_RETRIES):
+    ref_bytes: Optional[bytes] = None
+    if reference_requested and reference_image_path:
         try:
-            if reference_requested and reference_image_path and edits_uri:
-                with open(reference_image_path, "rb") as ref_file:
-                    ref_bytes = ref_file.read()
-                fields = [
-                    ("prompt", _build_reference_guidance(full_prompt)),
-                    ("size", "1024x1024"),
-                ]
-                if "/deployments/" not in edits_uri:
-                    fields.append(("model", model))
-                if "mini" not in model.lower():
-                    fields.append(("input_fidelity", "high"))
-                print(f"[INFO] IMG reference start path={Path(reference_image_path).name}")
-                rsp = _post_multipart(
-                    edits_uri,
-                    fields,
-                    [("image[]", Path(reference_image_path).name, ref_bytes, "image/png")],
-                    api_key,
-                )
-            else:
-                payload = {
-                    "prompt": full_prompt,
-                    "size": "1024x1024",
-                }
-                if "openai.azure.com" not in uri:
-                    payload["response_format"] = "b64_json"
-                if "/deployments/" not in uri:
-                    payload["model"] = model
-                rsp = _post_json(uri, payload, api_key)
-
-            saved = _extract_image_response(rsp)
-            if saved:
-                return saved
-            print(f"[IMG] attempt {attempt+1}: empty image data")
-        except Exception as e:
-            mode = "edits" if reference_requested else "generations"
-            print(f"[IMG] attempt {attempt+1} {mode} exception: {e}")
+            with open(reference_image_path, "rb") as ref_file:
+                ref_bytes = ref_file.read()
+        except OSError as e:
+            print(f"[IMG] reference image unreadable path={Path(reference_image_path).name}: {e}")
+            return None
+    use_reference = bool(ref_bytes and edits_uri)
+    request_prompt = _build_reference_guidance(full_prompt) if use_reference else full_prompt
+
+    def render() -> Optional[bytes]:
+        for attempt in range(MAX_RETRIES):
+            try:
+                if use_reference:
+                    fields = [
+                        ("prompt", request_prompt),
+                        ("size", IMAGE_SIZE),
+                    ]
+                    if "/deployments/" not in edits_uri:
+                        fields.append(("model", model))
+                    if "mini" not in model.lower():
+                        fields.append(("input_fidelity", "high"))
+                    print(f"[INFO] IMG reference start path={Path(reference_image_path).name}")
+                    rsp = _post_multipart(
+                        edits_uri,
+                        fields,
+                        [("image[]", Path(reference_image_path).name, ref_bytes, "image/png")],
+                        api_key,
+                    )
+                else:
+                    payload = {
+                        "prompt": request_prompt,
+                        "size": IMAGE_SIZE,
+                    }
+                    if "openai.azure.com" not in uri:
+                        payload["response_format"] = "b64_json"
+                    if "/deployments/" not in uri:
+                        payload["model"] = model
+                    rsp = _post_json(uri, payload, api_key)
+
+                raw = _extract_image_bytes(rsp)
+                if raw:
+                    return raw
+                print(f"[IMG] attempt {attempt+1}: empty image data")
+            except Exception as e:
+                mode = "edits" if reference_requested else "generations"
+                print(f"[IMG] attempt {attempt+1} {mode} exception: {e}")
 
-        if attempt < PAGE_MAX_RETRIES - 1:
-            time.sleep(RETRY_DELAYS[attempt])
+            if attempt < PAGE_MAX_RETRIES - 1:
+                time.sleep(RETRY_DELAYS[attempt])
 
-    print(f"[IMG] all {PAGE_MAX_RETRIES} attempts failed for prompt: {full_prompt[:80]}...")
-    return None
+        print(f"[IMG] all {PAGE_MAX_RETRIES} attempts failed for prompt: {full_prompt[:80]}...")
+        return None
 
+    key = image_cache.cache_key(request_prompt, IMAGE_SIZE, model, image_cache.digest(ref_bytes))
+    return _render_with_cache(key, render)
 
-def generate_images_for_pages(
+
+def _image_env_ready() -> bool:
+    return bool(
+        os.getenv("STORYIMAGE_OPENAI_API_KEY")
+        and os.getenv("STORYIMAGE_OPENAI_URI")
+        and os.getenv("STORYIMAGE_OPENAI_MODEL")
+    )
+
+
+def schedule_images_for_pages(
     pages: list,
     global_style: str,
     visual_canon: Optional[dict[str, Any]] = None,
     page_image_prompt_packages: Optional[list[dict[str, Any]]] = None,
     child_avatar: Optional[dict[str, Any]] = None,
+    on_complete: Optional[Callable[[int, int], None]] = None,
+    on_image_saved: Optional[Callable[[int, str, str, dict], None]] = None,
 ) -> None:
-    """为所有页面生成插图（最多 2 个并发），失败页面重试后仍跳过。"""
-    if not os.getenv("STORYIMAGE_OPENAI_API_KEY") or not os.getenv("STORYIMAGE_OPENAI_URI") or not os.getenv("STORYIMAGE_OPENAI_MODEL"):
+    """把所有页面插图提交到全局图片调度器，立即返回。
+
+    页面插图成功后再提交该页的互动差分图（优先级最低）。每张图片落盘并生成派生版本后
+    立即调用 on_image_saved(page_index, field, url, renditions)，field 为 image_url 或
+    interaction_image_url，renditions 同时写入 page["renditions"][field]。全部任务结束后
+    在调度器线程中调用 on_complete(success, failed)；未配置 STORYIMAGE_OPENAI_* 时直接以 (0, 0) 回调。
+    """
+    if not _image_env_ready():
         print("[IMG] STORYIMAGE_OPENAI_* not set, skipping image generation")
+        if on_complete:
+            on_complete(0, 0)
         return
 
     total = len(pages)
-    success = 0
-    failed = 0
     print(f"[INFO] IMG batch start pages={total}")
+    if not total:
+        if on_complete:
+            on_complete(0, 0)
+        return
     prompt_package_map = {
         _safe_str(pkg.get("page_id")): pkg
         for pkg in (page_image_prompt_packages or [])
@@ -421,46 +486,166 @@ def generate_images_for_pages(
     if reference_image_path:
         print(f"[INFO] IMG avatar reference ready file={Path(reference_image_path).name}")
 
-    def gen_one(page: dict):
+    scheduler = get_scheduler()
+    batch = scheduler.new_batch()
+    lock = threading.Lock()
+    state = {"outstanding": total, "success": 0, "failed": 0}
+
+    def settle(outstanding_delta: int, **counts: int) -> None:
+        with lock:
+            for key, value in counts.items():
+                state[key] += value
+            state["outstanding"] += outstanding_delta
+            done = state["outstanding"] == 0
+        if done:
+            print(f"[INFO] IMG batch done success={state['success']} failed={state['failed']}")
+            if on_complete:
+                on_complete(state["success"], state["failed"])
+
+    def publish(page_index: int, page: dict, field: str, url: str) -> None:
+        renditions = derive_renditions(url)
+        page[field] = url
+        page_renditions = page.setdefault("renditions", {})
+        if renditions:
+            page_renditions[field] = renditions
+        else:
+            page_renditions.pop(field, None)
+        if on_image_saved:
+            try:
+                on_image_saved(page_index, field, url, renditions)
+            except Exception as e:
+                print(f"[IMG] persist failed page_id={page.get('page_id', '?')} field={field}: {e}")
+
+    def gen_page(page_index: int, page: dict) -> Optional[str]:
         prompt = _resolve_page_prompt(page, visual_canon, prompt_package_map)
         if not prompt:
             print(f"[IMG] missing prompt page_id={page.get('page_id', '?')}")
-            return False
+            return None
         url = generate_page_image(prompt, global_style, reference_image_path=reference_image_path)
         if url:
-            page["image_url"] = url
-            interaction = page.get("interaction") if isinstance(page.get("interaction"), dict) else {}
-            interaction_type = _safe_str(interaction.get("type"))
-            if interaction_type in {"tap", "drag", "mimic"}:
-                instruction = _safe_str(interaction.get("instruction"))
-                full_prompt = f"{global_style}. {prompt}" if global_style else prompt
-                delta_url = generate_interaction_delta_image(
-                    base_image_url=url,
-                    base_prompt=full_prompt,
-                    interaction_type=interaction_type,
-                    instruction=instruction,
-                )
-                if delta_url:
-                    page["interaction_image_url"] = delta_url
-                else:
-                    print(
-                        f"[IMG] interaction diff missing page_id={page.get('page_id', '?')} type={interaction_type}"
-                    )
-            return True
-        return False
+            publish(page_index, page, "image_url", url)
+        return url
+
+    def gen_delta(page_index: int, page: dict, url: str, interaction_type: str) -> None:
+        interaction = page.get("interaction") if isinstance(page.get("interaction"), dict) else {}
+        prompt = _resolve_page_prompt(page, visual_canon, prompt_package_map)
+        full_prompt = f"{global_style}. {prompt}" if global_style else prompt
+        delta_url = generate_interaction_delta_image(
+            base_image_url=url,
+            base_prompt=full_prompt,
+            interaction_type=interaction_type,
+            instruction=_safe_str(interaction.get("instruction")),
+        )
+        if delta_url:
+            publish(page_index, page, "interaction_image_url", delta_url)
+        else:
+            print(f"[IMG] interaction diff missing page_id={page.get('page_id', '?')} type={interaction_type}")
+
+    def on_delta_done(future) -> None:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"[IMG] interaction diff error: {e}")
+        settle(-1)
+
+    def on_page_done(page_index: int, page: dict, future) -> None:
+        try:
+            url = future.result()
+        except Exception as e:
+            url = None
+            print(f"[IMG] thread error for page_id={page.get('page_id', '?')}: {e}")
+        if not url:
+            print(f"[IMG] FAILED page_id={page.get('page_id', '?')}")
+            settle(-1, failed=1)
+            return
+        interaction = page.get("interaction") if isinstance(page.get("interaction"), dict) else {}
+        interaction_type = _safe_str(interaction.get("type"))
+        if interaction_type in {"tap", "drag", "mimic"}:
+            # 先登记差分任务再结算页面，保证 outstanding 不会提前归零
+            with lock:
+                state["outstanding"] += 1
+            delta_future = scheduler.submit(
+                gen_delta, page_index, page, url, interaction_type,
+                batch=batch, page_index=page_index, kind=KIND_DELTA,
+            )
+            delta_future.add_done_callback(on_delta_done)
+        settle(-1, success=1)
+
+    for page_index, page in enumerate(pages):
+        future = scheduler.submit(gen_page, page_index, page, batch=batch, page_index=page_index, kind=KIND_PAGE)
+        future.add_done_callback(
+            lambda f, page_index=page_index, page=page: on_page_done(page_index, page, f)
+        )
 
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future_to_page = {executor.submit(gen_one, page): page for page in pages}
-        for f in as_completed(future_to_page):
-            page = future_to_page[f]
-            try:
-                if f.result():
-                    success += 1
-                else:
-                    failed += 1
-                    print(f"[IMG] FAILED page_id={page.get('page_id', '?')}")
-            except Exception as e:
-                failed += 1
-                print(f"[IMG] thread error for page_id={page.get('page_id', '?')}: {e}")
 
-    print(f"[INFO] IMG batch done success={success} failed={failed}")
+def prestart_page_images(
+    child_avatar: Optional[dict[str, Any]] = None,
+) -> Optional[Callable[[str, Optional[int], Any], None]]:
+    """返回 episode 流式生成的 on_partial 回调：visual_canon 与某页 prompt package 到齐即排队该页插图。
+
+    提前生成的插图与文案完成后 schedule_images_for_pages 使用完全相同的提示词与参考图，
+    结果经提示词缓存交接：正式任务到来时插图已完成则直接命中，仍在生成则合并等待。
+    未配置 STORYIMAGE_OPENAI_* 或关闭了插图缓存（无法交接）时返回 None。
+    """
+    if not _image_env_ready() or not image_cache.enabled():
+        return None
+    reference_image_path = _resolve_child_avatar_reference_path(child_avatar)
+    scheduler = get_scheduler()
+    batch = scheduler.new_batch()
+    lock = threading.Lock()
+    state: dict[str, Any] = {"canon": None, "pending": [], "queued": set()}
+
+    def queue(index: int, pkg: dict) -> None:
+        suffix = _safe_str(pkg.get("image_prompt_suffix_en"))
+        if not suffix:
+            return
+        prompt = _assemble_episode_prompt(state["canon"], suffix)
+        with lock:
+            if prompt in state["queued"]:
+                return
+            state["queued"].add(prompt)
+        page_no = pkg.get("page_no")
+        page_index = page_no - 1 if isinstance(page_no, int) and page_no > 0 else index
+        print(f"[INFO] IMG prestart page_id={pkg.get('page_id', '?')} page_index={page_index}")
+        scheduler.submit(
+            generate_page_image, prompt, "", reference_image_path,
+            batch=batch, page_index=page_index, kind=KIND_PAGE,
+        )
+
+    def on_partial(key: str, index: Optional[int], value: Any) -> None:
+        if not isinstance(value, dict):
+            return
+        if key == "visual_canon":
+            with lock:
+                state["canon"] = value
+                pending, state["pending"] = state["pending"], []
+            for item in pending:
+                queue(*item)
+        elif key == "page_image_prompt_packages" and index is not None:
+            with lock:
+                if state["canon"] is None:
+                    state["pending"].append((index, value))
+                    return
+            queue(index, value)
+
+    return on_partial
+
+
+def generate_images_for_pages(
+    pages: list,
+    global_style: str,
+    visual_canon: Optional[dict[str, Any]] = None,
+    page_image_prompt_packages: Optional[list[dict[str, Any]]] = None,
+    child_avatar: Optional[dict[str, Any]] = None,
+) -> None:
+    """阻塞版本：经全局调度器生成所有页面插图并等待完成，失败页面重试后仍跳过。"""
+    done = threading.Event()
+    schedule_images_for_pages(
+        pages,
+        global_style,
+        visual_canon=visual_canon,
+        page_image_prompt_packages=page_image_prompt_packages,
+        child_avatar=child_avatar,
+        on_complete=lambda success, failed: done.set(),
+    )
+    done.wait()
@@ -0,0 +1,93 @@
+"""插图的派生版本：AVIF / WebP 的全尺寸与缩略图（依赖可选的 Pillow）。
+
+原图以 sha256(内容).png 存于 static/images；派生文件与原图同目录、同名前缀：
+<sha>.<格式>（原尺寸）与 <sha>.w<宽度>.<格式>（缩略图），前端按浏览器支持的格式与
+显示宽度用 <picture>/srcset 选取。派生文件已存在时直接复用，同一张图只编码一次。
+未安装 Pillow、或 Pillow 不支持某种格式时跳过对应版本，前端回落到原图 PNG。
+"""
+import os
+import tempfile
+try:
+    from PIL import Image, features
+except ImportError:  # 可选依赖：pip install Pillow
+    Image = None
+    features = None
+
+_ENCODE_OPTIONS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "avif": ("AVIF", {"quality": 60, "speed": 8}),
+}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def enabled() -> bool:
+    return available() and os.getenv("STORYIMAGE_RENDITIONS", "1").strip().lower() not in ("0", "false", "no")
+
+
+def _formats() -> list[str]:
+    raw = os.getenv("STORYIMAGE_RENDITION_FORMATS", "avif,webp")
+    return [f for f in (s.strip().lower() for s in raw.split(",")) if f in _ENCODE_OPTIONS and features.check(f)]
+
+
+def _thumb_widths() -> list[int]:
+    raw = os.getenv("STORYIMAGE_THUMB_WIDTHS", "512,256")
+    return [int(s) for s in raw.split(",") if s.strip().isdigit() and int(s) > 0]
+
+
+def _save(image, path: str, fmt: str) -> None:
+    pil_format, options = _ENCODE_OPTIONS[fmt]
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, pil_format, **options)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def derive(path: str) -> dict[str, dict[str, str]]:
+    """为原图生成派生版本，返回 {格式: {宽度: 文件名}}。"""
+    if not enabled():
+        return {}
+    directory, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    renditions: dict[str, dict[str, str]] = {}
+    try:
+        with Image.open(path) as image:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            for fmt in _formats():
+                variants = renditions.setdefault(fmt, {})
+                for width in [None, *_thumb_widths()]:
+                    if width is not None and width >= image.width:
+                        continue
+                    filename = f"{stem}.{fmt}" if width is None else f"{stem}.w{width}.{fmt}"
+                    target = os.path.join(directory, filename)
+                    if not os.path.exists(target):
+                        variant = image
+                        if width is not None:
+                            variant = image.copy()
+                            variant.thumbnail((width, max(1, width * image.height // image.width)), Image.LANCZOS)
+                        _save(variant, target, fmt)
+                    variants[str(width or image.width)] = filename
+    except Exception as e:
+        print(f"[IMG] rendition failed file={name}: {e}")
+    return {fmt: variants for fmt, variants in renditions.items() if variants}
+
+
+def get_rendition_stats() -> dict:
+    if not available():
+        return {"available": False, "enabled": False}
+    return {
+        "available": True,
+        "enabled": enabled(),
+        "formats": _formats(),
+        "thumbWidths": _thumb_widths(),
+    }
@@ -0,0 +1,217 @@
+"""进程级插图生成调度器。
+
+所有故事的插图任务进入同一个优先队列，由固定数量的 worker 线程执行
+（STORYIMAGE_MAX_CONCURRENCY），因此并发调用图片接口的总数有全局上限。
+
+优先级（数值越小越先执行）：
+1. 页面插图先于互动差分图（interaction delta）；
+2. 每本书的前 STORYIMAGE_PRIORITY_HEAD_PAGES 页先于其余页；
+3. 越新的故事越优先；
+4. 同一本书内按页序。
+
+每个图片服务 URI 各自有一个令牌桶（STORYIMAGE_RATE_PER_MIN / STORYIMAGE_RATE_BURST），
+上游返回 429 时该 URI 暂停发放令牌（优先使用 Retry-After）。
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+KIND_PAGE = "page"
+KIND_DELTA = "delta"
+_KIND_RANK = {KIND_PAGE: 0, KIND_DELTA: 1}
+
+
+def _provider_key(uri: str) -> str:
+    parsed = urlparse(uri)
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path}" if parsed.netloc else uri
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waited_sec = 0.0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_sec > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate_per_sec)
+        self.updated = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.paused_until > now:
+                    wait = self.paused_until - now
+                elif self.rate_per_sec <= 0:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate_per_sec
+                self.waited_sec += wait
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "ratePerMin": round(self.rate_per_sec * 60, 2),
+                "tokens": round(self.tokens, 2),
+                "pausedForSec": round(max(0.0, self.paused_until - time.monotonic()), 1),
+                "rateLimited": self.rate_limited,
+                "waitedSec": round(self.waited_sec, 1),
+            }
+
+
+class ImageScheduler:
+    def __init__(self, max_concurrency: int, head_pages: int, rate_per_min: float, burst: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.head_pages = max(0, head_pages)
+        self.rate_per_sec = max(0.0, rate_per_min) / 60
+        self.burst = burst
+        self._cond = threading.Condition()
+        self._heap: list[tuple] = []
+        self._seq = itertools.count()
+        self._batch_seq = itertools.count(1)
+        self._workers: list[threading.Thread] = []
+        self._buckets: dict[str, _TokenBucket] = {}
+        self._in_flight = 0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0}
+
+    def new_batch(self) -> int:
+        """为一本书分配批次号；批次号越大代表故事越新。"""
+        return next(self._batch_seq)
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        batch: int,
+        page_index: int,
+        kind: str = KIND_PAGE,
+    ) -> Future:
+        future: Future = Future()
+        head_rank = 0 if page_index < self.head_pages else 1
+        priority = (_KIND_RANK.get(kind, 1), head_rank, -batch, page_index, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._heap, (priority, kind, fn, args, future))
+            self._stats["submitted"] += 1
+            self._ensure_workers()
+            self._cond.notify()
+        return future
+
+    def _ensure_workers(self) -> None:
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"image-scheduler-{len(self._workers)}",
+                daemon=True,
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, fn, args, future = heapq.heappop(self._heap)
+                self._in_flight += 1
+            if not future.set_running_or_notify_cancel():
+                with self._cond:
+                    self._in_flight -= 1
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._stats["failed"] += 1
+                future.set_exception(e)
+            else:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._stats["completed"] += 1
+                future.set_result(result)
+
+    def _bucket(self, uri: str) -> _TokenBucket:
+        key = _provider_key(uri)
+        with self._cond:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = _TokenBucket(self.rate_per_sec, self.burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def throttle(self, uri: str) -> None:
+        """每次调用上游图片接口前获取该 URI 的令牌，必要时阻塞等待。"""
+        self._bucket(uri).acquire()
+
+    def report_rate_limited(self, uri: str, retry_after_sec: Optional[float] = None) -> None:
+        pause = retry_after_sec if retry_after_sec and retry_after_sec > 0 else float(
+            os.getenv("STORYIMAGE_RATE_LIMIT_PAUSE_SEC", "20")
+        )
+        self._bucket(uri).pause(pause)
+        print(f"[IMG] provider rate limited, pausing {pause:.0f}s uri={_provider_key(uri)}")
+
+    def stats(self) -> dict:
+        with self._cond:
+            by_kind = {KIND_PAGE: 0, KIND_DELTA: 0}
+            for entry in self._heap:
+                by_kind[entry[1]] = by_kind.get(entry[1], 0) + 1
+            stats = {
+                "maxConcurrency": self.max_concurrency,
+                "queueDepth": len(self._heap),
+                "queueDepthByKind": by_kind,
+                "inFlight": self._in_flight,
+                **self._stats,
+            }
+            buckets = dict(self._buckets)
+        stats["providers"] = {key: bucket.stats() for key, bucket in buckets.items()}
+        return stats
+
+
+_scheduler: Optional[ImageScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ImageScheduler:
+    global _scheduler
+    if _scheduler is not None:
+        return _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ImageScheduler(
+                max_concurrency=int(os.getenv("STORYIMAGE_MAX_CONCURRENCY", "4")),
+                head_pages=int(os.getenv("STORYIMAGE_PRIORITY_HEAD_PAGES", "2")),
+                rate_per_min=float(os.getenv("STORYIMAGE_RATE_PER_MIN", "0")),
+                burst=int(os.getenv("STORYIMAGE_RATE_BURST", "4")),
+            )
+        return _scheduler
+
+
+def get_scheduler_stats() -> dict:
+    with _scheduler_lock:
+        scheduler = _scheduler
+    if scheduler is None:
+        return {"started": False}
+    return {"started": True, **scheduler.stats()}
@@ -0,0 +1,54 @@
+"""LLM 调用的 token 用量记录（只依赖标准库）。
+
+episode / story_arc / summarizer 模块会被复制到隔离子进程或在常驻 worker 进程中运行，
+不能直接写库：它们通过 on_usage 回调交出 usage_record() 生成的记录，由调用方
+（episode_engine / continuity_pool / feedback_words）交给 usage_store 持久化。
+"""
+import time
+from typing import Any, Callable, Dict, Optional
+
+OnUsage = Callable[[Dict[str, Any]], None]
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_record(kind: str, model: Optional[str], usage: Any, latency_ms: float) -> Dict[str, Any]:
+    """把 SDK 的 response.usage 对象或原始 JSON 的 usage 字典整理为一条记录。"""
+    details = _field(usage, "prompt_tokens_details")
+    return {
+        "kind": kind,
+        "model": model or "",
+        "prompt_tokens": int(_field(usage, "prompt_tokens") or 0),
+        "cached_tokens": int(_field(details, "cached_tokens") or 0),
+        "completion_tokens": int(_field(usage, "completion_tokens") or 0),
+        "latency_ms": round(latency_ms, 1),
+    }
+
+
+def report(
+    on_usage: Optional[OnUsage],
+    kind: str,
+    model: Optional[str],
+    usage: Any,
+    started: float,
+) -> None:
+    """started 为 time.monotonic() 的调用开始时间；回调异常只打印，不影响调用本身。"""
+    if on_usage is None:
+        return
+    forward(on_usage, usage_record(kind, model, usage, (time.monotonic() - started) * 1000))
+
+
+def forward(on_usage: Optional[OnUsage], record: Dict[str, Any]) -> None:
+    """转交一条已生成的记录（子进程 / worker 进程回传的 usage）。"""
+    if on_usage is None:
+        return
+    try:
+        on_usage(record)
+    except Exception as e:
+        print(f"[WARN] llm usage report failed kind={record.get('kind')}: {e}")
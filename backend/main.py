@@ -6,7 +6,13 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from database import init_db
+from database import close_pools, init_db
+import episode_engine
+import continuity_pool
+import story_jobs
+import telemetry_buffer
+import tts_presynth
+import upstream_http
 from routers import story, session, telemetry, feedback, tts
 from routers import feedback_words as feedback_words_router
 from routers import export as export_router
@@ -60,6 +66,26 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 @app.on_event("startup")
 def startup():
     init_db()
+    telemetry_buffer.start()
+    story.recover_interrupted_jobs()
+    episode_engine.warm_up()
+    continuity_pool.warm_up()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    story_jobs.shutdown()
+    tts_presynth.shutdown()
+    telemetry_buffer.shutdown()
+    episode_engine.shutdown()
+    continuity_pool.shutdown()
+    upstream_http.close_clients()
+    close_pools()
+
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await upstream_http.aclose_clients()
 
 
 @app.get("/health")
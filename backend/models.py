@@ -36,6 +36,7 @@ class StoryConfig(BaseModel):
 
 class GenerateRequest(BaseModel):
     theme_food: Optional[str] = None
+    child_id: Optional[str] = None
     child_profile: ChildProfile
     meal_context: MealContext
     story_config: StoryConfig
@@ -94,7 +95,8 @@ class TelemetryEvent(BaseModel):
     payload: Optional[dict[str, Any]] = None
 
 class TelemetryReportRequest(BaseModel):
-    events: list[TelemetryEvent]
+    # 逐条校验（见 routers/telemetry.py），单条格式错误只计入 rejected，不拒绝整批
+    events: list[Any]
 
 class TelemetryReportResponse(BaseModel):
     accepted: int
@@ -1,7 +1,19 @@
 import os
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Header
-from database import get_backend_stats, get_telemetry_stats
+from database import get_pool_stats
+import continuity_pool
+import episode_engine
+import image_cache
+import image_renditions
+import image_scheduler
+import stats_store
+import story_jobs
+import telemetry_buffer
+import tts_cache
+import tts_presynth
+import upstream_http
+import usage_store
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
@@ -17,6 +29,40 @@ def _check_admin_key(x_admin_key: Optional[str]):
 @router.get("/stats")
 def admin_stats(x_admin_key: Optional[str] = Header(None)):
     _check_admin_key(x_admin_key)
-    stats = get_backend_stats()
-    stats["telemetry"] = get_telemetry_stats()
-    return stats
+    return stats_store.get_admin_stats()
+
+
+@router.post("/stats/rebuild")
+def admin_stats_rebuild(x_admin_key: Optional[str] = Header(None)):
+    """从原表重算汇总表（手工改库导致计数漂移时使用）。"""
+    _check_admin_key(x_admin_key)
+    stats_store.rebuild()
+    return stats_store.get_admin_stats()
+
+
+@router.get("/runtime")
+def admin_runtime(x_admin_key: Optional[str] = Header(None)):
+    """进程内调度器/线程池的实时状态（队列深度、并发、失败计数）。"""
+    _check_admin_key(x_admin_key)
+    return {
+        "image_queue": image_scheduler.get_scheduler_stats(),
+        "image_cache": image_cache.get_cache_stats(),
+        "image_renditions": image_renditions.get_rendition_stats(),
+        "story_jobs": story_jobs.get_scheduler_stats(),
+        "episode_engine": episode_engine.get_engine_stats(),
+        "continuity_pool": continuity_pool.get_pool_stats(),
+        "db_pool": get_pool_stats(),
+        "telemetry_buffer": telemetry_buffer.get_buffer_stats(),
+        "admin_stats_cache": stats_store.get_cache_stats(),
+        "tts_cache": tts_cache.get_cache_stats(),
+        "tts_presynth": tts_presynth.get_presynth_stats(),
+        "upstream_http": upstream_http.get_upstream_stats(),
+        "llm_usage": usage_store.get_usage_stats(),
+    }
+
+
+@router.get("/llm-usage")
+def admin_llm_usage(days: int = 7, x_admin_key: Optional[str] = Header(None)):
+    """最近 days 天各类 LLM 调用的 token 用量与 prompt 缓存命中率。"""
+    _check_admin_key(x_admin_key)
+    return usage_store.summarize(days)
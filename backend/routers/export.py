@@ -1,14 +1,18 @@
-import json
 import csv
 import io
 import os
-from typing import Optional
+import zlib
+from typing import Any, Callable, Iterable, Iterator, Optional
 from fastapi import APIRouter, HTTPException, Header, Query
-from fastapi.responses import StreamingResponse
-from database import get_db
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import columnar_export
+from database import get_read_db
 
 router = APIRouter(prefix="/api/v1/export", tags=["export"])
 
+_CSV_CHUNK_BYTES = 64 * 1024
+
 
 def _check_admin(x_admin_key: Optional[str] = None, key: Optional[str] = None):
     expected = os.environ.get("ADMIN_API_KEY", "")
@@ -18,188 +22,326 @@ def _check_admin(x_admin_key: Optional[str] = None, key: Optional[str] = None):
         raise HTTPException(403, detail="forbidden")
 
 
-def _rows_to_csv(rows, filename: str) -> StreamingResponse:
-    output = io.StringIO()
-    writer = csv.writer(output)
-    if rows:
-        writer.writerow(rows[0].keys())
-        for r in rows:
-            writer.writerow(r)
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
+def _page_size() -> int:
+    return max(1, int(os.getenv("EXPORT_PAGE_SIZE", "2000")))
+
+
+def _normalize_ts(value: Optional[str]) -> Optional[str]:
+    """created_at 为 'YYYY-MM-DD HH:MM:SS' 文本；接受日期或 ISO 时间（T 分隔）。"""
+    if not value:
+        return None
+    return value.strip().replace("T", " ").rstrip("Z")
+
+
+def _iter_keyset(
+    source: str,
+    columns: str,
+    filters: list[tuple[str, tuple]],
+    key: tuple[str, str],
+    *,
+    descending: bool,
+) -> Iterator[Any]:
+    """按 (key[0], key[1]) 做 keyset 分页逐页读取；每页一个短读事务，内存占用与表大小无关。"""
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    page_size = _page_size()
+    last: Optional[tuple] = None
+    while True:
+        conds = [cond for cond, _ in filters]
+        params: list[Any] = [p for _, values in filters for p in values]
+        if last is not None:
+            conds.append(f"({key[0]}, {key[1]}) {op} (?, ?)")
+            params.extend(last)
+        where = f" WHERE {' AND '.join(conds)}" if conds else ""
+        sql = (
+            f"SELECT {columns}, {key[0]} AS _k0, {key[1]} AS _k1 FROM {source}{where} "
+            f"ORDER BY {key[0]} {direction}, {key[1]} {direction} LIMIT ?"
+        )
+        with get_read_db() as db:
+            rows = db.execute(sql, (*params, page_size)).fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = (rows[-1]["_k0"], rows[-1]["_k1"])
+
+
+def _csv_chunks(header: list[str], rows: Iterable[Any], to_values: Callable[[Any], list]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(to_values(row))
+        if buf.tell() >= _CSV_CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → gzip 容器
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _csv_response(
+    filename: str,
+    header: list[str],
+    rows: Iterable[Any],
+    to_values: Callable[[Any], list],
+    accept_encoding: Optional[str],
+) -> StreamingResponse:
+    chunks = _csv_chunks(header, rows, to_values)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if "gzip" in (accept_encoding or "").lower():
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        return StreamingResponse(_gzip_chunks(chunks), media_type="text/csv", headers=headers)
+    return StreamingResponse((chunk.encode("utf-8") for chunk in chunks), media_type="text/csv", headers=headers)
+
+
+def _range_filters(column: str, since: Optional[str], until: Optional[str]) -> list[tuple[str, tuple]]:
+    filters: list[tuple[str, tuple]] = []
+    if _normalize_ts(since):
+        filters.append((f"{column} >= ?", (_normalize_ts(since),)))
+    if _normalize_ts(until):
+        filters.append((f"{column} < ?", (_normalize_ts(until),)))
+    return filters
+
+
+def _child_session_filter(column: str, child_id: Optional[str]) -> list[tuple[str, tuple]]:
+    if not child_id:
+        return []
+    return [(f"{column} IN (SELECT session_id FROM sessions WHERE child_id = ?)", (child_id,))]
+
+
+def _table_export(
+    table: str,
+    columns: list[str],
+    filename: str,
+    filters: list[tuple[str, tuple]],
+    accept_encoding: Optional[str],
+) -> StreamingResponse:
+    rows = _iter_keyset(table, ", ".join(columns), filters, ("created_at", "rowid"), descending=True)
+    return _csv_response(filename, columns, rows, lambda r: [r[c] for c in columns], accept_encoding)
 
 
 @router.get("/child/{child_id}")
-def export_child_data(child_id: str):
+def export_child_data(
+    child_id: str,
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     """导出某个孩子所有 session 数据为 CSV，供学术分析使用。"""
-    with get_db() as db:
-        rows = db.execute("""
-            SELECT
+    source = """sessions s
+            LEFT JOIN stories st  ON s.story_id   = st.story_id
+            LEFT JOIN feedback f  ON s.session_id = f.session_id
+            LEFT JOIN sus_responses sus ON s.session_id = sus.session_id"""
+    columns = """
                 s.session_index,
                 s.session_id,
                 s.story_id,
                 s.child_id,
                 s.created_at  AS session_start,
-                st.story_json,
+                st.title      AS story_title,
+                st.theme_food AS target_food,
+                st.story_type,
+                st.page_count,
                 f.status      AS feedback_status,
                 f.try_level,
                 f.abort_reason,
                 f.notes       AS feedback_notes,
                 sus.answers   AS sus_answers,
-                sus.sus_score
-            FROM sessions s
-            LEFT JOIN stories st  ON s.story_id   = st.story_id
-            LEFT JOIN feedback f  ON s.session_id = f.session_id
-            LEFT JOIN sus_responses sus ON s.session_id = sus.session_id
-            WHERE s.child_id = ?
-            ORDER BY s.session_index
-        """, (child_id,)).fetchall()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
+                sus.sus_score"""
+    filters = [("s.child_id = ?", (child_id,))] + _range_filters("s.created_at", since, until)
+    rows = _iter_keyset(source, columns, filters, ("s.session_index", "s.rowid"), descending=False)
+    header = [
         'session_index', 'session_id', 'session_start',
         'story_id', 'story_title', 'target_food', 'story_type', 'page_count',
         'feedback_status', 'try_level', 'abort_reason', 'feedback_notes',
         'sus_score', 'sus_answers',
-    ])
+    ]
 
-    for row in rows:
-        story_meta: dict = {}
-        if row['story_json']:
-            try:
-                story = json.loads(row['story_json'])
-                meta = story.get('book_meta', {})
-                story_meta = {
-                    'title': meta.get('title', ''),
-                    'food': meta.get('theme_food', ''),
-                    'type': meta.get('story_type', ''),
-                    'pages': len(story.get('pages', [])),
-                }
-            except Exception:
-                pass
-
-        writer.writerow([
+    def to_values(row) -> list:
+        return [
             row['session_index'], row['session_id'], row['session_start'],
-            row['story_id'], story_meta.get('title', ''), story_meta.get('food', ''),
-            story_meta.get('type', ''), story_meta.get('pages', ''),
+            row['story_id'], row['story_title'] or '', row['target_food'] or '',
+            row['story_type'] or '', row['page_count'] if row['story_id'] else '',
             row['feedback_status'], row['try_level'], row['abort_reason'], row['feedback_notes'],
             row['sus_score'], row['sus_answers'],
-        ])
+        ]
 
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type='text/csv',
-        headers={'Content-Disposition': f'attachment; filename="child_{child_id}.csv"'},
-    )
+    return _csv_response(f"child_{child_id}.csv", header, rows, to_values, accept_encoding)
 
 
 # ─── Admin CSV Exports ─────────────────────────────────────
+# 均按 created_at DESC 流式输出；支持 since / until（created_at 区间，左闭右开）与 child_id 过滤。
 
 @router.get("/admin/sessions.csv")
 def export_admin_sessions(
     x_admin_key: Optional[str] = Header(None),
     key: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    child_id: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     _check_admin(x_admin_key, key)
-    with get_db() as db:
-        rows = db.execute("""
-            SELECT session_id, story_id, child_id, session_index,
-                   client_session_token, status, created_at
-            FROM sessions ORDER BY created_at DESC
-        """).fetchall()
-    return _rows_to_csv(rows, "sessions.csv")
+    filters = _range_filters("created_at", since, until)
+    if child_id:
+        filters.append(("child_id = ?", (child_id,)))
+    return _table_export(
+        "sessions",
+        ["session_id", "story_id", "child_id", "session_index", "client_session_token", "status", "created_at"],
+        "sessions.csv",
+        filters,
+        accept_encoding,
+    )
 
 
 @router.get("/admin/telemetry.csv")
 def export_admin_telemetry(
     x_admin_key: Optional[str] = Header(None),
     key: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    child_id: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     _check_admin(x_admin_key, key)
-    with get_db() as db:
-        rows = db.execute("""
-            SELECT event_id, session_id, story_id, page_id,
-                   event_type, payload, ts_client_ms, created_at
-            FROM telemetry_events ORDER BY created_at DESC
-        """).fetchall()
-    return _rows_to_csv(rows, "telemetry.csv")
+    return _table_export(
+        "telemetry_events",
+        ["event_id", "session_id", "story_id", "page_id", "event_type", "payload", "ts_client_ms", "created_at"],
+        "telemetry.csv",
+        _range_filters("created_at", since, until) + _child_session_filter("session_id", child_id),
+        accept_encoding,
+    )
 
 
 @router.get("/admin/feedback.csv")
 def export_admin_feedback(
     x_admin_key: Optional[str] = Header(None),
     key: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    child_id: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     _check_admin(x_admin_key, key)
-    with get_db() as db:
-        rows = db.execute("""
-            SELECT id, session_id, status, try_level, abort_reason, notes, created_at
-            FROM feedback ORDER BY created_at DESC
-        """).fetchall()
-    return _rows_to_csv(rows, "feedback.csv")
+    return _table_export(
+        "feedback",
+        ["id", "session_id", "status", "try_level", "abort_reason", "notes", "created_at"],
+        "feedback.csv",
+        _range_filters("created_at", since, until) + _child_session_filter("session_id", child_id),
+        accept_encoding,
+    )
 
 
 @router.get("/admin/sus.csv")
 def export_admin_sus(
     x_admin_key: Optional[str] = Header(None),
     key: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    child_id: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     _check_admin(x_admin_key, key)
-    with get_db() as db:
-        rows = db.execute("""
-            SELECT id, session_id, answers, sus_score, created_at
-            FROM sus_responses ORDER BY created_at DESC
-        """).fetchall()
-    return _rows_to_csv(rows, "sus.csv")
+    return _table_export(
+        "sus_responses",
+        ["id", "session_id", "answers", "sus_score", "created_at"],
+        "sus.csv",
+        _range_filters("created_at", since, until) + _child_session_filter("session_id", child_id),
+        accept_encoding,
+    )
 
 
 @router.get("/admin/stories.csv")
 def export_admin_stories(
     x_admin_key: Optional[str] = Header(None),
     key: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    child_id: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     _check_admin(x_admin_key, key)
-    with get_db() as db:
-        raw = db.execute("""
-            SELECT story_id, parent_story_id, child_id, regen_count, story_json, created_at
-            FROM stories ORDER BY created_at DESC
-        """).fetchall()
-    # Extract book_meta fields, omit full story_json
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
+    # 书级元数据直接取自 stories 列，不反序列化整本书
+    columns = [
         "story_id", "parent_story_id", "child_id", "regen_count",
         "title", "summary", "theme_food", "story_type", "page_count", "created_at",
-    ])
-    for r in raw:
-        meta: dict = {}
-        if r["story_json"]:
-            try:
-                story = json.loads(r["story_json"])
-                bm = story.get("book_meta", {})
-                meta = {
-                    "title": bm.get("title", ""),
-                    "summary": bm.get("summary", ""),
-                    "theme_food": bm.get("theme_food", ""),
-                    "story_type": bm.get("story_type", ""),
-                    "page_count": len(story.get("pages", [])),
-                }
-            except Exception:
-                pass
-        writer.writerow([
+    ]
+    filters = _range_filters("created_at", since, until)
+    if child_id:
+        filters.append(("child_id = ?", (child_id,)))
+    rows = _iter_keyset("stories", ", ".join(columns), filters, ("created_at", "rowid"), descending=True)
+
+    def to_values(r) -> list:
+        return [
             r["story_id"], r["parent_story_id"], r["child_id"], r["regen_count"],
-            meta.get("title", ""), meta.get("summary", ""), meta.get("theme_food", ""),
-            meta.get("story_type", ""), meta.get("page_count", ""), r["created_at"],
-        ])
-    output.seek(0)
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": 'attachment; filename="stories.csv"'},
+            r["title"] or "", r["summary"] or "", r["theme_food"] or "",
+            r["story_type"] or "", r["page_count"], r["created_at"],
+        ]
+
+    return _csv_response("stories.csv", columns, rows, to_values, accept_encoding)
+
+
+# ─── Admin Columnar Exports ────────────────────────────────
+# Parquet / Arrow IPC，按 rowid 增量导出：把响应头 X-Export-Watermark 作为下次的 since_rowid。
+
+_COLUMNAR_MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+
+def _columnar_export(table: str, fmt: str, since_rowid: int, max_rows: Optional[int]) -> FileResponse:
+    if table not in columnar_export.TABLES:
+        raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": f"unknown table: {table}"}})
+    if not columnar_export.available():
+        raise HTTPException(501, detail={
+            "error": {"code": "COLUMNAR_UNAVAILABLE", "message": "pyarrow is not installed on the server"}
+        })
+    path, info = columnar_export.export_table(table, fmt, after_rowid=since_rowid, max_rows=max_rows)
+    filename = f"{table}_{since_rowid}_{info['watermark']}.{info['format']}"
+    return FileResponse(
+        path,
+        media_type=_COLUMNAR_MEDIA_TYPES[info["format"]],
+        filename=filename,
+        headers={
+            "X-Export-Format": info["format"],
+            "X-Export-Rows": str(info["rows"]),
+            "X-Export-Watermark": str(info["watermark"]),
+            "X-Export-Has-More": "1" if info["has_more"] else "0",
+        },
+        background=BackgroundTask(os.remove, path),
     )
+
+
+@router.get("/admin/{table}.parquet")
+def export_admin_parquet(
+    table: str,
+    x_admin_key: Optional[str] = Header(None),
+    key: Optional[str] = Query(None),
+    since_rowid: int = Query(0, ge=0),
+    max_rows: Optional[int] = Query(None, ge=1),
+):
+    """未安装 parquet 支持时退回 Arrow IPC（见 X-Export-Format）。"""
+    _check_admin(x_admin_key, key)
+    return _columnar_export(table, "parquet", since_rowid, max_rows)
+
+
+@router.get("/admin/{table}.arrow")
+def export_admin_arrow(
+    table: str,
+    x_admin_key: Optional[str] = Header(None),
+    key: Optional[str] = Query(None),
+    since_rowid: int = Query(0, ge=0),
+    max_rows: Optional[int] = Query(None, ge=1),
+):
+    _check_admin(x_admin_key, key)
+    return _columnar_export(table, "arrow", since_rowid, max_rows)
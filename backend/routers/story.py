@@ -1,18 +1,34 @@
 import json
 import uuid
 import copy
-import threading
 import traceback
 from datetime import datetime, timezone
+from typing import Any, Optional
 from fastapi import APIRouter, HTTPException
 from openai import RateLimitError
 from models import GenerateRequest, RegenerateRequest
-from database import get_db
-from episode_text import generate_story_from_episode
-from image_gen import generate_images_for_pages
+from database import get_db, get_read_db
+from episode_text import build_placeholder_content, generate_story_from_episode
+from episode_engine import streaming_enabled
+from image_gen import prestart_page_images, schedule_images_for_pages
+import story_jobs
+import story_store
+import tts_presynth
+import usage_store
 
 router = APIRouter(prefix="/api/v1/story", tags=["story"])
 
+# 保存原始请求参数，供 regenerate 时复用
+_REQUEST_ECHO_KEYS = (
+    "child_profile",
+    "meal_context",
+    "story_config",
+    "story_arc",
+    "recap_and_goal",
+    "temporal_characteristics",
+    "recent_story",
+)
+
 
 def _build_draft(story_content: dict, story_id: str) -> dict:
     return {
@@ -26,131 +42,319 @@ def _build_draft(story_content: dict, story_id: str) -> dict:
     }
 
 
-def _generate_images_bg(story_id: str, draft_copy: dict):
-    """后台线程：并行生成图片后更新数据库。"""
-    global_style = ""
-    visual_canon = draft_copy.get("visual_canon") if isinstance(draft_copy.get("visual_canon"), dict) else None
-    page_image_prompt_packages = (
-        draft_copy.get("page_image_prompt_packages")
-        if isinstance(draft_copy.get("page_image_prompt_packages"), list)
-        else None
-    )
+def _attach_request_echo(draft: dict, echo: dict) -> dict:
+    draft["child_profile"] = echo.get("child_profile") or {}
+    draft["meal_context"] = echo.get("meal_context")
+    draft["story_config"] = echo.get("story_config")
+    for key in ("story_arc", "recap_and_goal", "temporal_characteristics"):
+        if echo.get(key):
+            draft[key] = echo[key]
+    if echo.get("recent_story") is not None:
+        draft["recent_story"] = echo["recent_story"]
+    return draft
+
+
+def _load_draft(story_id: str) -> Optional[dict]:
+    with get_read_db() as db:
+        return story_store.load_draft(db, story_id)
+
+
+def _save_page_image(story_id: str, page_index: int, field: str, url: str, renditions: dict) -> dict:
+    """单页图片落盘后立即写回 story_pages 的对应行，返回最新插图进度。"""
+    with get_db() as db:
+        story_store.set_page_image(db, story_id, page_index, field, url, renditions)
+        return story_store.images_progress(db, story_id)
+
+
+def _set_generation_status(story_id: str, status: str) -> None:
+    with get_db() as db:
+        story_store.set_generation_status(db, story_id, status)
+
+
+def _mark_story_error(story_id: str, error_code: str, message: str) -> None:
+    with get_db() as db:
+        story_store.set_generation_status(db, story_id, "ERROR", error=message, error_code=error_code)
+
+
+def _fail_job(job_id: str, story_id: str, error_code: str, message: str) -> None:
+    _mark_story_error(story_id, error_code, message)
+    story_jobs.finish_job(job_id, error_code=error_code, error=message)
+
+
+def _child_avatar(draft: dict) -> Optional[dict]:
     temporal_characteristics = (
-        draft_copy.get("temporal_characteristics")
-        if isinstance(draft_copy.get("temporal_characteristics"), dict)
+        draft.get("temporal_characteristics")
+        if isinstance(draft.get("temporal_characteristics"), dict)
         else {}
     )
-    child_avatar = (
+    return (
         temporal_characteristics.get("child_avatar")
         if isinstance(temporal_characteristics.get("child_avatar"), dict)
         else None
     )
+
+
+def _start_image_stage(story_id: str, draft_copy: dict, job_id: Optional[str] = None) -> None:
+    """把插图任务交给全局图片调度器；全部完成后在调度器线程中持久化并结束任务。"""
+    global_style = ""
+    visual_canon = draft_copy.get("visual_canon") if isinstance(draft_copy.get("visual_canon"), dict) else None
+    page_image_prompt_packages = (
+        draft_copy.get("page_image_prompt_packages")
+        if isinstance(draft_copy.get("page_image_prompt_packages"), list)
+        else None
+    )
+    child_avatar = _child_avatar(draft_copy)
     if not visual_canon:
         global_style = draft_copy.get("book_meta", {}).get("global_visual_style", "")
+
+    def on_image_saved(page_index: int, field: str, url: str, renditions: dict) -> None:
+        images = _save_page_image(story_id, page_index, field, url, renditions)
+        if job_id and field == "image_url" and images["total"]:
+            story_jobs.update_job(job_id, progress=round(0.5 + 0.5 * images["ready"] / images["total"], 3))
+
+    def on_complete(success: int, failed: int) -> None:
+        try:
+            _set_generation_status(story_id, "READY")
+        except Exception as e:
+            traceback.print_exc()
+            if job_id:
+                _fail_job(job_id, story_id, "IMAGE_ERROR", str(e))
+            return
+        if job_id:
+            story_jobs.finish_job(job_id)
+        print(f"[INFO] IMG generation done story_id={story_id}")
+
     print(f"[INFO] IMG generation start story_id={story_id}")
-    generate_images_for_pages(
-        draft_copy["pages"],
-        global_style,
-        visual_canon=visual_canon,
-        page_image_prompt_packages=page_image_prompt_packages,
-        child_avatar=child_avatar,
-    )
-    with get_db() as db:
-        db.execute(
-            "UPDATE stories SET story_json = ? WHERE story_id = ?",
-            (json.dumps(draft_copy), story_id),
+    try:
+        schedule_images_for_pages(
+            draft_copy["pages"],
+            global_style,
+            visual_canon=visual_canon,
+            page_image_prompt_packages=page_image_prompt_packages,
+            child_avatar=child_avatar,
+            on_complete=on_complete,
+            on_image_saved=on_image_saved,
         )
-    print(f"[INFO] IMG generation done story_id={story_id}")
+    except Exception as e:
+        traceback.print_exc()
+        if job_id:
+            _fail_job(job_id, story_id, "IMAGE_ERROR", str(e))
 
 
-@router.get("/{story_id}")
-def story_get(story_id: str):
+def _save_audio(story_id: str, page_index: Optional[int], segment: str, url: str) -> None:
     with get_db() as db:
-        row = db.execute(
-            "SELECT story_json FROM stories WHERE story_id = ?",
-            (story_id,),
-        ).fetchone()
-    if not row:
-        raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "story not found"}})
-    return {"draft": json.loads(row["story_json"])}
+        if page_index is None:
+            story_store.set_ending_audio(db, story_id, segment, url)
+        else:
+            story_store.set_page_audio(db, story_id, page_index, segment, url)
 
 
-@router.post("/generate")
-def story_generate(req: GenerateRequest):
-    child_profile = req.child_profile.model_dump()
-    meal_context = req.meal_context.model_dump()
-    story_config = req.story_config.model_dump()
-    story_arc = req.story_arc or {}
-    recap_and_goal = req.recap_and_goal or {}
-    temporal_characteristics = req.temporal_characteristics or {}
-    recent_story = req.recent_story
+def _start_audio_stage(story_id: str, draft: dict) -> None:
+    """文案定稿后整本预合成朗读音频，与插图并行，不影响任务进度与 READY 状态。"""
+    count = tts_presynth.schedule_story(
+        story_id,
+        draft,
+        lambda page_index, segment, url: _save_audio(story_id, page_index, segment, url),
+    )
+    if count:
+        print(f"[INFO] tts presynth queued story_id={story_id} segments={count}")
+
+
+def _run_generation_job(
+    job_id: str,
+    story_id: str,
+    params: dict,
+    echo: dict,
+    parent_story_id: Optional[str] = None,
+) -> None:
+    """任务主体：生成文案 → 持久化完整 draft → 交给后台图片线程。
+
+    regenerate 时 parent_story_id 为原故事，文案成功落库的同一事务中才计入其 regen_count。
+    流式生成时，文案输出中每页插图提示词一到齐就提前排队插图，不必等整份 JSON 结束。
+    """
+    story_jobs.update_job(job_id, status="RUNNING", stage="text", progress=0.1)
+    on_partial = prestart_page_images(_child_avatar(echo)) if streaming_enabled() else None
     try:
-        print("[INFO] story_generate episode_module start")
+        print(f"[INFO] story_job text start story_id={story_id} stream={on_partial is not None}")
         content = generate_story_from_episode(
-            theme_food=req.theme_food or req.meal_context.target_food,
-            child_profile=child_profile,
-            meal_context=meal_context,
-            story_config=story_config,
-            story_arc=story_arc,
-            recap_and_goal=recap_and_goal,
-            temporal_characteristics=temporal_characteristics,
-            recent_story=recent_story,
+            **params,
+            on_partial=on_partial,
+            on_usage=lambda record: usage_store.record(record, story_id=story_id),
         )
-        print("[INFO] story_generate episode_module done")
+        print(f"[INFO] story_job text done story_id={story_id}")
     except RateLimitError:
-        raise HTTPException(429, detail={"error": {"code": "RATE_LIMIT", "message": "AI 生成频率超限，请等待 1 分钟后重试。"}})
+        _fail_job(job_id, story_id, "RATE_LIMIT", "AI 生成频率超限，请等待 1 分钟后重试。")
+        return
     except json.JSONDecodeError as e:
         traceback.print_exc()
-        raise HTTPException(500, detail={"error": {"code": "LLM_PARSE_ERROR", "message": str(e)}})
+        _fail_job(job_id, story_id, "LLM_PARSE_ERROR", str(e))
+        return
     except Exception as e:
         traceback.print_exc()
-        raise HTTPException(500, detail={"error": {"code": "INTERNAL_ERROR", "message": str(e)}})
+        _fail_job(job_id, story_id, "INTERNAL_ERROR", str(e))
+        return
 
+    draft = _attach_request_echo(_build_draft(content, story_id), echo)
+    draft["generation_status"] = "GENERATING_IMAGES"
+    with get_db() as db:
+        story_store.save_draft(db, story_id, draft)
+        if parent_story_id:
+            db.execute(
+                "UPDATE stories SET regen_count = regen_count + 1 WHERE story_id = ?",
+                (parent_story_id,),
+            )
+    story_jobs.update_job(job_id, stage="images", progress=0.5)
+    story_jobs.release_dedupe(job_id)
+
+    # 插图由全局调度器排队执行，不占用文案任务的 worker
+    _start_image_stage(story_id, copy.deepcopy(draft), job_id)
+    _start_audio_stage(story_id, draft)
+
+
+def _submit_generation(
+    *,
+    child_id: Optional[str],
+    kind: str,
+    dedupe_key: Optional[str],
+    params: dict,
+    echo: dict,
+    insert_story,
+    parent_story_id: Optional[str] = None,
+) -> dict:
     story_id = "st_" + uuid.uuid4().hex[:16]
-    draft = _build_draft(content, story_id)
-    # 保存原始请求参数，供 regenerate 时复用
-    draft["child_profile"] = child_profile
-    draft["meal_context"] = meal_context
-    draft["story_config"] = story_config
-    if story_arc:
-        draft["story_arc"] = story_arc
-    if recap_and_goal:
-        draft["recap_and_goal"] = recap_and_goal
-    if temporal_characteristics:
-        draft["temporal_characteristics"] = temporal_characteristics
-    if recent_story is not None:
-        draft["recent_story"] = recent_story
+    placeholder = _build_draft(
+        build_placeholder_content(
+            theme_food=params.get("theme_food"),
+            story_arc=params.get("story_arc"),
+            meal_context=params["meal_context"],
+            story_config=params["story_config"],
+            temporal_characteristics=params.get("temporal_characteristics"),
+        ),
+        story_id,
+    )
+    placeholder = _attach_request_echo(placeholder, echo)
+    placeholder["generation_status"] = "GENERATING_TEXT"
 
-    with get_db() as db:
-        db.execute(
-            "INSERT INTO stories (story_id, regen_count, story_json) VALUES (?, 0, ?)",
-            (story_id, json.dumps(draft)),
+    try:
+        job, deduped = story_jobs.submit_job(
+            story_id=story_id,
+            child_id=child_id,
+            kind=kind,
+            dedupe_key=dedupe_key,
+            create_story=lambda db: insert_story(db, story_id, placeholder),
+            run=lambda job_id: _run_generation_job(job_id, story_id, params, echo, parent_story_id),
         )
+    except story_jobs.StoryJobBusy:
+        raise HTTPException(503, detail={"error": {"code": "GENERATION_BUSY", "message": "生成任务排队已满，请稍后重试。"}})
+
+    if deduped:
+        print(f"[INFO] story_{kind} deduped child_id={child_id} story_id={job['story_id']}")
+        return {"draft": _load_draft(job["story_id"]) or placeholder, "job": job, "deduped": True}
+    print(f"[INFO] story_{kind} queued story_id={story_id} job_id={job['job_id']}")
+    return {"draft": placeholder, "job": job, "deduped": False}
+
+
+def recover_interrupted_jobs() -> None:
+    """启动时调用：把上次进程遗留的未完成任务对应的 draft 标记为 ERROR。"""
+    count = story_jobs.recover_orphaned_jobs(
+        lambda job_id, story_id: _mark_story_error(story_id, "INTERRUPTED", "generation interrupted by server restart")
+    )
+    if count:
+        print(f"[INFO] story_jobs recovered interrupted jobs count={count}")
+
+
+@router.get("/{story_id}")
+def story_get(story_id: str):
+    with get_read_db() as db:
+        draft = story_store.load_draft(db, story_id)
+        if draft is None:
+            raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "story not found"}})
+        images = story_store.images_progress(db, story_id)
+    return {
+        "draft": draft,
+        "images": images,
+        "job": story_jobs.get_latest_job_for_story(story_id),
+    }
+
+
+@router.get("/{story_id}/progress")
+def story_progress(story_id: str):
+    """轻量轮询：只读书级元数据列与插图进度，不反序列化整本书。"""
+    with get_read_db() as db:
+        meta = story_store.load_meta(db, story_id)
+        if meta is None:
+            raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "story not found"}})
+        images = story_store.images_progress(db, story_id)
+    return {
+        "story_id": story_id,
+        "generation_status": meta["generation_status"],
+        "images": images,
+        "job": story_jobs.get_latest_job_for_story(story_id),
+    }
+
+
+@router.get("/{story_id}/meta")
+def story_meta(story_id: str):
+    with get_read_db() as db:
+        meta = story_store.load_meta(db, story_id)
+    if meta is None:
+        raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "story not found"}})
+    return meta
+
+
+@router.get("/{story_id}/pages/{page_index}")
+def story_page(story_id: str, page_index: int):
+    with get_read_db() as db:
+        page = story_store.load_page(db, story_id, page_index)
+    if page is None:
+        raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "page not found"}})
+    return {"story_id": story_id, "page_index": page_index, "page": page}
 
-    # 后台异步生成图片，不阻塞接口返回
-    threading.Thread(
-        target=_generate_images_bg,
-        args=(story_id, copy.deepcopy(draft)),
-        daemon=True,
-    ).start()
 
-    return {"draft": draft}
+@router.post("/generate")
+def story_generate(req: GenerateRequest):
+    echo: dict[str, Any] = {
+        "child_profile": req.child_profile.model_dump(),
+        "meal_context": req.meal_context.model_dump(),
+        "story_config": req.story_config.model_dump(),
+        "story_arc": req.story_arc or {},
+        "recap_and_goal": req.recap_and_goal or {},
+        "temporal_characteristics": req.temporal_characteristics or {},
+        "recent_story": req.recent_story,
+    }
+    params = {
+        "theme_food": req.theme_food or req.meal_context.target_food,
+        **echo,
+    }
+
+    def insert_story(db, story_id: str, draft: dict):
+        story_store.insert_story(db, story_id, draft, child_id=req.child_id)
+
+    return _submit_generation(
+        child_id=req.child_id,
+        kind="generate",
+        dedupe_key=f"generate:{req.child_id}" if req.child_id else None,
+        params=params,
+        echo=echo,
+        insert_story=insert_story,
+    )
 
 
 @router.post("/regenerate")
 def story_regenerate(req: RegenerateRequest):
-    with get_db() as db:
+    with get_read_db() as db:
         row = db.execute(
-            "SELECT regen_count, story_json FROM stories WHERE story_id = ?",
+            "SELECT regen_count, child_id FROM stories WHERE story_id = ?",
             (req.previous_story_id,),
         ).fetchone()
+        # 只取复用所需的请求回显，不加载整本书
+        prev_draft = story_store.load_assets(db, req.previous_story_id, _REQUEST_ECHO_KEYS) if row else {}
 
     if not row:
         raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "story not found"}})
     if row["regen_count"] >= 2:
         raise HTTPException(429, detail={"error": {"code": "REGEN_LIMIT_REACHED", "message": "max 2 regenerations"}})
 
-    prev_draft = json.loads(row["story_json"])
     story_config = prev_draft.get("story_config") or {"story_type": "light_fantasy", "pages": 12, "interactive_density": "medium", "language": "zh-CN"}
     # 用户重新生成时选择的新参数覆盖旧配置
     if isinstance(req.story_type, str) and req.story_type.strip():
@@ -173,61 +377,42 @@ def story_regenerate(req: RegenerateRequest):
         "selected_food_instance": req.target_food,
     }
 
-    try:
-        print("[INFO] story_regenerate episode_module start")
-        content = generate_story_from_episode(
-            theme_food=req.theme_food or req.target_food,
-            child_profile=prev_draft.get("child_profile") or {},
-            meal_context=meal_context,
-            story_config=story_config,
-            story_arc=story_arc,
-            recap_and_goal=recap_and_goal,
-            temporal_characteristics=temporal_characteristics,
-            recent_story=prev_draft.get("recent_story"),
-            regenerate_overrides={
-                "pages": req.pages,
-                "difficulty": req.difficulty,
-                "interaction_density": req.interaction_density,
-            },
-        )
-        print("[INFO] story_regenerate episode_module done")
-    except RateLimitError:
-        raise HTTPException(429, detail={"error": {"code": "RATE_LIMIT", "message": "AI 生成频率超限，请等待 1 分钟后重试。"}})
-    except json.JSONDecodeError as e:
-        traceback.print_exc()
-        raise HTTPException(500, detail={"error": {"code": "LLM_PARSE_ERROR", "message": str(e)}})
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(500, detail={"error": {"code": "INTERNAL_ERROR", "message": str(e)}})
-
-    story_id = "st_" + uuid.uuid4().hex[:16]
-    draft = _build_draft(content, story_id)
-    # 保存请求参数，供下一次 regenerate 复用
-    draft["child_profile"] = prev_draft.get("child_profile") or {}
-    draft["meal_context"] = meal_context
-    draft["story_config"] = story_config
-    if story_arc:
-        draft["story_arc"] = story_arc
-    if recap_and_goal:
-        draft["recap_and_goal"] = recap_and_goal
-    if temporal_characteristics:
-        draft["temporal_characteristics"] = temporal_characteristics
+    echo: dict[str, Any] = {
+        "child_profile": prev_draft.get("child_profile") or {},
+        "meal_context": meal_context,
+        "story_config": story_config,
+        "story_arc": story_arc,
+        "recap_and_goal": recap_and_goal,
+        "temporal_characteristics": temporal_characteristics,
+    }
+    params = {
+        "theme_food": req.theme_food or req.target_food,
+        **echo,
+        "recent_story": prev_draft.get("recent_story"),
+        "regenerate_overrides": {
+            "pages": req.pages,
+            "difficulty": req.difficulty,
+            "interaction_density": req.interaction_density,
+        },
+    }
+    child_id = row["child_id"]
 
-    with get_db() as db:
-        db.execute(
-            "INSERT INTO stories (story_id, parent_story_id, regen_count, story_json) VALUES (?, ?, ?, ?)",
-            (story_id, req.previous_story_id, 0, json.dumps(draft)),
-        )
-        db.execute(
-            "UPDATE stories SET regen_count = regen_count + 1 WHERE story_id = ?",
-            (req.previous_story_id,),
+    def insert_story(db, story_id: str, draft: dict):
+        story_store.insert_story(
+            db,
+            story_id,
+            draft,
+            child_id=child_id,
+            parent_story_id=req.previous_story_id,
         )
 
-    # 后台异步生成图片，不阻塞接口返回
-    threading.Thread(
-        target=_generate_images_bg,
-        args=(story_id, copy.deepcopy(draft)),
-        daemon=True,
-    ).start()
-
-    return {"draft": draft}
+    # 同一原故事的 regenerate 去重；不与生成原故事的 generate 任务合并
+    return _submit_generation(
+        child_id=child_id,
+        kind="regenerate",
+        dedupe_key=f"regenerate:{req.previous_story_id}",
+        params=params,
+        echo=echo,
+        insert_story=insert_story,
+        parent_story_id=req.previous_story_id,
+    )
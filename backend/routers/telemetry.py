@@ -1,40 +1,59 @@
 import json
 from fastapi import APIRouter
-from models import TelemetryReportRequest, TelemetryReportResponse
-from database import get_db
+from pydantic import ValidationError
+from models import TelemetryEvent, TelemetryReportRequest, TelemetryReportResponse
+import telemetry_buffer
 
 router = APIRouter(prefix="/api/v1/telemetry", tags=["telemetry"])
 
 
-@router.post("/report", response_model=TelemetryReportResponse)
-def telemetry_report(req: TelemetryReportRequest):
-    accepted = deduped = 0
+def _validate_events(raw_events: list) -> tuple[list[tuple], int, int]:
+    """逐条校验并按 event_id 去掉同批重复，返回 (rows, rejected, deduped_in_batch)。"""
+    rows: list[tuple] = []
+    seen: set[str] = set()
+    rejected = deduped = 0
+    for raw in raw_events:
+        try:
+            event = TelemetryEvent.model_validate(raw)
+        except ValidationError:
+            rejected += 1
+            continue
+        if not event.event_id.strip() or not event.session_id.strip() or not event.event_type.strip():
+            rejected += 1
+            continue
+        if event.event_id in seen:
+            deduped += 1
+            continue
+        seen.add(event.event_id)
+        rows.append((
+            event.event_id,
+            event.session_id,
+            event.story_id,
+            event.page_id,
+            event.event_type,
+            json.dumps(event.payload) if event.payload else None,
+            event.ts_client_ms,
+        ))
+    return rows, rejected, deduped
 
-    with get_db() as db:
-        for event in req.events:
-            # De-duplicate by event_id
-            existing = db.execute(
-                "SELECT 1 FROM telemetry_events WHERE event_id = ?", (event.event_id,)
-            ).fetchone()
 
-            if existing:
-                deduped += 1
-                continue
+@router.post("/report", response_model=TelemetryReportResponse)
+def telemetry_report(req: TelemetryReportRequest):
+    rows, rejected, deduped = _validate_events(req.events)
 
-            db.execute(
-                """INSERT INTO telemetry_events
-                   (event_id, session_id, story_id, page_id, event_type, payload, ts_client_ms)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    event.event_id,
-                    event.session_id,
-                    event.story_id,
-                    event.page_id,
-                    event.event_type,
-                    json.dumps(event.payload) if event.payload else None,
-                    event.ts_client_ms,
-                ),
-            )
-            accepted += 1
+    if telemetry_buffer.enabled():
+        # 写后缓冲：入队即返回；已入队或已入库的 event_id 在入队前剔除，计为 deduped
+        accepted = telemetry_buffer.submit(rows)
+        return TelemetryReportResponse(
+            accepted=accepted,
+            deduped=deduped + len(rows) - accepted,
+            rejected=rejected,
+        )
 
-    return TelemetryReportResponse(accepted=accepted, deduped=deduped, rejected=0)
+    # 同步写入：event_id 主键冲突被 INSERT OR IGNORE 跳过，计为 deduped
+    accepted = telemetry_buffer.insert_rows(rows)
+    return TelemetryReportResponse(
+        accepted=accepted,
+        deduped=deduped + len(rows) - accepted,
+        rejected=rejected,
+    )
@@ -1,14 +1,14 @@
 import io
 import os
 import asyncio
-import json
-import uuid
-import urllib.request
-import urllib.error
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import Response
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, HTTPException, Header, Query, UploadFile, File
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import edge_tts
+import httpx
+import tts_cache
+import upstream_http
 
 router = APIRouter(prefix="/api/v1", tags=["tts", "transcribe"])
 
@@ -19,59 +19,174 @@ VOICE_MAP = {
     "zhishuo":  "zh-CN-YunyangNeural",    # 男声
 }
 DEFAULT_VOICE = "zhimiao"
+TTS_RATE = "-10%"
+TTS_TIMEOUT_SEC = 15
 
 
 class TTSRequest(BaseModel):
     text: str
     voice: str = DEFAULT_VOICE
+    stream: bool = False
+
+
+def _resolve_voice(voice_key: str) -> str:
+    return VOICE_MAP.get(voice_key, VOICE_MAP[DEFAULT_VOICE])
+
+
+def audio_url(key: str) -> str:
+    return f"/api/v1/tts/audio/{key}.mp3"
+
+
+async def _stream_chunks(text: str, voice_key: str) -> AsyncIterator[bytes]:
+    communicate = edge_tts.Communicate(text, voice=_resolve_voice(voice_key), rate=TTS_RATE)
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio" and chunk["data"]:
+            yield chunk["data"]
 
 
 async def _synthesize(text: str, voice_key: str) -> bytes:
-    voice = VOICE_MAP.get(voice_key, VOICE_MAP[DEFAULT_VOICE])
-    communicate = edge_tts.Communicate(text, voice=voice, rate="-10%")
     buf = io.BytesIO()
-    async for chunk in communicate.stream():
-        if chunk["type"] == "audio":
-            buf.write(chunk["data"])
+    async for data in _stream_chunks(text, voice_key):
+        buf.write(data)
     audio = buf.getvalue()
     if not audio:
-        raise RuntimeError(f"edge-tts 合成失败，voice={voice}")
+        raise RuntimeError(f"edge-tts 合成失败，voice={_resolve_voice(voice_key)}")
     return audio
 
 
-@router.post("/tts")
-async def synthesize(req: TTSRequest):
+async def get_or_synthesize(text: str, voice_key: str) -> tuple[str, bytes, bool]:
+    """经缓存合成；返回 (key, audio, 是否命中缓存)。"""
+    key = tts_cache.cache_key(text, _resolve_voice(voice_key), TTS_RATE)
+    audio, hit = await tts_cache.get_cache().get_or_synthesize(
+        key,
+        lambda: asyncio.wait_for(_synthesize(text, voice_key), timeout=TTS_TIMEOUT_SEC),
+    )
+    return key, audio, hit
+
+
+def _etag(key: str) -> str:
+    return f'"{key}"'
+
+
+def _audio_headers(key: str) -> dict:
+    return {
+        "ETag": _etag(key),
+        "X-TTS-Audio-Url": audio_url(key),
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+
+
+def _tts_error(e: Exception) -> HTTPException:
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(504, detail={"error": {"code": "TTS_TIMEOUT", "message": "TTS 合成超时"}})
+    return HTTPException(500, detail={"error": {"code": "TTS_ERROR", "message": str(e)}})
+
+
+async def _buffered_response(text: str, voice_key: str, key: str) -> Response:
     try:
-        audio = await asyncio.wait_for(_synthesize(req.text, req.voice), timeout=15)
-    except asyncio.TimeoutError:
-        raise HTTPException(
-            504,
-            detail={"error": {"code": "TTS_TIMEOUT", "message": "TTS 合成超时"}},
-        )
+        _, audio, hit = await get_or_synthesize(text, voice_key)
     except Exception as e:
-        raise HTTPException(
-            500,
-            detail={"error": {"code": "TTS_ERROR", "message": str(e)}},
-        )
-    return Response(content=audio, media_type="audio/mpeg")
-
-
-def _build_multipart(file_bytes: bytes, filename: str, content_type: str, fields: dict) -> tuple[bytes, str]:
-    boundary = uuid.uuid4().hex
-    lines: list[bytes] = []
-    for key, value in fields.items():
-        lines.append(f"--{boundary}\r\n".encode())
-        lines.append(f'Content-Disposition: form-data; name="{key}"\r\n\r\n'.encode())
-        lines.append(str(value).encode())
-        lines.append(b"\r\n")
-    lines.append(f"--{boundary}\r\n".encode())
-    lines.append(f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode())
-    lines.append(f"Content-Type: {content_type}\r\n\r\n".encode())
-    lines.append(file_bytes)
-    lines.append(b"\r\n")
-    lines.append(f"--{boundary}--\r\n".encode())
-    body = b"".join(lines)
-    return body, f"multipart/form-data; boundary={boundary}"
+        raise _tts_error(e)
+    headers = _audio_headers(key)
+    headers["X-TTS-Cache"] = "hit" if hit else "miss"
+    return Response(content=audio, media_type="audio/mpeg", headers=headers)
+
+
+async def _streaming_response(text: str, voice_key: str, key: str) -> Response:
+    """边合成边推送（chunked），完整音频在流结束后写入缓存。
+
+    命中缓存或已有同 key 合成进行中时退回整段返回。等首个音频块最多 TTS_TIMEOUT_SEC，
+    之后任意两块间隔超过该值视为中断。超时用 asyncio.timeout 直接作用于 anext()，不为每块
+    另建任务；中断后生成器由 aclose() 关闭。
+    """
+    cache = tts_cache.get_cache()
+    if await cache.aget(key) is not None or not cache.claim(key):
+        return await _buffered_response(text, voice_key, key)
+
+    chunks = _stream_chunks(text, voice_key)
+    try:
+        async with asyncio.timeout(TTS_TIMEOUT_SEC):
+            first = await anext(chunks, None)
+        if first is None:
+            raise RuntimeError(f"edge-tts 合成失败，voice={_resolve_voice(voice_key)}")
+    except BaseException as e:
+        cache.fail(key, tts_cache.SynthesisAborted("TTS 流式合成中断") if isinstance(e, asyncio.CancelledError) else e)
+        await chunks.aclose()
+        if isinstance(e, Exception):
+            raise _tts_error(e)
+        raise
+
+    async def body() -> AsyncIterator[bytes]:
+        parts = [first]
+        finished = False
+        try:
+            yield first
+            while True:
+                # 只限制等待下一块的时间，不包括 yield 后客户端接收的时间
+                async with asyncio.timeout(TTS_TIMEOUT_SEC):
+                    data = await anext(chunks, None)
+                if data is None:
+                    finished = True
+                    break
+                parts.append(data)
+                yield data
+        finally:
+            if finished:
+                await asyncio.to_thread(cache.complete, key, b"".join(parts))
+            else:
+                # 客户端断开或合成中断：不缓存不完整的音频
+                cache.fail(key, tts_cache.SynthesisAborted("TTS 流式合成中断"))
+                await chunks.aclose()
+
+    headers = _audio_headers(key)
+    headers["X-TTS-Cache"] = "miss"
+    return StreamingResponse(body(), media_type="audio/mpeg", headers=headers)
+
+
+@router.post("/tts")
+async def synthesize(req: TTSRequest, if_none_match: Optional[str] = Header(None)):
+    key = tts_cache.cache_key(req.text, _resolve_voice(req.voice), TTS_RATE)
+    if if_none_match and _etag(key) in if_none_match and tts_cache.get_cache().has_file(key):
+        return Response(status_code=304, headers=_audio_headers(key))
+    if req.stream:
+        return await _streaming_response(req.text, req.voice, key)
+    return await _buffered_response(req.text, req.voice, key)
+
+
+@router.get("/tts/stream")
+async def synthesize_stream(
+    text: str = Query(..., min_length=1),
+    voice: str = Query(DEFAULT_VOICE),
+    if_none_match: Optional[str] = Header(None),
+):
+    """流式朗读，供 <audio src> 直接边下边播。"""
+    key = tts_cache.cache_key(text, _resolve_voice(voice), TTS_RATE)
+    if if_none_match and _etag(key) in if_none_match and tts_cache.get_cache().has_file(key):
+        return Response(status_code=304, headers=_audio_headers(key))
+    return await _streaming_response(text, voice, key)
+
+
+@router.get("/tts/audio/{key}.mp3")
+def get_audio(key: str, if_none_match: Optional[str] = Header(None)):
+    """按内容 key 读取已合成的音频；支持 ETag / Range，可直接作为 <audio src>。"""
+    cache = tts_cache.get_cache()
+    if not tts_cache.is_valid_key(key) or not cache.has_file(key):
+        raise HTTPException(404, detail={"error": {"code": "NOT_FOUND", "message": "audio not found"}})
+    headers = {"ETag": _etag(key), "Cache-Control": "public, max-age=31536000, immutable"}
+    if if_none_match and _etag(key) in if_none_match:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(cache.path_for(key), media_type="audio/mpeg", headers=headers)
+
+
+# 转写上游走 upstream_http 的共享 AsyncClient（keep-alive 连接池），并发数受信号量限制
+_transcribe_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_transcribe_semaphore() -> asyncio.Semaphore:
+    global _transcribe_semaphore
+    if _transcribe_semaphore is None:
+        _transcribe_semaphore = asyncio.Semaphore(max(1, int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", "4"))))
+    return _transcribe_semaphore
 
 
 EXT_TO_CONTENT_TYPE = {
@@ -162,33 +277,30 @@ async def transcribe(file: UploadFile = File(...)):
         raise HTTPException(503, detail={"error": {"code": "TRANSCRIBE_KEY_NOT_SET", "message": "TRANSCIBE_OPENAI_API_KEY not set"}})
     if not model:
         raise HTTPException(503, detail={"error": {"code": "TRANSCRIBE_MODEL_NOT_SET", "message": "TRANSCIBE_OPENAI_MODEL not set"}})
-    data = await file.read()
-    if not data:
+    # 只读文件头用于识别格式；上传时由 httpx 从临时文件分块读取，不在内存中拼接整个请求体
+    head = await file.read(16)
+    if not head:
         raise HTTPException(400, detail={"error": {"code": "EMPTY_AUDIO", "message": "empty audio file"}})
+    await file.seek(0)
+    filename, content_type = _normalize_audio_meta(head, file.filename, file.content_type)
+    try:
+        async with _get_transcribe_semaphore():
+            resp = await upstream_http.arequest(
+                "POST",
+                uri,
+                api_key=api_key,
+                timeout=httpx.Timeout(float(os.getenv("TRANSCRIBE_TIMEOUT_SEC", "60")), connect=10.0),
+                label="transcribe",
+                # 超时不重试、其余错误最多重试一次，单次上传占用并发名额的时间与超时设置相当
+                retries=1,
+                retry_timeouts=False,
+                data={"model": model, "response_format": "json"},
+                files={"file": (filename, file.file, content_type)},
+            )
+    except Exception as e:
+        raise HTTPException(502, detail={"error": {"code": "TRANSCRIBE_FAILED", "message": str(e)}})
     try:
-        filename, content_type = _normalize_audio_meta(
-            data,
-            file.filename,
-            file.content_type,
-        )
-        body, content_type_header = _build_multipart(
-            data,
-            filename,
-            content_type,
-            {"model": model, "response_format": "json"},
-        )
-        headers = {"Content-Type": content_type_header}
-        if "openai.azure.com" in uri:
-            headers["api-key"] = api_key
-        else:
-            headers["Authorization"] = f"Bearer {api_key}"
-        req = urllib.request.Request(uri, data=body, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            text = resp.read().decode("utf-8")
-        payload = json.loads(text) if text else {}
-        return {"text": payload.get("text", "")}
-    except urllib.error.HTTPError as e:
-        detail = e.read().decode("utf-8")
-        raise HTTPException(502, detail={"error": {"code": "TRANSCRIBE_FAILED", "message": f"{e.code}: {detail}"}})
+        payload = resp.json() if resp.content else {}
     except Exception as e:
         raise HTTPException(502, detail={"error": {"code": "TRANSCRIBE_FAILED", "message": str(e)}})
+    return {"text": payload.get("text", "")}
@@ -0,0 +1,214 @@
+"""管理后台统计：读取物化的汇总表（见 database._MIGRATIONS v3），不再全表聚合。
+
+- sessions / feedback / sus_responses 的计数与分布由触发器在写入事务内维护。
+- telemetry_events 写入量大，不挂触发器；refresh_telemetry() 按 rowid 水位把新增行
+  分块汇总进 stats_counters / stats_dist / stats_telemetry_sessions。
+- get_admin_stats() 前置 ADMIN_STATS_CACHE_TTL_SEC 的进程内缓存，缓存过期时先增量刷新。
+- 手工改库（删除行等）后计数可能漂移，调用 rebuild() 从原表重算。
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from database import _MIGRATIONS, get_db, get_read_db
+
+_TELEMETRY_SOURCE = "telemetry_events"
+
+_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_cache: Optional[tuple[float, dict]] = None
+_stats = {"hits": 0, "misses": 0, "refreshes": 0, "refreshedRows": 0, "lastRefreshMs": 0.0}
+
+
+def _ttl_sec() -> float:
+    return max(0.0, float(os.getenv("ADMIN_STATS_CACHE_TTL_SEC", "5")))
+
+
+def _refresh_chunk() -> int:
+    return max(1, int(os.getenv("ADMIN_STATS_REFRESH_CHUNK", "100000")))
+
+
+def _add_counters(db, deltas: dict[str, float]) -> None:
+    db.executemany(
+        "UPDATE stats_counters SET value = value + ? WHERE name = ?",
+        [(delta, name) for name, delta in deltas.items() if delta],
+    )
+
+
+def _refresh_telemetry_chunk(db, chunk: int) -> tuple[int, bool]:
+    """汇总 (水位, 水位 + chunk] 区间；返回 (行数, 是否已追上 MAX(rowid))。"""
+    # 先写水位行拿到写锁：之后读到的 MAX(rowid) 之前不会再有未提交的行
+    db.execute("UPDATE stats_watermarks SET last_rowid = last_rowid WHERE source = ?", (_TELEMETRY_SOURCE,))
+    row = db.execute("SELECT last_rowid FROM stats_watermarks WHERE source = ?", (_TELEMETRY_SOURCE,)).fetchone()
+    low = row["last_rowid"] if row else 0
+    max_rowid = db.execute("SELECT MAX(rowid) AS m FROM telemetry_events").fetchone()["m"] or 0
+    high = min(max_rowid, low + chunk)
+    if high <= low:
+        return 0, True
+
+    agg = db.execute(
+        """SELECT COUNT(*) AS cnt, COALESCE(SUM(ts_client_ms), 0) AS ts_sum, COUNT(ts_client_ms) AS ts_count
+           FROM telemetry_events WHERE rowid > ? AND rowid <= ?""",
+        (low, high),
+    ).fetchone()
+    db.execute(
+        """INSERT INTO stats_dist (dimension, value, cnt)
+           SELECT 'event_type', event_type, COUNT(*) FROM telemetry_events
+           WHERE rowid > ? AND rowid <= ? GROUP BY event_type
+           ON CONFLICT (dimension, value) DO UPDATE SET cnt = cnt + excluded.cnt""",
+        (low, high),
+    )
+    before = db.total_changes
+    db.execute(
+        """INSERT OR IGNORE INTO stats_telemetry_sessions (session_id)
+           SELECT DISTINCT session_id FROM telemetry_events WHERE rowid > ? AND rowid <= ?""",
+        (low, high),
+    )
+    new_sessions = db.total_changes - before
+    _add_counters(db, {
+        "telemetry.total": agg["cnt"],
+        "telemetry.ts_sum": agg["ts_sum"],
+        "telemetry.ts_count": agg["ts_count"],
+        "telemetry.unique_sessions": new_sessions,
+    })
+    db.execute("UPDATE stats_watermarks SET last_rowid = ? WHERE source = ?", (high, _TELEMETRY_SOURCE))
+    return agg["cnt"], high >= max_rowid
+
+
+def refresh_telemetry() -> int:
+    """把水位之后的 telemetry 行汇总进统计表；每块一个短写事务。返回本次处理的行数。"""
+    chunk = _refresh_chunk()
+    total = 0
+    started = time.monotonic()
+    with _refresh_lock:
+        while True:
+            with get_db() as db:
+                processed, caught_up = _refresh_telemetry_chunk(db, chunk)
+            total += processed
+            if caught_up:
+                break
+    with _cache_lock:
+        _stats["refreshes"] += 1
+        _stats["refreshedRows"] += total
+        _stats["lastRefreshMs"] = round((time.monotonic() - started) * 1000, 1)
+    return total
+
+
+def rebuild() -> None:
+    """从原表重算全部汇总（O(n)，仅用于修复漂移）。"""
+    with _refresh_lock:
+        with get_db() as db:
+            db.execute("DELETE FROM stats_dist")
+            db.execute("DELETE FROM stats_telemetry_sessions")
+            backfill = [sql for version, _, statements in _MIGRATIONS if version == 3
+                        for sql in statements if sql.startswith("INSERT OR REPLACE")]
+            for sql in backfill:
+                db.execute(sql)
+    invalidate()
+    refresh_telemetry()
+
+
+def invalidate() -> None:
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _counters(db) -> dict[str, float]:
+    return {r["name"]: r["value"] for r in db.execute("SELECT name, value FROM stats_counters")}
+
+
+def _dist(db, dimension: str) -> dict[str, int]:
+    rows = db.execute(
+        "SELECT value, cnt FROM stats_dist WHERE dimension = ? AND cnt > 0 ORDER BY value", (dimension,)
+    ).fetchall()
+    return {r["value"]: r["cnt"] for r in rows}
+
+
+def _pct(part: float, total: float):
+    return round(part / total * 100, 1) if total > 0 else 0
+
+
+def get_backend_stats() -> dict:
+    """sessions / feedback / sus 汇总（读计数器，O(1)）。"""
+    with get_read_db() as db:
+        c = _counters(db)
+        try_level_dist = _dist(db, "try_level")
+        abort_reason_dist = _dist(db, "abort_reason")
+    total = int(c.get("sessions.total", 0))
+    completed = int(c.get("sessions.completed", 0))
+    aborted = int(c.get("sessions.aborted", 0))
+    sus_count = int(c.get("sus.count", 0))
+    score_count = c.get("sus.score_count", 0)
+    feedback_count = int(c.get("feedback.total", 0))
+    return {
+        "sessions": {
+            "total": total,
+            "completed": completed,
+            "aborted": aborted,
+            "completedRate": _pct(completed, total),
+            "abortedRate": _pct(aborted, total),
+        },
+        "feedback": {"tryLevelDist": try_level_dist, "abortReasonDist": abort_reason_dist},
+        "sus": {
+            "responseCount": sus_count,
+            "avgScore": round(c.get("sus.score_sum", 0) / score_count, 1) if score_count else None,
+            "distribution": {
+                "low": int(c.get("sus.low", 0)),
+                "mid": int(c.get("sus.mid", 0)),
+                "high": int(c.get("sus.high", 0)),
+            },
+        },
+        "completeness": {
+            "sessionsWithFeedback": feedback_count,
+            "sessionsWithFeedbackPct": _pct(feedback_count, total),
+            "sessionsWithSUS": sus_count,
+            "sessionsWithSUSPct": _pct(sus_count, total),
+        },
+    }
+
+
+def get_telemetry_stats() -> dict:
+    """telemetry 汇总；只反映已刷新到水位的行。"""
+    with get_read_db() as db:
+        c = _counters(db)
+        by_type = _dist(db, "event_type")
+    ts_count = c.get("telemetry.ts_count", 0)
+    return {
+        "totalEvents": int(c.get("telemetry.total", 0)),
+        "uniqueSessions": int(c.get("telemetry.unique_sessions", 0)),
+        "avgDwellMs": round(c.get("telemetry.ts_sum", 0) / ts_count, 1) if ts_count else 0,
+        "byType": by_type,
+    }
+
+
+def get_admin_stats() -> dict:
+    """GET /api/v1/admin/stats 的响应；TTL 内直接返回缓存。"""
+    global _cache
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache is not None and _cache[0] > now:
+            _stats["hits"] += 1
+            return _cache[1]
+        _stats["misses"] += 1
+    refresh_telemetry()
+    stats = get_backend_stats()
+    stats["telemetry"] = get_telemetry_stats()
+    with _cache_lock:
+        _cache = (time.monotonic() + _ttl_sec(), stats)
+    return stats
+
+
+def get_cache_stats() -> dict:
+    with get_read_db() as db:
+        row = db.execute(
+            "SELECT last_rowid FROM stats_watermarks WHERE source = ?", (_TELEMETRY_SOURCE,)
+        ).fetchone()
+    with _cache_lock:
+        return {
+            "ttlSec": _ttl_sec(),
+            "cached": _cache is not None and _cache[0] > time.monotonic(),
+            "telemetryWatermark": row["last_rowid"] if row else 0,
+            **_stats,
+        }
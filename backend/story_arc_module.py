@@ -1,9 +1,12 @@
 
 import os
 import json
+import time
 from openai import AzureOpenAI
 from typing import Optional, Dict, Any, List
 
+import llm_usage
+
 # 从.env文件中读取Azure OpenAI配置
 from dotenv import load_dotenv
 load_dotenv()
@@ -24,21 +27,23 @@ client = AzureOpenAI(
 )
 
 
-# 读取design_consideration.json
-with open("design_consideration.json", "r") as f:
-    design_consideration = json.load(f)
+def _module_dir() -> str:
+    return os.path.dirname(os.path.abspath(__file__))
+
 
-# 读取user_profile.json
-with open("user_profile.json", "r") as f:
-    user_profile = json.load(f)
+def _load_json(filename: str) -> Any:
+    path = os.path.join(_module_dir(), filename)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-# 读取 basic_constraints.json
-with open("basic_constraints.json", "r") as f:
-    basic_constraints = json.load(f)
 
-# 读取 story_bible_template_optional_library.json
-with open("story_bible_template_optional_library.json", "r") as f:
-    story_bible_template_optional_library = json.load(f)
+def load_static_libraries() -> Dict[str, Any]:
+    """读取与用户无关的静态输入（design_consideration / basic_constraints / 模板库）。"""
+    return {
+        "design_consideration": _load_json("design_consideration.json"),
+        "basic_constraints": _load_json("basic_constraints.json"),
+        "story_bible_template_optional_library": _load_json("story_bible_template_optional_library.json"),
+    }
 
 
 # -----------------------------
@@ -370,8 +375,8 @@ def build_run_config(
         "selected_template_guidance": selected_template if selected_template else "unspecified",
     }
 
+    # 静态部分在前、随用户变化的 effective_inputs 在后，便于上游复用相同的提示前缀
     return {
-        "effective_inputs": effective_inputs,
         "prompt_emphasis": {
             "mode_style_anchor": {
                 "realistic_everyday": "Everyday cause-effect routine in familiar life spaces; small household/social events drive the episode.",
@@ -389,6 +394,7 @@ def build_run_config(
             "world_setting.core_locations": 2,
             "world_setting.world_rules": 3,
         },
+        "effective_inputs": effective_inputs,
     }
 
 
@@ -506,59 +512,85 @@ def build_response_format(user_profile_dict: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-# Normalize inputs (do not invent values)
-user_profile = normalize_user_profile(user_profile)
-basic_constraints = normalize_basic_constraints(basic_constraints)
-
-# Pre-select template based on preferred_story_mode and interest_theme
-preferred_mode = select_preferred_mode(user_profile)
-selected_template = select_template_one(
-    story_bible_template_optional_library,
-    preferred_mode,
-    user_profile,
-)
-
-developer_policy = build_developer_policy()
-run_config = build_run_config(
-    selected_template,
-    user_profile,
-    design_consideration,
-    basic_constraints,
-)
-
-# Only send real user data as user message
-user_payload = {
-    "user_profile": user_profile,
-}
-
-# Structured Outputs schema (locks enums when inputs are real)
-response_format = build_response_format(user_profile)
-
-# Call model with developer messages
-try:
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=[
-            {"role": "developer", "content": developer_policy},
-            {"role": "developer", "content": json.dumps(run_config, ensure_ascii=False)},
-            {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
-        ],
-        response_format=response_format,
-        max_completion_tokens=16384,
+def generate_story_arc_framework(
+    user_profile: Dict[str, Any],
+    design_consideration: Optional[Dict[str, Any]] = None,
+    basic_constraints: Optional[Dict[str, Any]] = None,
+    story_bible_template_optional_library: Optional[Dict[str, Any]] = None,
+    on_usage: Optional[llm_usage.OnUsage] = None,
+) -> Dict[str, Any]:
+    """根据 user_profile 生成故事背景框架。静态输入缺省时从模块目录读取。"""
+    if design_consideration is None or basic_constraints is None or story_bible_template_optional_library is None:
+        static_libraries = load_static_libraries()
+        if design_consideration is None:
+            design_consideration = static_libraries["design_consideration"]
+        if basic_constraints is None:
+            basic_constraints = static_libraries["basic_constraints"]
+        if story_bible_template_optional_library is None:
+            story_bible_template_optional_library = static_libraries["story_bible_template_optional_library"]
+
+    # Normalize inputs (do not invent values)
+    user_profile = normalize_user_profile(user_profile)
+    basic_constraints = normalize_basic_constraints(basic_constraints)
+
+    # Pre-select template based on preferred_story_mode and interest_theme
+    preferred_mode = select_preferred_mode(user_profile)
+    selected_template = select_template_one(
+        story_bible_template_optional_library,
+        preferred_mode,
+        user_profile,
     )
-except TypeError:
-    # Fallback for older SDKs that don't accept response_format
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=[
-            {"role": "developer", "content": developer_policy},
-            {"role": "developer", "content": json.dumps(run_config, ensure_ascii=False)},
-            {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
-        ],
-        max_completion_tokens=16384,
+
+    developer_policy = build_developer_policy()
+    run_config = build_run_config(
+        selected_template,
+        user_profile,
+        design_consideration,
+        basic_constraints,
     )
 
-raw_content = response.choices[0].message.content
-story_arc_framework = json.loads(raw_content)
+    # Only send real user data as user message
+    user_payload = {
+        "user_profile": user_profile,
+    }
 
-print(story_arc_framework)
+    # Structured Outputs schema (locks enums when inputs are real)
+    response_format = build_response_format(user_profile)
+
+    # Call model with developer messages
+    started = time.monotonic()
+    try:
+        response = client.chat.completions.create(
+            model=deployment,
+            messages=[
+                {"role": "developer", "content": developer_policy},
+                {"role": "developer", "content": json.dumps(run_config, ensure_ascii=False)},
+                {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+            ],
+            response_format=response_format,
+            max_completion_tokens=16384,
+        )
+    except TypeError:
+        # Fallback for older SDKs that don't accept response_format
+        response = client.chat.completions.create(
+            model=deployment,
+            messages=[
+                {"role": "developer", "content": developer_policy},
+                {"role": "developer", "content": json.dumps(run_config, ensure_ascii=False)},
+                {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+            ],
+            max_completion_tokens=16384,
+        )
+    llm_usage.report(on_usage, "story_arc", deployment, getattr(response, "usage", None), started)
+
+    raw_content = response.choices[0].message.content
+    return json.loads(raw_content)
+
+
+if __name__ == "__main__":
+    # 读取user_profile.json
+    with open("user_profile.json", "r") as f:
+        demo_user_profile = json.load(f)
+
+    story_arc_framework = generate_story_arc_framework(demo_user_profile)
+    print(story_arc_framework)
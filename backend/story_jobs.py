@@ -0,0 +1,213 @@
+"""故事生成任务调度。
+
+generate / regenerate 接口只负责写入占位 draft 并登记任务，真正的文案生成在
+有界线程池中执行（STORY_JOB_MAX_WORKERS），排队任务数超过
+STORY_JOB_MAX_PENDING 时拒绝新任务。同一去重键（同一 child 的 generate、同一
+原故事的 regenerate）在文案阶段只允许一个任务，重复提交直接返回已有任务；文案
+落库后即释放去重占位（插图按页单独跟踪）。任务阶段：queued → text → images → done。
+"""
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from database import get_db, get_read_db
+
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+
+class StoryJobBusy(RuntimeError):
+    pass
+
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+_active_by_key: dict[str, str] = {}
+
+
+def _max_workers() -> int:
+    return max(1, int(os.getenv("STORY_JOB_MAX_WORKERS", "4")))
+
+
+def _max_pending() -> int:
+    return max(1, int(os.getenv("STORY_JOB_MAX_PENDING", "32")))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_max_workers(),
+                thread_name_prefix="story-job",
+            )
+        return _executor
+
+
+def _row_to_job(row) -> dict:
+    return {
+        "job_id": row["job_id"],
+        "story_id": row["story_id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "stage": row["stage"],
+        "progress": row["progress"],
+        "error_code": row["error_code"],
+        "error": row["error"],
+    }
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with get_read_db() as db:
+        row = db.execute("SELECT * FROM story_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def get_latest_job_for_story(story_id: str) -> Optional[dict]:
+    with get_read_db() as db:
+        row = db.execute(
+            "SELECT * FROM story_jobs WHERE story_id = ? ORDER BY created_at DESC, rowid DESC LIMIT 1",
+            (story_id,),
+        ).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def find_active_job(dedupe_key: Optional[str]) -> Optional[dict]:
+    if not dedupe_key:
+        return None
+    with _lock:
+        job_id = _active_by_key.get(dedupe_key)
+    return get_job(job_id) if job_id else None
+
+
+def release_dedupe(job_id: str) -> None:
+    """释放该任务的去重占位：文案落库后调用，之后的同类请求会新建任务。"""
+    with _lock:
+        for key, active_job_id in list(_active_by_key.items()):
+            if active_job_id == job_id:
+                del _active_by_key[key]
+
+
+def update_job(job_id: str, **fields: Any) -> None:
+    if not fields:
+        return
+    columns = ", ".join(f"{key} = ?" for key in fields)
+    with get_db() as db:
+        db.execute(
+            f"UPDATE story_jobs SET {columns}, updated_at = datetime('now') WHERE job_id = ?",
+            (*fields.values(), job_id),
+        )
+
+
+def finish_job(job_id: str, *, error_code: Optional[str] = None, error: Optional[str] = None) -> None:
+    """标记任务结束（成功或失败），并释放去重占位（若尚未释放）。"""
+    with get_db() as db:
+        if error is None:
+            db.execute(
+                """UPDATE story_jobs SET status = 'DONE', stage = 'done', progress = 1,
+                   updated_at = datetime('now'), finished_at = datetime('now') WHERE job_id = ?""",
+                (job_id,),
+            )
+        else:
+            db.execute(
+                """UPDATE story_jobs SET status = 'ERROR', error_code = ?, error = ?,
+                   updated_at = datetime('now'), finished_at = datetime('now') WHERE job_id = ?""",
+                (error_code or "INTERNAL_ERROR", error, job_id),
+            )
+    release_dedupe(job_id)
+
+
+def submit_job(
+    *,
+    story_id: str,
+    child_id: Optional[str],
+    kind: str,
+    dedupe_key: Optional[str],
+    create_story: Callable[[Any], None],
+    run: Callable[[str], None],
+) -> tuple[dict, bool]:
+    """登记并调度一个任务。返回 (job, deduped)。
+
+    create_story(db) 在登记任务的同一事务中写入占位 story；若 dedupe_key 已有
+    文案阶段中的任务，则不会调用 create_story，直接返回已有任务且 deduped=True。
+    run(job_id) 在线程池中执行，负责推进阶段并最终调用 finish_job。
+    """
+    global _pending
+    while True:
+        with _lock:
+            existing_job_id = _active_by_key.get(dedupe_key) if dedupe_key else None
+            if not existing_job_id:
+                if _pending >= _max_pending():
+                    raise StoryJobBusy("story generation queue is full")
+                job_id = "job_" + uuid.uuid4().hex[:16]
+                _pending += 1
+                if dedupe_key:
+                    _active_by_key[dedupe_key] = job_id
+                break
+        existing = get_job(existing_job_id)
+        if existing:
+            return existing, True
+        with _lock:
+            if _active_by_key.get(dedupe_key) == existing_job_id:
+                del _active_by_key[dedupe_key]
+
+    try:
+        with get_db() as db:
+            create_story(db)
+            db.execute(
+                "INSERT INTO story_jobs (job_id, story_id, child_id, kind) VALUES (?, ?, ?, ?)",
+                (job_id, story_id, child_id, kind),
+            )
+    except Exception:
+        with _lock:
+            _pending -= 1
+            if dedupe_key and _active_by_key.get(dedupe_key) == job_id:
+                del _active_by_key[dedupe_key]
+        raise
+
+    def _run():
+        global _pending
+        with _lock:
+            _pending -= 1
+        try:
+            run(job_id)
+        except Exception as e:
+            traceback.print_exc()
+            finish_job(job_id, error=str(e))
+
+    _get_executor().submit(_run)
+    return get_job(job_id) or {"job_id": job_id, "story_id": story_id, "status": "QUEUED"}, False
+
+
+def recover_orphaned_jobs(on_orphan: Callable[[str, str], None]) -> int:
+    """进程重启后，把上次遗留的 QUEUED/RUNNING 任务标记为失败。"""
+    with get_db() as db:
+        rows = db.execute(
+            "SELECT job_id, story_id FROM story_jobs WHERE status IN (?, ?)",
+            ACTIVE_STATUSES,
+        ).fetchall()
+    for row in rows:
+        finish_job(row["job_id"], error_code="INTERRUPTED", error="generation interrupted by server restart")
+        on_orphan(row["job_id"], row["story_id"])
+    return len(rows)
+
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_scheduler_stats() -> dict:
+    with _lock:
+        return {
+            "maxWorkers": _max_workers(),
+            "maxPending": _max_pending(),
+            "pending": _pending,
+            "activeDedupeKeys": len(_active_by_key),
+        }
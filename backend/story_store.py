@@ -0,0 +1,279 @@
+"""故事的拆分存储：stories（书级元数据 + 小体积 core JSON）/ story_pages / story_assets。
+
+draft 在写入时被拆成三部分：
+- core：book_meta、ending、generation_status 等小字段，仍存于 stories.story_json；
+- assets：visual_canon、prompt packages、请求回显等大块 JSON，每块一行存于 story_assets；
+- pages：每页一行存于 story_pages，image_url / interaction_image_url 为独立列，
+  预合成朗读音频的 URL（page["audio"]）存于 audio_json 列，插图派生版本
+  （page["renditions"]，按图片字段分组的 WebP/AVIF/缩略图 URL）存于 renditions_json 列。
+
+读书级元数据或单页时无需反序列化整本书，单页图片更新只改 story_pages 的一行。
+所有函数都接收调用方的连接（database.get_db()），便于与其它写操作放在同一事务里。
+"""
+import json
+from typing import Any, Optional
+
+ASSET_KEYS = (
+    "visual_canon",
+    "page_image_prompt_packages",
+    "child_profile",
+    "meal_context",
+    "story_config",
+    "story_arc",
+    "recap_and_goal",
+    "temporal_characteristics",
+    "recent_story",
+)
+PAGE_IMAGE_FIELDS = ("image_url", "interaction_image_url")
+PAGE_AUDIO_FIELD = "audio"
+PAGE_RENDITIONS_FIELD = "renditions"
+_PAGE_COLUMN_FIELDS = (*PAGE_IMAGE_FIELDS, PAGE_AUDIO_FIELD, PAGE_RENDITIONS_FIELD)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _meta_columns(draft: dict) -> dict:
+    book_meta = draft.get("book_meta") if isinstance(draft.get("book_meta"), dict) else {}
+    meal_context = draft.get("meal_context") if isinstance(draft.get("meal_context"), dict) else {}
+    story_config = draft.get("story_config") if isinstance(draft.get("story_config"), dict) else {}
+    pages = draft.get("pages") if isinstance(draft.get("pages"), list) else []
+    return {
+        "title": book_meta.get("title") or None,
+        "summary": book_meta.get("summary") or None,
+        "theme_food": book_meta.get("theme_food") or meal_context.get("target_food") or None,
+        "story_type": book_meta.get("story_type") or story_config.get("story_type") or None,
+        "page_count": len(pages),
+    }
+
+
+def split_draft(draft: dict) -> tuple[dict, dict, list]:
+    """draft → (core, assets, pages)。"""
+    core = {k: v for k, v in draft.items() if k != "pages" and k not in ASSET_KEYS}
+    assets = {k: draft[k] for k in ASSET_KEYS if k in draft}
+    pages = draft.get("pages") if isinstance(draft.get("pages"), list) else []
+    return core, assets, pages
+
+
+def _write_body(db, story_id: str, assets: dict, pages: list) -> None:
+    db.execute("DELETE FROM story_assets WHERE story_id = ?", (story_id,))
+    db.executemany(
+        "INSERT INTO story_assets (story_id, kind, asset_json) VALUES (?, ?, ?)",
+        [(story_id, kind, _dumps(value)) for kind, value in assets.items()],
+    )
+    db.execute("DELETE FROM story_pages WHERE story_id = ?", (story_id,))
+    rows = []
+    for index, page in enumerate(pages):
+        page = page if isinstance(page, dict) else {}
+        body = {k: v for k, v in page.items() if k not in _PAGE_COLUMN_FIELDS}
+        audio = page.get(PAGE_AUDIO_FIELD)
+        renditions = page.get(PAGE_RENDITIONS_FIELD)
+        rows.append((
+            story_id,
+            index,
+            page.get("page_id"),
+            _dumps(body),
+            page.get("image_url"),
+            page.get("interaction_image_url"),
+            _dumps(audio) if isinstance(audio, dict) and audio else None,
+            _dumps(renditions) if isinstance(renditions, dict) and renditions else None,
+        ))
+    db.executemany(
+        """INSERT INTO story_pages
+           (story_id, page_index, page_id, page_json, image_url, interaction_image_url, audio_json,
+            renditions_json)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        rows,
+    )
+
+
+def insert_story(
+    db,
+    story_id: str,
+    draft: dict,
+    *,
+    child_id: Optional[str] = None,
+    parent_story_id: Optional[str] = None,
+    regen_count: int = 0,
+) -> None:
+    core, assets, pages = split_draft(draft)
+    meta = _meta_columns(draft)
+    db.execute(
+        """INSERT INTO stories
+           (story_id, parent_story_id, child_id, regen_count, story_json,
+            title, summary, theme_food, story_type, page_count)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            story_id, parent_story_id, child_id, regen_count, _dumps(core),
+            meta["title"], meta["summary"], meta["theme_food"], meta["story_type"], meta["page_count"],
+        ),
+    )
+    _write_body(db, story_id, assets, pages)
+
+
+def save_draft(db, story_id: str, draft: dict) -> None:
+    """整本覆盖写入（文案生成完成、标记错误等低频场景）。"""
+    core, assets, pages = split_draft(draft)
+    meta = _meta_columns(draft)
+    db.execute(
+        """UPDATE stories SET story_json = ?, title = ?, summary = ?, theme_food = ?,
+                  story_type = ?, page_count = ?
+           WHERE story_id = ?""",
+        (
+            _dumps(core), meta["title"], meta["summary"], meta["theme_food"],
+            meta["story_type"], meta["page_count"], story_id,
+        ),
+    )
+    _write_body(db, story_id, assets, pages)
+
+
+def _row_to_page(row) -> dict:
+    page = json.loads(row["page_json"])
+    for field in PAGE_IMAGE_FIELDS:
+        if row[field]:
+            page[field] = row[field]
+    if row["audio_json"]:
+        page[PAGE_AUDIO_FIELD] = json.loads(row["audio_json"])
+    if row["renditions_json"]:
+        page[PAGE_RENDITIONS_FIELD] = json.loads(row["renditions_json"])
+    return page
+
+
+def load_pages(db, story_id: str) -> list[dict]:
+    rows = db.execute(
+        """SELECT page_json, image_url, interaction_image_url, audio_json, renditions_json FROM story_pages
+           WHERE story_id = ? ORDER BY page_index""",
+        (story_id,),
+    ).fetchall()
+    return [_row_to_page(row) for row in rows]
+
+
+def load_page(db, story_id: str, page_index: int) -> Optional[dict]:
+    row = db.execute(
+        """SELECT page_json, image_url, interaction_image_url, audio_json, renditions_json FROM story_pages
+           WHERE story_id = ? AND page_index = ?""",
+        (story_id, page_index),
+    ).fetchone()
+    return _row_to_page(row) if row else None
+
+
+def load_assets(db, story_id: str, kinds: Optional[tuple[str, ...]] = None) -> dict:
+    if kinds:
+        placeholders = ", ".join("?" for _ in kinds)
+        rows = db.execute(
+            f"SELECT kind, asset_json FROM story_assets WHERE story_id = ? AND kind IN ({placeholders})",
+            (story_id, *kinds),
+        ).fetchall()
+    else:
+        rows = db.execute(
+            "SELECT kind, asset_json FROM story_assets WHERE story_id = ?",
+            (story_id,),
+        ).fetchall()
+    return {row["kind"]: json.loads(row["asset_json"]) for row in rows}
+
+
+def load_draft(db, story_id: str) -> Optional[dict]:
+    """拼回完整 draft（与拆分前的结构一致）。"""
+    row = db.execute("SELECT story_json FROM stories WHERE story_id = ?", (story_id,)).fetchone()
+    if row is None:
+        return None
+    draft = json.loads(row["story_json"])
+    draft.update(load_assets(db, story_id))
+    draft["pages"] = load_pages(db, story_id)
+    return draft
+
+
+def images_progress(db, story_id: str) -> dict:
+    row = db.execute(
+        "SELECT COUNT(image_url) AS ready, COUNT(*) AS total FROM story_pages WHERE story_id = ?",
+        (story_id,),
+    ).fetchone()
+    return {"ready": row["ready"] or 0, "total": row["total"] or 0}
+
+
+def load_meta(db, story_id: str) -> Optional[dict]:
+    """书级元数据：只读 stories 的列，不反序列化 pages / assets。"""
+    row = db.execute(
+        """SELECT story_id, parent_story_id, child_id, regen_count, title, summary, theme_food,
+                  story_type, page_count, created_at,
+                  json_extract(story_json, '$.generation_status') AS generation_status,
+                  json_extract(story_json, '$.generation_error_code') AS generation_error_code
+           FROM stories WHERE story_id = ?""",
+        (story_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def set_page_image(
+    db, story_id: str, page_index: int, field: str, url: str, renditions: Optional[dict] = None
+) -> None:
+    """写入单页图片 URL，并替换该图片字段的派生版本（无派生版本时清除旧的）。"""
+    if field not in PAGE_IMAGE_FIELDS:
+        raise ValueError(f"unknown page image field: {field}")
+    if renditions:
+        renditions_sql = "json_set(COALESCE(renditions_json, '{}'), '$.' || ?, json(?))"
+        params = (url, field, _dumps(renditions), story_id, page_index)
+    else:
+        renditions_sql = "NULLIF(json_remove(COALESCE(renditions_json, '{}'), '$.' || ?), '{}')"
+        params = (url, field, story_id, page_index)
+    db.execute(
+        f"""UPDATE story_pages SET {field} = ?, renditions_json = {renditions_sql}
+            WHERE story_id = ? AND page_index = ?""",
+        params,
+    )
+
+
+def set_page_audio(db, story_id: str, page_index: int, segment: str, url: str) -> None:
+    """合并写入单页的一段朗读音频 URL（page["audio"][segment]）。"""
+    db.execute(
+        """UPDATE story_pages SET audio_json = json_patch(COALESCE(audio_json, '{}'), json_object(?, ?))
+           WHERE story_id = ? AND page_index = ?""",
+        (segment, url, story_id, page_index),
+    )
+
+
+def set_ending_audio(db, story_id: str, segment: str, url: str) -> None:
+    """书末朗读音频 URL 写在 core JSON 的 ending.audio 下。"""
+    db.execute(
+        """UPDATE stories SET story_json = json_set(story_json, '$.ending.audio.' || ?, ?)
+           WHERE story_id = ? AND json_type(story_json, '$.ending') = 'object'""",
+        (segment, url, story_id),
+    )
+
+
+def set_generation_status(
+    db,
+    story_id: str,
+    status: str,
+    *,
+    error: Optional[str] = None,
+    error_code: Optional[str] = None,
+) -> None:
+    if error is None:
+        db.execute(
+            "UPDATE stories SET story_json = json_set(story_json, '$.generation_status', ?) WHERE story_id = ?",
+            (status, story_id),
+        )
+    else:
+        db.execute(
+            """UPDATE stories SET story_json = json_set(story_json,
+                   '$.generation_status', ?, '$.generation_error', ?, '$.generation_error_code', ?)
+               WHERE story_id = ?""",
+            (status, error, error_code, story_id),
+        )
+
+
+def migrate_legacy_stories(db) -> int:
+    """把旧版整本 story_json（含 pages）拆分写入新表，返回迁移条数。可重复执行。"""
+    rows = db.execute(
+        """SELECT story_id, story_json FROM stories
+           WHERE CASE WHEN json_valid(story_json) THEN json_type(story_json, '$.pages') END = 'array'"""
+    ).fetchall()
+    for row in rows:
+        try:
+            draft = json.loads(row["story_json"])
+        except Exception:
+            continue
+        save_draft(db, row["story_id"], draft)
+    return len(rows)
@@ -1,9 +1,12 @@
 import json
 import os
+import time
 from typing import Any, Dict, List, Optional
 
 from openai import AzureOpenAI
 
+import llm_usage
+
 
 # 从.env文件中读取Azure OpenAI配置
 from dotenv import load_dotenv
@@ -186,11 +189,8 @@ Output rules:
 def build_run_config(story_framework: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     story_framework = story_framework or {}
 
+    # 静态的 prompt_emphasis 在前、随故事变化的 story_framework 在后，便于上游复用相同的提示前缀
     return {
-        "effective_inputs": {
-            "story_framework": story_framework,
-            "window_rule": "Summarize at most the latest 3 previous story episodes.",
-        },
         "prompt_emphasis": {
             "framework_usage": "Use story_framework to strengthen stable series identity and recurring continuity machinery when grounded, without claiming unseen events.",
             "micro_goal_granularity": "Keep the micro goal high-level, interesting, and generative for downstream episode writing; do not pre-script the next episode beat by beat.",
@@ -200,6 +200,10 @@ def build_run_config(story_framework: Optional[Dict[str, Any]]) -> Dict[str, Any
                 "Avoid near-duplicate episode skeletons in consecutive episodes, and avoid defaulting to repeated '看一看/闻一闻/小口尝' loops."
             ),
         },
+        "effective_inputs": {
+            "window_rule": "Summarize at most the latest 3 previous story episodes.",
+            "story_framework": story_framework,
+        },
     }
 
 
@@ -286,6 +290,7 @@ def build_response_format() -> Dict[str, Any]:
 def summarize_previous_episodes(
     previous_blocks: Any,
     story_framework: Optional[Dict[str, Any]] = None,
+    on_usage: Optional[llm_usage.OnUsage] = None,
 ) -> Dict[str, Any]:
     normalized_blocks = normalize_previous_blocks(previous_blocks)
 
@@ -302,6 +307,7 @@ def summarize_previous_episodes(
         "previous_blocks": normalized_blocks,
     }
 
+    started = time.monotonic()
     try:
         response = client.chat.completions.create(
             model=deployment,
@@ -323,6 +329,7 @@ def summarize_previous_episodes(
             ],
             max_completion_tokens=16384,
         )
+    llm_usage.report(on_usage, "summarize", deployment, getattr(response, "usage", None), started)
 
     raw_content = response.choices[0].message.content
 
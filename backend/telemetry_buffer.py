@@ -0,0 +1,312 @@
+"""telemetry_events 的写后缓冲（write-behind）。
+
+上报接口校验后把事件放进内存队列即返回，后台 flusher 线程在队列达到
+TELEMETRY_FLUSH_BATCH 条或距上次提交超过 TELEMETRY_FLUSH_INTERVAL_MS 时
+批量提交（group commit）。队列超过 TELEMETRY_BUFFER_MAX_EVENTS 时，新事件
+追加写入 TELEMETRY_SPILL_PATH（JSONL），flusher 空闲时回放；未配置溢出文件时
+改为在请求线程中同步写入。进程退出时 shutdown() 会把队列刷完。
+
+入队前按 event_id 去重：先查最近入队过的 event_id 集合（TELEMETRY_RECENT_IDS 条，
+覆盖尚未落库的事件），其余再按主键查一次已入库事件，使接口返回的 accepted /
+deduped 与最终写入一致。
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from typing import Optional
+
+from database import get_db, get_read_db
+
+_INSERT_SQL = """INSERT OR IGNORE INTO telemetry_events
+   (event_id, session_id, story_id, page_id, event_type, payload, ts_client_ms)
+   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def enabled() -> bool:
+    return os.getenv("TELEMETRY_WRITE_BEHIND", "1").strip().lower() not in ("0", "false", "no")
+
+
+def _chunk_size() -> int:
+    return max(1, int(os.getenv("TELEMETRY_INSERT_CHUNK", "500")))
+
+
+# SQLite 单条语句的绑定参数上限为 999
+_LOOKUP_CHUNK = 500
+
+
+def _stored_event_ids(event_ids: list[str]) -> set[str]:
+    """返回其中已入库的 event_id（主键查询，走只读连接）。"""
+    found: set[str] = set()
+    with get_read_db() as db:
+        for start in range(0, len(event_ids), _LOOKUP_CHUNK):
+            chunk = event_ids[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(
+                row[0]
+                for row in db.execute(
+                    f"SELECT event_id FROM telemetry_events WHERE event_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+    return found
+
+
+def insert_rows(rows: list[tuple]) -> int:
+    """分块 INSERT OR IGNORE，每块一个短事务；返回实际写入条数。"""
+    inserted = 0
+    chunk = _chunk_size()
+    for start in range(0, len(rows), chunk):
+        with get_db() as db:
+            before = db.total_changes
+            db.executemany(_INSERT_SQL, rows[start:start + chunk])
+            inserted += db.total_changes - before
+    return inserted
+
+
+class TelemetryBuffer:
+    def __init__(
+        self,
+        *,
+        flush_batch: int,
+        flush_interval_sec: float,
+        max_events: int,
+        spill_path: Optional[str],
+        recent_ids: int = 50000,
+    ):
+        self.flush_batch = max(1, flush_batch)
+        self.flush_interval_sec = max(0.01, flush_interval_sec)
+        self.max_events = max(self.flush_batch, max_events)
+        self.spill_path = spill_path or None
+        self.recent_ids_max = max(self.max_events, recent_ids)
+        self._recent_ids: OrderedDict[str, None] = OrderedDict()
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._stats = {
+            "enqueued": 0,
+            "deduped": 0,
+            "inserted": 0,
+            "flushes": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "syncWrites": 0,
+            "flushErrors": 0,
+            "lastFlushMs": 0.0,
+        }
+
+    # ── 入队 ────────────────────────────────────────────────
+    def accept(self, rows: list[tuple]) -> list[tuple]:
+        """去掉最近已入队或已入库的 event_id，并把其余登记为最近入队；返回新事件。"""
+        with self._cond:
+            fresh = [row for row in rows if row[0] not in self._recent_ids]
+        stored = _stored_event_ids([row[0] for row in fresh]) if fresh else set()
+        accepted = []
+        with self._cond:
+            for row in fresh:
+                # 并发请求可能在查库期间登记了同一 event_id，这里再查一次
+                if row[0] in stored or row[0] in self._recent_ids:
+                    continue
+                self._recent_ids[row[0]] = None
+                accepted.append(row)
+            while len(self._recent_ids) > self.recent_ids_max:
+                self._recent_ids.popitem(last=False)
+            self._stats["deduped"] += len(rows) - len(accepted)
+        return accepted
+
+    def enqueue(self, rows: list[tuple]) -> None:
+        if not rows:
+            return
+        with self._cond:
+            room = self.max_events - len(self._queue)
+            head, overflow = rows[:max(0, room)], rows[max(0, room):]
+            self._queue.extend(head)
+            self._stats["enqueued"] += len(head)
+            if len(self._queue) >= self.flush_batch:
+                self._cond.notify()
+        if overflow:
+            if self.spill_path:
+                self._spill(overflow)
+            else:
+                # 无溢出文件时直接在请求线程写库，形成反压
+                insert_rows(overflow)
+                with self._cond:
+                    self._stats["syncWrites"] += len(overflow)
+
+    def _spill(self, rows: list[tuple]) -> None:
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        with self._cond:
+            self._stats["spilled"] += len(rows)
+
+    # ── flusher ─────────────────────────────────────────────
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="telemetry-flusher", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> list[tuple]:
+        batch = []
+        while self._queue and len(batch) < self.max_events:
+            batch.append(self._queue.popleft())
+        return batch
+
+    def _run(self) -> None:
+        self._replay_spill()
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval_sec
+                while not self._stopping and len(self._queue) < self.flush_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+                stopping = self._stopping
+            if batch:
+                self._flush(batch)
+            elif self.spill_path and os.path.exists(self.spill_path):
+                self._replay_spill()
+            if stopping:
+                with self._cond:
+                    if not self._queue:
+                        return
+
+    def _flush(self, batch: list[tuple]) -> None:
+        started = time.monotonic()
+        try:
+            inserted = insert_rows(batch)
+        except Exception:
+            traceback.print_exc()
+            with self._cond:
+                self._stats["flushErrors"] += 1
+            if self.spill_path:
+                self._spill(batch)
+            else:
+                with self._cond:
+                    self._queue.extendleft(reversed(batch))
+                time.sleep(self.flush_interval_sec)
+            return
+        with self._cond:
+            self._stats["inserted"] += inserted
+            self._stats["flushes"] += 1
+            self._stats["lastFlushMs"] = round((time.monotonic() - started) * 1000, 1)
+
+    def _replay_spill(self) -> None:
+        """把溢出文件改名后整体回放；回放期间的新溢出写入新文件。"""
+        if not self.spill_path:
+            return
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        rows = []
+        with open(replay_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(tuple(json.loads(line)))
+                except Exception:
+                    continue
+        try:
+            inserted = insert_rows(rows)
+        except Exception:
+            traceback.print_exc()
+            with self._cond:
+                self._stats["flushErrors"] += 1
+            return
+        os.remove(replay_path)
+        with self._cond:
+            self._stats["replayed"] += len(rows)
+            self._stats["inserted"] += inserted
+        print(f"[INFO] telemetry_buffer replayed spill rows={len(rows)} inserted={inserted}")
+
+    def shutdown(self, timeout_sec: float = 10.0) -> None:
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout=timeout_sec)
+        # flusher 未能及时退出时，剩余事件落到溢出文件，避免丢失
+        with self._cond:
+            leftover = list(self._queue)
+            self._queue.clear()
+        if leftover:
+            if self.spill_path:
+                self._spill(leftover)
+            else:
+                insert_rows(leftover)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "maxEvents": self.max_events,
+                "flushBatch": self.flush_batch,
+                "flushIntervalMs": int(self.flush_interval_sec * 1000),
+                "spillPath": self.spill_path,
+                **self._stats,
+            }
+
+
+_buffer: Optional[TelemetryBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> TelemetryBuffer:
+    global _buffer
+    if _buffer is not None:
+        return _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = TelemetryBuffer(
+                flush_batch=int(os.getenv("TELEMETRY_FLUSH_BATCH", "500")),
+                flush_interval_sec=int(os.getenv("TELEMETRY_FLUSH_INTERVAL_MS", "250")) / 1000,
+                max_events=int(os.getenv("TELEMETRY_BUFFER_MAX_EVENTS", "20000")),
+                spill_path=os.getenv("TELEMETRY_SPILL_PATH", "telemetry_spill.jsonl"),
+                recent_ids=int(os.getenv("TELEMETRY_RECENT_IDS", "50000")),
+            )
+        return _buffer
+
+
+def start() -> None:
+    if enabled():
+        get_buffer().start()
+
+
+def submit(rows: list[tuple]) -> int:
+    """去重后入队，返回实际接收（新的）事件数。"""
+    buffer = get_buffer()
+    buffer.start()
+    accepted = buffer.accept(rows)
+    buffer.enqueue(accepted)
+    return len(accepted)
+
+
+def shutdown() -> None:
+    with _buffer_lock:
+        buffer = _buffer
+    if buffer is not None:
+        buffer.shutdown()
+
+
+def get_buffer_stats() -> dict:
+    with _buffer_lock:
+        buffer = _buffer
+    if buffer is None:
+        return {"enabled": enabled(), "started": False}
+    return {"enabled": enabled(), "started": True, **buffer.stats()}
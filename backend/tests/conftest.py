@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块为扁平导入（与 main.py 同目录运行），测试时把 backend/ 加入 sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc as pa_ipc
+
+import columnar_export
+import database
+from database import get_db
+
+_INSERT_SQL = """INSERT INTO telemetry_events (event_id, session_id, event_type, payload, ts_client_ms)
+   VALUES (?, 's1', 'tap', ?, 0)"""
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "storybook.db"))
+    database.init_db()
+
+
+def _insert(event_id: str, payload: dict) -> None:
+    with get_db() as db:
+        db.execute(_INSERT_SQL, (event_id, json.dumps(payload)))
+
+
+def _read(path: str):
+    try:
+        with pa.memory_map(path) as source:
+            return pa_ipc.open_file(source).read_all()
+    finally:
+        os.remove(path)
+
+
+def test_rows_written_after_column_scan_wait_for_next_export(temp_db, monkeypatch):
+    _insert("e1", {"n": 1})
+    scan = columnar_export._payload_columns
+
+    def scan_then_insert(*args, **kwargs):
+        columns = scan(*args, **kwargs)
+        # 列扫描之后、分页读取之前写入类型冲突且带新键的行
+        _insert("e2", {"n": "oops", "newkey": 5})
+        return columns
+
+    monkeypatch.setattr(columnar_export, "_payload_columns", scan_then_insert)
+    path, info = columnar_export.export_table("telemetry", "arrow")
+    table = _read(path)
+    assert table.column("event_id").to_pylist() == ["e1"]
+    assert table.column("payload.n").to_pylist() == [1]
+    assert info["has_more"] is False
+
+    monkeypatch.setattr(columnar_export, "_payload_columns", scan)
+    path, info = columnar_export.export_table("telemetry", "arrow", after_rowid=info["watermark"])
+    table = _read(path)
+    assert table.column("event_id").to_pylist() == ["e2"]
+    assert table.column("payload.n").to_pylist() == ["oops"]
+    assert table.column("payload.newkey").to_pylist() == [5]
+
+
+def test_column_scan_is_limited_to_exported_rows(temp_db):
+    _insert("e1", {"a": 1})
+    _insert("e2", {"b": 2})
+    path, info = columnar_export.export_table("telemetry", "arrow", max_rows=1)
+    table = _read(path)
+    assert [n for n in table.column_names if n.startswith("payload.")] == ["payload.a"]
+    assert info["rows"] == 1 and info["has_more"] is True
@@ -0,0 +1,272 @@
+"""TTS 音频的内容寻址缓存（内存 LRU + 磁盘 LRU）。
+
+key = sha256(voice, rate, text)，同一段文字只合成一次：
+- 内存层：最近使用的音频字节，总量不超过 TTS_CACHE_MEMORY_MB。
+- 磁盘层：TTS_CACHE_DIR/<key>.mp3，总量不超过 TTS_CACHE_DISK_MB，按最近访问淘汰。
+- 相同 key 的并发请求合并为一次合成（跨事件循环/线程均可等待同一个 Future）。
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+class SynthesisAborted(RuntimeError):
+    """进行中的合成被发起方放弃（非合成本身失败），等待方可重试。"""
+
+
+def cache_key(text: str, voice: str, rate: str) -> str:
+    raw = "\x00".join([voice, rate, text]).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def is_valid_key(key: str) -> bool:
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+
+class TTSCache:
+    def __init__(self, directory: str, *, memory_max_bytes: int, disk_max_bytes: int):
+        self.directory = directory
+        self.memory_max_bytes = max(0, memory_max_bytes)
+        self.disk_max_bytes = max(0, disk_max_bytes)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # key → size，按访问顺序
+        self._disk_bytes = 0
+        self._inflight: dict[str, concurrent.futures.Future] = {}
+        self._stats = {
+            "memoryHits": 0,
+            "diskHits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "synthesized": 0,
+            "failures": 0,
+            "evictedMemory": 0,
+            "evictedDisk": 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._scan_disk()
+
+    # ── 磁盘层 ──────────────────────────────────────────────
+    def _scan_disk(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext != ".mp3" or not is_valid_key(key):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, key, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _write_disk(self, key: str, audio: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, self.path_for(key))
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_bytes += len(audio)
+            self._disk.move_to_end(key)
+            victims = self._evict_disk_locked(keep=key)
+        for victim in victims:
+            try:
+                os.remove(self.path_for(victim))
+            except FileNotFoundError:
+                pass
+
+    def _evict_disk_locked(self, keep: str) -> list[str]:
+        victims = []
+        while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+            key, size = next(iter(self._disk.items()))
+            if key == keep:
+                break
+            del self._disk[key]
+            self._disk_bytes -= size
+            self._stats["evictedDisk"] += 1
+            victims.append(key)
+        return victims
+
+    def _touch_disk(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._disk:
+                return False
+            self._disk.move_to_end(key)
+        try:
+            os.utime(self.path_for(key))
+        except FileNotFoundError:
+            with self._lock:
+                size = self._disk.pop(key, 0)
+                self._disk_bytes -= size
+            return False
+        return True
+
+    # ── 内存层 ──────────────────────────────────────────────
+    def _remember_locked(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self._stats["evictedMemory"] += 1
+
+    # ── 对外接口 ────────────────────────────────────────────
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._stats["memoryHits"] += 1
+            return audio
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self._get_memory(key)
+        if audio is not None:
+            return audio
+        return self._read_disk(key)
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        """get() 的异步版本：内存命中直接返回，读盘放到线程中，不阻塞事件循环。"""
+        audio = self._get_memory(key)
+        if audio is not None:
+            return audio
+        return await asyncio.to_thread(self._read_disk, key)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self._touch_disk(key):
+            return None
+        try:
+            with open(self.path_for(key), "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._stats["diskHits"] += 1
+            self._remember_locked(key, audio)
+        return audio
+
+    def has_file(self, key: str) -> bool:
+        """磁盘上有该音频（供 GET 接口直接以文件返回，支持 Range）。"""
+        return self._touch_disk(key)
+
+    def put(self, key: str, audio: bytes) -> None:
+        self._write_disk(key, audio)
+        with self._lock:
+            self._remember_locked(key, audio)
+
+    def claim(self, key: str) -> bool:
+        """尝试成为该 key 的合成方；已有进行中的合成时返回 False。
+
+        成功后调用方必须以 complete() 或 fail() 结束（流式合成边推送边缓存时使用）。
+        """
+        with self._lock:
+            if key in self._inflight:
+                return False
+            self._inflight[key] = concurrent.futures.Future()
+            self._stats["misses"] += 1
+            return True
+
+    def complete(self, key: str, audio: bytes) -> None:
+        try:
+            self.put(key, audio)
+        except OSError as e:
+            # 写盘失败不影响本次及等待中的请求拿到音频
+            print(f"[WARN] tts_cache write failed key={key}: {e}")
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            self._stats["synthesized"] += 1
+        if future is not None:
+            future.set_result(audio)
+
+    def fail(self, key: str, error: BaseException) -> None:
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            self._stats["failures"] += 1
+        if future is not None:
+            future.set_exception(error)
+
+    async def get_or_synthesize(self, key: str, synthesize: Callable[[], Awaitable[bytes]]) -> tuple[bytes, bool]:
+        """返回 (audio, 是否命中缓存)。同 key 并发调用只执行一次 synthesize。"""
+        while True:
+            audio = await self.aget(key)
+            if audio is not None:
+                return audio, True
+            if self.claim(key):
+                break
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is not None:
+                    self._stats["coalesced"] += 1
+            if future is None:
+                continue
+            try:
+                return await asyncio.wrap_future(future), True
+            except SynthesisAborted:
+                # 发起方中途放弃（如流式请求的客户端断开），由本请求重新合成
+                continue
+        try:
+            audio = await synthesize()
+        except BaseException as e:
+            # 发起方被取消时，等待中的请求收到 SynthesisAborted 后自行重试
+            self.fail(key, SynthesisAborted("TTS 合成被取消") if isinstance(e, asyncio.CancelledError) else e)
+            raise
+        await asyncio.to_thread(self.complete, key, audio)
+        return audio, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "memoryEntries": len(self._memory),
+                "memoryBytes": self._memory_bytes,
+                "memoryMaxBytes": self.memory_max_bytes,
+                "diskEntries": len(self._disk),
+                "diskBytes": self._disk_bytes,
+                "diskMaxBytes": self.disk_max_bytes,
+                "inflight": len(self._inflight),
+                **self._stats,
+            }
+
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TTSCache:
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache(
+                os.getenv("TTS_CACHE_DIR", "static/tts"),
+                memory_max_bytes=int(float(os.getenv("TTS_CACHE_MEMORY_MB", "32")) * 1024 * 1024),
+                disk_max_bytes=int(float(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024),
+            )
+        return _cache
+
+
+def get_cache_stats() -> dict:
+    with _cache_lock:
+        cache = _cache
+    if cache is None:
+        return {"started": False}
+    return {"started": True, **cache.stats()}
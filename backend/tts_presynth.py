@@ -0,0 +1,179 @@
+"""文案定稿后整本预合成朗读音频，播放时只需按 URL 取静态文件。
+
+每页合成：正文 text、互动提示 instruction、选择题选项 choices、互动后的鼓励语
+encouragement；书末合成 ending.positive_feedback。文本拼接方式与前端 Reader 朗读
+时一致，因此即使前端未拿到 URL，POST /api/v1/tts 也会命中同一条缓存。
+
+所有故事共用一个后台事件循环线程，TTS_PRESYNTH_CONCURRENCY 限制同时进行的
+edge-tts 合成数，避免与交互路径上的实时合成抢资源。TTS_PRESYNTH=0 关闭。
+"""
+import asyncio
+import os
+import threading
+import traceback
+from typing import Callable, Optional
+
+from routers.tts import DEFAULT_VOICE, audio_url, get_or_synthesize
+
+PAGE_SEGMENTS = ("text", "instruction", "choices", "encouragement")
+ENDING_SEGMENTS = ("positive_feedback",)
+
+# (page_index 或 None 表示书末, segment, url)
+OnAudio = Callable[[Optional[int], str, str], None]
+
+
+def enabled() -> bool:
+    return os.getenv("TTS_PRESYNTH", "1").strip().lower() not in ("0", "false", "no")
+
+
+def reader_voice(draft: dict) -> str:
+    """与前端 Reader 的选择一致：男孩用男声，其余用默认女声。"""
+    profile = draft.get("child_profile") if isinstance(draft.get("child_profile"), dict) else {}
+    gender = str(profile.get("gender") or "").lower()
+    return "zhishuo" if gender == "male" else DEFAULT_VOICE
+
+
+def page_segments(page: dict) -> dict[str, str]:
+    segments: dict[str, str] = {}
+    text = page.get("text")
+    if isinstance(text, str) and text.strip():
+        segments["text"] = text
+    interaction = page.get("interaction") if isinstance(page.get("interaction"), dict) else {}
+    if interaction.get("type") not in (None, "none"):
+        instruction = interaction.get("instruction")
+        if isinstance(instruction, str) and instruction.strip():
+            segments["instruction"] = instruction
+        choices = page.get("branch_choices") if isinstance(page.get("branch_choices"), list) else []
+        labels = [c.get("label") for c in choices if isinstance(c, dict) and c.get("label")]
+        if interaction.get("type") == "choice" and labels:
+            segments["choices"] = "。".join(f"选项{i + 1}：{label}" for i, label in enumerate(labels)) + "。"
+        ext = interaction.get("ext") if isinstance(interaction.get("ext"), dict) else {}
+        encouragement = ext.get("encouragement")
+        if isinstance(encouragement, str) and encouragement.strip():
+            segments["encouragement"] = encouragement
+    return segments
+
+
+def ending_segments(draft: dict) -> dict[str, str]:
+    ending = draft.get("ending") if isinstance(draft.get("ending"), dict) else {}
+    feedback = ending.get("positive_feedback")
+    if isinstance(feedback, str) and feedback.strip():
+        return {"positive_feedback": feedback}
+    return {}
+
+
+class PresynthPipeline:
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._loop = asyncio.new_event_loop()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="tts-presynth", daemon=True)
+        self._stats = {
+            "storiesQueued": 0,
+            "storiesDone": 0,
+            "segmentsPending": 0,
+            "segmentsDone": 0,
+            "segmentsCached": 0,
+            "segmentsFailed": 0,
+        }
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._loop.run_forever()
+
+    def _bump(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += delta
+
+    async def _segment(self, story_id: str, voice: str, page_index: Optional[int], segment: str,
+                       text: str, on_audio: OnAudio) -> None:
+        try:
+            async with self._semaphore:
+                key, _, hit = await get_or_synthesize(text, voice)
+            await asyncio.to_thread(on_audio, page_index, segment, audio_url(key))
+            self._bump("segmentsCached" if hit else "segmentsDone")
+        except Exception as e:
+            self._bump("segmentsFailed")
+            print(f"[WARN] tts presynth failed story_id={story_id} page={page_index} segment={segment}: {e}")
+        finally:
+            self._bump("segmentsPending", -1)
+
+    async def _story(self, story_id: str, voice: str, jobs: list[tuple[Optional[int], str, str]],
+                     on_audio: OnAudio) -> None:
+        await asyncio.gather(*(
+            self._segment(story_id, voice, page_index, segment, text, on_audio)
+            for page_index, segment, text in jobs
+        ))
+        self._bump("storiesDone")
+        print(f"[INFO] tts presynth done story_id={story_id} segments={len(jobs)}")
+
+    def submit(self, story_id: str, draft: dict, on_audio: OnAudio) -> int:
+        """按页序排入本书全部片段（正文优先于互动提示），返回片段数。"""
+        voice = reader_voice(draft)
+        pages = draft.get("pages") if isinstance(draft.get("pages"), list) else []
+        per_page = [page_segments(p) if isinstance(p, dict) else {} for p in pages]
+        jobs: list[tuple[Optional[int], str, str]] = []
+        for segment in PAGE_SEGMENTS:
+            for index, segments in enumerate(per_page):
+                if segment in segments:
+                    jobs.append((index, segment, segments[segment]))
+        for segment, text in ending_segments(draft).items():
+            jobs.append((None, segment, text))
+        if not jobs:
+            return 0
+        with self._lock:
+            self._stats["storiesQueued"] += 1
+            self._stats["segmentsPending"] += len(jobs)
+        asyncio.run_coroutine_threadsafe(self._story(story_id, voice, jobs, on_audio), self._loop)
+        return len(jobs)
+
+    def shutdown(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"concurrency": self.concurrency, **self._stats}
+
+
+_pipeline: Optional[PresynthPipeline] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> PresynthPipeline:
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = PresynthPipeline(int(os.getenv("TTS_PRESYNTH_CONCURRENCY", "2")))
+        return _pipeline
+
+
+def schedule_story(story_id: str, draft: dict, on_audio: OnAudio) -> int:
+    if not enabled():
+        return 0
+    try:
+        return get_pipeline().submit(story_id, draft, on_audio)
+    except Exception:
+        traceback.print_exc()
+        return 0
+
+
+def shutdown() -> None:
+    global _pipeline
+    with _pipeline_lock:
+        pipeline, _pipeline = _pipeline, None
+    if pipeline is not None:
+        pipeline.shutdown()
+
+
+def get_presynth_stats() -> dict:
+    with _pipeline_lock:
+        pipeline = _pipeline
+    if pipeline is None:
+        return {"enabled": enabled(), "started": False}
+    return {"enabled": enabled(), "started": True, **pipeline.stats()}
@@ -0,0 +1,294 @@
+"""上游 OpenAI 兼容接口的共享 HTTP 层（插图、反馈话术、语音转写）。
+
+- 每个上游 base URL（scheme://host）复用一个 httpx 客户端，保持 keep-alive 连接池，
+  避免每次调用重新建立 TCP/TLS 连接。同步调用（插图线程、反馈话术）与异步调用
+  （转写）各有一组客户端。
+- 统一的重试退避：连接错误、超时、429 与 5xx 按 STORYTEXT_OPENAI_BACKOFF_SEC 起、
+  每次翻倍、不超过 STORYTEXT_OPENAI_BACKOFF_MAX_SEC 等待后重试；有 Retry-After 时优先使用。
+  重试次数为 UPSTREAM_HTTP_MAX_RETRIES（默认 2）。
+- 每个上游记录请求数、重试数、按类型的错误数与延迟直方图，见 get_upstream_stats()。
+"""
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+
+class UpstreamError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None, body: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+def auth_headers(uri: str, api_key: str) -> dict[str, str]:
+    """Azure OpenAI 用 api-key 头，其余 OpenAI 兼容服务用 Bearer。"""
+    if "openai.azure.com" in uri:
+        return {"api-key": api_key}
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def upstream_key(uri: str) -> str:
+    parsed = urlparse(uri)
+    return f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else uri
+
+
+def _max_retries() -> int:
+    return max(0, int(os.getenv("UPSTREAM_HTTP_MAX_RETRIES", "2")))
+
+
+def _backoff_sec(attempt: int, retry_after: Optional[float]) -> float:
+    cap = float(os.getenv("STORYTEXT_OPENAI_BACKOFF_MAX_SEC", "60"))
+    if retry_after is not None and retry_after > 0:
+        return min(retry_after, cap)
+    base = float(os.getenv("STORYTEXT_OPENAI_BACKOFF_SEC", "2"))
+    return min(base * (2 ** attempt), cap)
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return float(resp.headers.get("Retry-After") or 0) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def _limits() -> httpx.Limits:
+    max_connections = max(1, int(os.getenv("UPSTREAM_HTTP_MAX_CONNECTIONS", "16")))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=float(os.getenv("UPSTREAM_HTTP_KEEPALIVE_SEC", "90")),
+    )
+
+
+# ── 统计 ────────────────────────────────────────────────────
+class _UpstreamStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors: dict[str, int] = {}
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum_ms = 0.0
+
+    def observe(self, elapsed_ms: float, error: Optional[str]) -> None:
+        self.requests += 1
+        self.latency_sum_ms += elapsed_ms
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def snapshot(self) -> dict:
+        histogram = {f"le_{b}": n for b, n in zip(LATENCY_BUCKETS_MS, self.latency_counts)}
+        histogram["le_inf"] = self.latency_counts[-1]
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": dict(self.errors),
+            "avgLatencyMs": round(self.latency_sum_ms / self.requests, 1) if self.requests else 0,
+            "latencyMs": histogram,
+        }
+
+
+_stats_lock = threading.Lock()
+_stats: dict[str, _UpstreamStats] = {}
+
+
+def _error_kind(status: Optional[int], exc: Optional[BaseException]) -> Optional[str]:
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.TransportError):
+        return "connect"
+    if exc is not None:
+        return "other"
+    if status is None or status < 400:
+        return None
+    if status == 429:
+        return "http_429"
+    return "http_5xx" if status >= 500 else "http_4xx"
+
+
+def _observe(key: str, started: float, status: Optional[int], exc: Optional[BaseException]) -> None:
+    elapsed_ms = (time.monotonic() - started) * 1000
+    with _stats_lock:
+        _stats.setdefault(key, _UpstreamStats()).observe(elapsed_ms, _error_kind(status, exc))
+
+
+def _count_retry(key: str) -> None:
+    with _stats_lock:
+        _stats.setdefault(key, _UpstreamStats()).retries += 1
+
+
+def get_upstream_stats() -> dict:
+    with _stats_lock:
+        upstreams = {key: s.snapshot() for key, s in _stats.items()}
+    with _clients_lock:
+        clients = {"sync": len(_clients), "async": len(_async_clients)}
+    return {"clients": clients, "maxRetries": _max_retries(), "upstreams": upstreams}
+
+
+# ── 客户端池 ────────────────────────────────────────────────
+_clients_lock = threading.Lock()
+_clients: dict[str, httpx.Client] = {}
+_async_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(uri: str) -> httpx.Client:
+    key = upstream_key(uri)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = httpx.Client(limits=_limits())
+        return client
+
+
+def get_async_client(uri: str) -> httpx.AsyncClient:
+    """异步客户端绑定创建时的事件循环，只在主事件循环（路由处理函数）中使用。"""
+    key = upstream_key(uri)
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = _async_clients[key] = httpx.AsyncClient(limits=_limits())
+        return client
+
+
+def close_clients() -> None:
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients() -> None:
+    with _clients_lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+# ── 请求 ────────────────────────────────────────────────────
+def _rewind_files(files: Any) -> None:
+    """重试前把上传的文件对象倒回开头。"""
+    values = files.values() if isinstance(files, dict) else [f[1] for f in files or []]
+    for value in values:
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+
+
+def _failed(label: str, resp: httpx.Response) -> UpstreamError:
+    return UpstreamError(f"{label} request failed ({resp.status_code}): {resp.text}", resp.status_code, resp.text)
+
+
+def request(
+    method: str,
+    uri: str,
+    *,
+    api_key: Optional[str] = None,
+    timeout: float = 60,
+    label: str = "upstream",
+    throttle: Optional[Callable[[], None]] = None,
+    on_rate_limited: Optional[Callable[[Optional[float]], None]] = None,
+    retries: Optional[int] = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """发送请求并按统一策略重试；最终仍失败时抛出 UpstreamError。
+
+    throttle 在每次尝试前调用（如插图调度器的令牌桶）；on_rate_limited 在上游 429 时
+    以 Retry-After 秒数调用。retries 缺省为 UPSTREAM_HTTP_MAX_RETRIES；调用方自己有重试循环时
+    传 0，避免两层重试叠加。
+    """
+    key = upstream_key(uri)
+    client = get_client(uri)
+    headers = {**(auth_headers(uri, api_key) if api_key else {}), **kwargs.pop("headers", {})}
+    retries = _max_retries() if retries is None else max(0, retries)
+    for attempt in range(retries + 1):
+        if attempt:
+            _rewind_files(kwargs.get("files"))
+        if throttle is not None:
+            throttle()
+        started = time.monotonic()
+        try:
+            resp = client.request(method, uri, headers=headers, timeout=timeout, **kwargs)
+        except httpx.HTTPError as e:
+            _observe(key, started, None, e)
+            if attempt >= retries:
+                raise UpstreamError(f"{label} request failed: {e!r}") from e
+            delay = _backoff_sec(attempt, None)
+        else:
+            _observe(key, started, resp.status_code, None)
+            if resp.status_code < 400:
+                return resp
+            retry_after = _retry_after(resp)
+            if resp.status_code == 429 and on_rate_limited is not None:
+                on_rate_limited(retry_after)
+            if resp.status_code not in RETRY_STATUS or attempt >= retries:
+                raise _failed(label, resp)
+            delay = _backoff_sec(attempt, retry_after)
+        _count_retry(key)
+        print(f"[WARN] {label} retry {attempt + 1}/{retries} in {delay:.1f}s uri={key}")
+        time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+async def arequest(
+    method: str,
+    uri: str,
+    *,
+    api_key: Optional[str] = None,
+    timeout: float = 60,
+    label: str = "upstream",
+    retries: Optional[int] = None,
+    retry_timeouts: bool = True,
+    **kwargs: Any,
+) -> httpx.Response:
+    """request() 的异步版本（不含限速钩子）。
+
+    retries 同 request()；retry_timeouts=False 时超时直接失败（大文件上传等单次就可能耗满
+    timeout 的请求，重试会成倍占用调用方的并发名额）。
+    """
+    key = upstream_key(uri)
+    client = get_async_client(uri)
+    headers = {**(auth_headers(uri, api_key) if api_key else {}), **kwargs.pop("headers", {})}
+    retries = _max_retries() if retries is None else max(0, retries)
+    for attempt in range(retries + 1):
+        if attempt:
+            _rewind_files(kwargs.get("files"))
+        started = time.monotonic()
+        try:
+            resp = await client.request(method, uri, headers=headers, timeout=timeout, **kwargs)
+        except httpx.HTTPError as e:
+            _observe(key, started, None, e)
+            if attempt >= retries or (not retry_timeouts and isinstance(e, httpx.TimeoutException)):
+                raise UpstreamError(f"{label} request failed: {e!r}") from e
+            delay = _backoff_sec(attempt, None)
+        else:
+            _observe(key, started, resp.status_code, None)
+            if resp.status_code < 400:
+                return resp
+            if resp.status_code not in RETRY_STATUS or attempt >= retries:
+                raise _failed(label, resp)
+            delay = _backoff_sec(attempt, _retry_after(resp))
+        _count_retry(key)
+        print(f"[WARN] {label} retry {attempt + 1}/{retries} in {delay:.1f}s uri={key}")
+        await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def post_json(uri: str, payload: dict, api_key: str, **kwargs: Any) -> dict:
+    resp = request("POST", uri, api_key=api_key, json=payload, **kwargs)
+    return json.loads(resp.content) if resp.content else {}
+
+
+def get_bytes(uri: str, **kwargs: Any) -> bytes:
+    return request("GET", uri, **kwargs).content
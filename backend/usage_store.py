@@ -0,0 +1,86 @@
+"""LLM token 用量的持久化与汇总（llm_usage 表，见 database._MIGRATIONS v4）。
+
+每次调用写一行（调用量小，直接短事务写入）；写库失败只打印日志，不影响生成。
+get_usage_stats() 为进程启动以来按调用类型的累计值，summarize() 从表中按时间窗口汇总，
+两者都给出 cachedRatio = cached_tokens / prompt_tokens，用于观察上游 prompt 缓存命中率。
+"""
+import threading
+from typing import Any, Optional
+
+from database import get_db, get_read_db
+
+_INSERT_SQL = """INSERT INTO llm_usage
+   (kind, model, story_id, prompt_tokens, cached_tokens, completion_tokens, latency_ms)
+   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+_lock = threading.Lock()
+_totals: dict[str, dict[str, float]] = {}
+
+
+def _ratio(cached: float, prompt: float) -> float:
+    return round(cached / prompt, 4) if prompt else 0.0
+
+
+def record(usage: dict[str, Any], story_id: Optional[str] = None) -> None:
+    kind = str(usage.get("kind") or "unknown")
+    row = (
+        kind,
+        usage.get("model") or "",
+        story_id,
+        int(usage.get("prompt_tokens") or 0),
+        int(usage.get("cached_tokens") or 0),
+        int(usage.get("completion_tokens") or 0),
+        float(usage.get("latency_ms") or 0),
+    )
+    with _lock:
+        totals = _totals.setdefault(
+            kind, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0}
+        )
+        totals["calls"] += 1
+        totals["prompt_tokens"] += row[3]
+        totals["cached_tokens"] += row[4]
+        totals["completion_tokens"] += row[5]
+        totals["latency_ms"] += row[6]
+    try:
+        with get_db() as db:
+            db.execute(_INSERT_SQL, row)
+    except Exception as e:
+        print(f"[WARN] llm_usage write failed kind={kind}: {e}")
+
+
+def _summary(calls: float, prompt: float, cached: float, completion: float, latency_ms: float) -> dict:
+    return {
+        "calls": int(calls),
+        "promptTokens": int(prompt),
+        "cachedTokens": int(cached),
+        "completionTokens": int(completion),
+        "cachedRatio": _ratio(cached, prompt),
+        "avgLatencyMs": round(latency_ms / calls, 1) if calls else 0,
+    }
+
+
+def get_usage_stats() -> dict:
+    with _lock:
+        return {
+            kind: _summary(t["calls"], t["prompt_tokens"], t["cached_tokens"], t["completion_tokens"], t["latency_ms"])
+            for kind, t in _totals.items()
+        }
+
+
+def summarize(days: int = 7) -> dict:
+    """最近 days 天按调用类型汇总。"""
+    with get_read_db() as db:
+        rows = db.execute(
+            """SELECT kind, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt, SUM(cached_tokens) AS cached,
+                      SUM(completion_tokens) AS completion, SUM(latency_ms) AS latency
+               FROM llm_usage WHERE created_at >= datetime('now', ?)
+               GROUP BY kind ORDER BY kind""",
+            (f"-{max(1, int(days))} days",),
+        ).fetchall()
+    return {
+        "days": max(1, int(days)),
+        "kinds": {
+            row["kind"]: _summary(row["calls"], row["prompt"] or 0, row["cached"] or 0, row["completion"] or 0, row["latency"] or 0)
+            for row in rows
+        },
+    }
@@ -0,0 +1,28 @@
+import type { ImageRenditions } from '@/types/story';
+
+interface StoryPictureProps {
+  src: string;
+  renditions?: ImageRenditions;
+  alt: string;
+  className?: string;
+  sizes?: string;
+}
+
+function srcSet(variants?: Record<string, string>): string | undefined {
+  if (!variants) return undefined;
+  const entries = Object.entries(variants).sort((a, b) => Number(a[0]) - Number(b[0]));
+  return entries.length ? entries.map(([width, url]) => `${url} ${width}w`).join(', ') : undefined;
+}
+
+/** 插图：优先 AVIF / WebP 派生版本并按显示宽度选尺寸，不支持时回落到原图 PNG */
+export function StoryPicture({ src, renditions, alt, className, sizes = '100vw' }: StoryPictureProps) {
+  const avif = srcSet(renditions?.avif);
+  const webp = srcSet(renditions?.webp);
+  return (
+    <picture>
+      {avif && <source type="image/avif" srcSet={avif} sizes={sizes} />}
+      {webp && <source type="image/webp" srcSet={webp} sizes={sizes} />}
+      <img src={src} alt={alt} className={className} decoding="async" />
+    </picture>
+  );
+}
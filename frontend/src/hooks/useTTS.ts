@@ -24,7 +24,6 @@ export function useTTS() {
   const [isSupported] = useState(() => !!window.speechSynthesis || typeof Audio !== 'undefined');
   const [isSpeaking, setIsSpeaking] = useState(false);
   const audioRef = useRef<HTMLAudioElement | null>(null);
-  const objectUrlRef = useRef<string | null>(null);
   const zhVoiceRef = useRef<SpeechSynthesisVoice | null>(null);
 
   useEffect(() => {
@@ -36,57 +35,47 @@ export function useTTS() {
     };
   }, []);
 
-  const _revokeUrl = () => {
-    if (objectUrlRef.current) {
-      URL.revokeObjectURL(objectUrlRef.current);
-      objectUrlRef.current = null;
-    }
-  };
-
   const stop = useCallback(() => {
     if (audioRef.current) {
       audioRef.current.pause();
       audioRef.current = null;
     }
-    _revokeUrl();
     window.speechSynthesis?.cancel();
     setIsSpeaking(false);
   }, []);
 
-  const speak = useCallback(async (text: string, voice = 'zhimiao', onEnd?: () => void) => {
+  const speak = useCallback(async (text: string, voice = 'zhimiao', onEnd?: () => void, audioUrl?: string) => {
     // 停止当前播放
     if (audioRef.current) {
       audioRef.current.pause();
       audioRef.current = null;
     }
-    _revokeUrl();
     window.speechSynthesis?.cancel();
     setIsSpeaking(true);
 
-    // 优先使用后端 edge-tts（自然人声）
-    try {
-      const res = await fetch(`${BASE_URL}/api/v1/tts`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text, voice }),
-      });
-      if (res.ok) {
-        const blob = await res.blob();
-        const url = URL.createObjectURL(blob);
-        objectUrlRef.current = url;
-        const audio = new Audio(url);
+    // 依次尝试：预合成音频（静态文件）→ 后端流式合成（边下边播）
+    const sources = [
+      ...(audioUrl ? [`${BASE_URL}${audioUrl}`] : []),
+      `${BASE_URL}/api/v1/tts/stream?${new URLSearchParams({ text, voice })}`,
+    ];
+    for (const src of sources) {
+      const audio = new Audio(src);
+      try {
         audioRef.current = audio;
         audio.onended = () => {
           setIsSpeaking(false);
-          _revokeUrl();
           onEnd?.();
         };
         audio.onerror = () => setIsSpeaking(false);
         await audio.play();
         return;
+      } catch {
+        audio.onended = null;
+        audio.onerror = null;
+        // 等待期间已被 stop() 或新的 speak() 取代：不再降级
+        if (audioRef.current !== audio) return;
+        audioRef.current = null;
       }
-    } catch {
-      // 降级到浏览器 TTS
     }
 
     // 降级：Web Speech API（尽量选较自然的中文声音）
@@ -107,7 +96,6 @@ export function useTTS() {
   // 组件卸载时清理
   useEffect(() => () => {
     if (audioRef.current) audioRef.current.pause();
-    _revokeUrl();
     window.speechSynthesis?.cancel();
   }, []);
 
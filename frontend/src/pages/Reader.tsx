@@ -5,6 +5,7 @@ import { SpeakerHigh, SpeakerSlash, CaretRight, CaretLeft, SignOut, Warning } fr
 import { InteractionLayer } from '@/components/InteractionLayer';
 import { FeedbackModal, type FeedbackDoneData } from '@/components/FeedbackModal';
 import RegenModal, { POST_COMPLETE_REGEN_PAYLOAD_KEY } from '@/components/RegenModal';
+import { StoryPicture } from '@/components/StoryPicture';
 import { useSession } from '@/hooks/useSession';
 import { useTelemetry } from '@/hooks/useTelemetry';
 import { useTTS } from '@/hooks/useTTS';
@@ -107,13 +108,18 @@ export default function ReaderPage() {
           const optionsText = p.branch_choices
             .map((c, idx) => `选项${idx + 1}：${c.label}`)
             .join('。');
-          tts.speak(instruction, readerVoice, () => tts.speak(`${optionsText}。`, readerVoice));
+          tts.speak(
+            instruction,
+            readerVoice,
+            () => tts.speak(`${optionsText}。`, readerVoice, undefined, p.audio?.choices),
+            p.audio?.instruction,
+          );
           return;
         }
-        tts.speak(instruction, readerVoice);
+        tts.speak(instruction, readerVoice, undefined, p.audio?.instruction);
       }
       : undefined;
-    tts.speak(p.text, readerVoice, onEnd);
+    tts.speak(p.text, readerVoice, onEnd, p.audio?.text);
   }, [tts, readerVoice]);
 
   useEffect(() => {
@@ -421,10 +427,12 @@ export default function ReaderPage() {
             >
               {currentImageUrl ? (
                 /* 真实插图 */
-                <img
+                <StoryPicture
                   src={currentImageUrl}
+                  renditions={page.renditions?.[showInteractionFrame ? 'interaction_image_url' : 'image_url']}
                   alt={page.image_prompt}
                   className="w-full h-full object-cover rounded-[2rem]"
+                  sizes="58vw"
                 />
               ) : (
                 <div className="absolute inset-0 flex items-center justify-center">
@@ -58,6 +58,17 @@ export interface BranchChoice {
   next_page_id: string;
 }
 
+// 预合成朗读音频的 URL（后端 /api/v1/tts/audio/{key}.mp3），未就绪时缺省
+export interface PageAudio {
+  text?: string;
+  instruction?: string;
+  choices?: string;
+  encouragement?: string;
+}
+
+// 插图派生版本：格式 → 宽度（px，字符串）→ URL，由后端在插图落盘后生成（需 Pillow），缺省时用原图
+export type ImageRenditions = Partial<Record<'avif' | 'webp', Record<string, string>>>;
+
 export interface Page {
   page_no: number;
   page_id: string;
@@ -68,6 +79,8 @@ export interface Page {
   interaction_image_url?: string;
   interaction: Interaction;
   branch_choices: BranchChoice[];
+  audio?: PageAudio;
+  renditions?: { image_url?: ImageRenditions; interaction_image_url?: ImageRenditions };
 }
 
 export interface BookMeta {
@@ -85,6 +98,7 @@ export interface Ending {
   positive_feedback: string;
   next_micro_goal: string;
   post_read_task?: string;
+  audio?: { positive_feedback?: string };
 }
 
 export interface TelemetrySuggestions {
@@ -0,0 +1,189 @@
+"""
+Benchmark storybook.db query paths with and without the indexes added by the
+versioned migrations in backend/database.py.
+
+Builds a throwaway database (default 1M telemetry rows), runs the hot queries
+used by session_start / export / admin stats, then drops the migration indexes
+and runs them again.
+
+Usage:
+  python scripts/bench_db_indexes.py                 # 1,000,000 telemetry rows
+  python scripts/bench_db_indexes.py --rows 200000 --keep /tmp/bench.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import database  # noqa: E402
+
+EVENT_TYPES = ["page_view", "page_dwell", "interaction", "branch_select", "story_complete", "audio_play"]
+
+QUERIES = {
+    "session_start count by child": (
+        "SELECT COUNT(*) FROM sessions WHERE child_id = ?",
+        lambda ctx: (random.choice(ctx["children"]),),
+    ),
+    "export_child_data join": (
+        """SELECT s.session_index, s.session_id, st.title, f.status, sus.sus_score
+           FROM sessions s
+           LEFT JOIN stories st ON s.story_id = st.story_id
+           LEFT JOIN feedback f ON s.session_id = f.session_id
+           LEFT JOIN sus_responses sus ON s.session_id = sus.session_id
+           WHERE s.child_id = ? ORDER BY s.session_index""",
+        lambda ctx: (random.choice(ctx["children"]),),
+    ),
+    "telemetry by session": (
+        "SELECT COUNT(*), MAX(ts_client_ms) FROM telemetry_events WHERE session_id = ?",
+        lambda ctx: (random.choice(ctx["sessions"]),),
+    ),
+    "telemetry group by event_type": (
+        "SELECT event_type, COUNT(*) FROM telemetry_events GROUP BY event_type",
+        lambda ctx: (),
+    ),
+    "telemetry stats summary": (
+        "SELECT COUNT(*), COUNT(DISTINCT session_id), AVG(ts_client_ms) FROM telemetry_events",
+        lambda ctx: (),
+    ),
+    "admin telemetry export page (ORDER BY created_at DESC LIMIT 1000)": (
+        "SELECT * FROM telemetry_events ORDER BY created_at DESC LIMIT 1000",
+        lambda ctx: (),
+    ),
+    "admin sessions export page (ORDER BY created_at DESC LIMIT 1000)": (
+        "SELECT * FROM sessions ORDER BY created_at DESC LIMIT 1000",
+        lambda ctx: (),
+    ),
+}
+
+
+def populate(conn, rows: int, children: int, sessions: int) -> dict:
+    rng = random.Random(42)
+    child_ids = [f"child_{i}" for i in range(children)]
+    story_rows, session_rows, feedback_rows = [], [], []
+    session_ids = []
+    per_child: dict[str, int] = {}
+    for i in range(sessions):
+        child_id = rng.choice(child_ids)
+        story_id = f"st_{i:08d}"
+        session_id = f"ss_{i:08d}"
+        session_ids.append(session_id)
+        index = per_child.get(child_id, 0)
+        per_child[child_id] = index + 1
+        created = f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00"
+        story_rows.append((story_id, child_id, "{}", f"title {i}", "carrot", "light_fantasy", 12, created))
+        session_rows.append((session_id, story_id, child_id, index, uuid.uuid4().hex, created))
+        if rng.random() < 0.6:
+            feedback_rows.append((session_id, rng.choice(["COMPLETED", "ABORTED"]), "Lv2", created))
+    conn.executemany(
+        """INSERT INTO stories (story_id, child_id, story_json, title, theme_food, story_type, page_count, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        story_rows,
+    )
+    conn.executemany(
+        """INSERT INTO sessions (session_id, story_id, child_id, session_index, client_session_token, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        session_rows,
+    )
+    conn.executemany(
+        "INSERT INTO feedback (session_id, status, try_level, created_at) VALUES (?, ?, ?, ?)",
+        feedback_rows,
+    )
+
+    batch = []
+    for i in range(rows):
+        session_id = session_ids[rng.randrange(sessions)]
+        batch.append((
+            f"ev_{i:09d}",
+            session_id,
+            "st_" + session_id[3:],
+            f"p{rng.randint(1, 12)}",
+            rng.choice(EVENT_TYPES),
+            None,
+            rng.randint(100, 60000),
+            f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+        ))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO telemetry_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO telemetry_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    return {"children": child_ids, "sessions": session_ids}
+
+
+def run_queries(conn, ctx: dict, repeat: int) -> dict:
+    results = {}
+    for name, (sql, make_args) in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            args = make_args(ctx)
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        plan = " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, make_args(ctx)))
+        results[name] = (statistics.median(timings), plan)
+    return results
+
+
+def migration_indexes() -> list[str]:
+    names = []
+    for _, _, statements in database._MIGRATIONS:
+        for sql in statements:
+            if sql.startswith("CREATE INDEX IF NOT EXISTS "):
+                names.append(sql.split()[5])
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="telemetry rows")
+    parser.add_argument("--sessions", type=int, default=50_000)
+    parser.add_argument("--children", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", help="keep the generated database at this path")
+    args = parser.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(prefix="sggg_bench_"), "bench.db")
+    if os.path.exists(path):
+        os.remove(path)
+    database.DB_PATH = path
+    database.init_db()
+    database.close_pools()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    print(f"populating {path}: telemetry={args.rows:,} sessions={args.sessions:,} children={args.children:,}")
+    started = time.perf_counter()
+    ctx = populate(conn, args.rows, args.children, args.sessions)
+    conn.execute("ANALYZE")
+    print(f"populated in {time.perf_counter() - started:.1f}s")
+
+    indexed = run_queries(conn, ctx, args.repeat)
+    for name in migration_indexes():
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.execute("ANALYZE")
+    unindexed = run_queries(conn, ctx, args.repeat)
+    conn.close()
+
+    print()
+    print(f"{'query':<66} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    for name in QUERIES:
+        before, before_plan = unindexed[name]
+        after, after_plan = indexed[name]
+        speedup = before / after if after > 0 else float("inf")
+        print(f"{name:<66} {before:>12.2f} {after:>12.2f} {speedup:>8.1f}x")
+        print(f"    before: {before_plan}")
+        print(f"    after:  {after_plan}")
+
+    if not args.keep:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Measure event-loop lag in the backend while /api/v1/voice/transcribe uploads are
+in flight.
+
+Starts a local fake transcription upstream (answers after --upstream-delay
+seconds), points TRANSCIBE_OPENAI_URI at it, then fires --concurrency uploads at
+the FastAPI app in-process while a probe coroutine sleeps 10ms in a loop and
+records how late each wake-up is. A blocking upstream call shows up as lag close
+to the upstream delay; an async client keeps lag in the low milliseconds.
+
+Usage:
+  python scripts/bench_transcribe_loop_lag.py
+  python scripts/bench_transcribe_loop_lag.py --concurrency 16 --audio-kb 512
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+
+def start_fake_upstream(delay: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            else:
+                # chunked upload
+                while True:
+                    size = int(self.rfile.readline().strip() or b"0", 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    self.rfile.read(size + 2)
+            time.sleep(delay)
+            body = json.dumps({"text": "ok"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def probe(stop: asyncio.Event, lags: list[float], interval: float = 0.01) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def run(args) -> None:
+    import httpx
+    from fastapi import FastAPI
+    from routers import tts
+
+    app = FastAPI()
+    app.include_router(tts.router)
+    audio = b"\x1a\x45\xdf\xa3" + os.urandom(args.audio_kb * 1024)
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stop, lags))
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        responses = await asyncio.gather(*(
+            client.post("/api/v1/voice/transcribe", files={"file": ("a.webm", audio, "audio/webm")})
+            for _ in range(args.concurrency)
+        ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    ok = sum(1 for r in responses if r.status_code == 200)
+    lags.sort()
+    print(f"uploads={args.concurrency} ok={ok} audio={args.audio_kb}KB upstream_delay={args.upstream_delay}s")
+    print(f"wall time            {elapsed:.2f}s")
+    print(f"loop lag p50 / p99   {statistics.median(lags):.1f} / {lags[int(len(lags) * 0.99) - 1]:.1f} ms")
+    print(f"loop lag max         {lags[-1]:.1f} ms  (probe samples={len(lags)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--upstream-delay", type=float, default=0.5)
+    parser.add_argument("--audio-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    server = start_fake_upstream(args.upstream_delay)
+    os.environ["TRANSCIBE_OPENAI_URI"] = f"http://127.0.0.1:{server.server_address[1]}/v1/audio/transcriptions"
+    os.environ.setdefault("TRANSCIBE_OPENAI_API_KEY", "bench")
+    os.environ.setdefault("TRANSCIBE_OPENAI_MODEL", "bench")
+    os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="sggg_bench_tts_"))
+    asyncio.run(run(args))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
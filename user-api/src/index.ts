@@ -219,18 +219,30 @@ function extractBookMeta(content: string): { title: string; summary: string; sto
   }
 }
 
+type BackendPage = {
+  page_no?: number;
+  image_url?: unknown;
+  renditions?: { image_url?: { webp?: Record<string, string> } };
+};
+
+// 封面/书架只需小图：优先用后端派生的 512px WebP 缩略图，没有时用原图
+function pagePreviewUrl(page: BackendPage | undefined): string | null {
+  const thumb = page?.renditions?.image_url?.webp?.["512"];
+  if (typeof thumb === "string" && thumb) return thumb;
+  return typeof page?.image_url === "string" && page.image_url ? page.image_url : null;
+}
+
 async function resolvePreviewFromBackend(storyId: string): Promise<string | null> {
   try {
     const res = await fetch(`${FASTAPI_URL}/api/v1/story/${storyId}`);
     if (!res.ok) return null;
-    const data = (await res.json()) as { draft?: { pages?: Array<{ page_no?: number; image_url?: string }> } };
+    const data = (await res.json()) as { draft?: { pages?: BackendPage[] } };
     const pages = data.draft?.pages ?? [];
     if (pages.length === 0) return null;
     const allReady = pages.every((p) => typeof p.image_url === "string" && p.image_url.length > 0);
     if (!allReady) return null;
     const sorted = [...pages].sort((a, b) => (a.page_no ?? 0) - (b.page_no ?? 0));
-    const first = sorted[0];
-    return first?.image_url ?? null;
+    return pagePreviewUrl(sorted[0]);
   } catch {
     return null;
   }
@@ -240,14 +252,13 @@ async function resolveDraftFromBackendIfReady(storyId: string): Promise<{ previe
   try {
     const res = await fetch(`${FASTAPI_URL}/api/v1/story/${storyId}`);
     if (!res.ok) return null;
-    const data = (await res.json()) as { draft?: { pages?: Array<{ page_no?: number; image_url?: string }> } };
+    const data = (await res.json()) as { draft?: { pages?: BackendPage[] } };
     const pages = data.draft?.pages ?? [];
     if (pages.length === 0) return null;
     const allReady = pages.every((p) => typeof p.image_url === "string" && p.image_url.length > 0);
     if (!allReady) return null;
     const sorted = [...pages].sort((a, b) => (a.page_no ?? 0) - (b.page_no ?? 0));
-    const first = sorted[0];
-    const preview = first?.image_url ?? null;
+    const preview = pagePreviewUrl(sorted[0]);
     if (!preview) return null;
     return { preview, content: JSON.stringify(data.draft) };
   } catch {
@@ -550,6 +561,7 @@ async function generateTempBookForUser(params: {
   }
 
   const requestBody = {
+    child_id: params.userID,
     child_profile: {
       nickname: params.nickname,
       age: 5,
@@ -1452,7 +1464,7 @@ app.post("/api/book/confirm", authRequired, async (req: AuthenticatedRequest, re
       res.status(503).json({ message: "图片状态检查失败" });
       return;
     }
-    const data = (await r.json()) as { draft?: { pages?: Array<{ page_no?: number; image_url?: unknown }>; book_meta?: { title?: string; summary?: string } } };
+    const data = (await r.json()) as { draft?: { pages?: BackendPage[]; book_meta?: { title?: string; summary?: string } } };
     const pages = data.draft?.pages ?? [];
     const allReady = pages.length > 0 && pages.every((p) => typeof p.image_url === "string" && p.image_url.length > 0);
     if (!allReady) {
@@ -1460,7 +1472,7 @@ app.post("/api/book/confirm", authRequired, async (req: AuthenticatedRequest, re
       return;
     }
     const sorted = [...pages].sort((a, b) => (a.page_no ?? 0) - (b.page_no ?? 0));
-    const firstUrl = typeof sorted[0]?.image_url === "string" ? (sorted[0].image_url as string) : null;
+    const firstUrl = pagePreviewUrl(sorted[0]);
     const nextPreview = firstUrl || tempBook.preview;
     const nextTitle = data.draft?.book_meta?.title || tempBook.title;
     const nextDesc = data.draft?.book_meta?.summary || tempBook.description;